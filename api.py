@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+import io
+import json
+import zlib
+import numpy as np
+import pandas as pd
+from flask import Blueprint, Response, jsonify, request
+
+# typing imports
+from typing import Iterable, Iterator, List
+
+# local imports
+import datastore
+import engine
+import mapview
+import spatialindex
+import utils
+from logging_config import get_logger
+
+
+# instantiate logger
+logger = get_logger(__name__)
+
+
+blueprint = Blueprint("api", __name__, url_prefix="/api/v1")
+
+SPATIAL_MODELS = engine.SPATIAL_MODELS
+TEMPORAL_MODELS = engine.TEMPORAL_MODELS
+
+EXPORT_COLUMNS = [
+    "GAGEID",
+    "datetime",
+    "twsa",
+    "Q_pred",
+    "Q_pred_selmonths",
+    "Q_mon",
+    "spatial_discrepency",
+    "temporal_discrepency",
+]
+
+
+def available_regionalisation_models() -> List[str]:
+    return engine.regionalisation_models()
+
+
+def _export_frames(
+    gageids: Iterable[str],
+    reg: str,
+    spatial: str,
+    temporal: str,
+    store: datastore.GaugeDataStore,
+) -> Iterator[pd.DataFrame]:
+    for gageid in gageids:
+        res = utils.load_click(gageid, reg, spatial, temporal, store=store)
+        if res["message"] is not None:
+            logger.info(f"Export skipped: {res['message']}")
+            continue
+        df = res["discharges"]
+        df = df.assign(
+            spatial_discrepency=res["spatial_discrepency"],
+            temporal_discrepency=res["temporal_discrepency"],
+        )
+        df["datetime"] = df["datetime"].dt.strftime("%Y-%m-%d")
+        yield df[EXPORT_COLUMNS].round(6)
+
+
+def _csv_chunks(frames: Iterable[pd.DataFrame]) -> Iterator[str]:
+    yield ",".join(EXPORT_COLUMNS) + "\n"
+    for df in frames:
+        buffer = io.StringIO()
+        df.to_csv(buffer, header=False, index=False)
+        yield buffer.getvalue()
+
+
+def _ndjson_chunks(frames: Iterable[pd.DataFrame]) -> Iterator[str]:
+    for df in frames:
+        df = df.astype(object).where(df.notna(), None)
+        yield "".join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=_json_default) + "\n"
+            for row in df.itertuples(index=False, name=None)
+        )
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _gzip_chunks(chunks: Iterable[str]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@blueprint.route("/discharge")
+def discharge() -> Response:
+    """
+    Streams the discharge series of many gauges as CSV or NDJSON.
+
+    Query parameters
+    ----------------
+    gages: str
+        Comma separated GAGEIDs, or "all" for the whole gauge catalogue.
+    reg: str
+        Regionalisation model, default GP.
+    spatial: str
+        Spatial feasibility model, default XGB.
+    temporal: str
+        Temporal feasibility model, default RF.
+    format: str
+        "csv" (default) or "ndjson".
+
+    The response is generated one gauge at a time, so memory use does not
+    grow with the number of gauges. It is gzip-compressed when the client
+    accepts gzip.
+    """
+    gages = request.args.get("gages", "")
+    reg = request.args.get("reg", "GP")
+    spatial = request.args.get("spatial", "XGB")
+    temporal = request.args.get("temporal", "RF")
+    fmt = request.args.get("format", "csv").lower()
+
+    if reg not in available_regionalisation_models():
+        return jsonify(error=f"unknown regionalisation model {reg!r}"), 400
+    if spatial not in SPATIAL_MODELS:
+        return jsonify(error=f"unknown spatial feasibility model {spatial!r}"), 400
+    if temporal not in TEMPORAL_MODELS:
+        return jsonify(error=f"unknown temporal feasibility model {temporal!r}"), 400
+    if fmt not in ("csv", "ndjson"):
+        return jsonify(error=f"unknown format {fmt!r}"), 400
+
+    # one version of the datasets for the whole export, even if they are
+    # reloaded while it streams
+    store = datastore.get_store()
+    if gages.strip().lower() == "all":
+        gageids = list(store.gauge_index)
+    else:
+        gageids = [g.strip() for g in gages.split(",") if g.strip()]
+    if not gageids:
+        return jsonify(error="no gauges requested, use gages=<id>,... or gages=all"), 400
+
+    frames = _export_frames(gageids, reg, spatial, temporal, store)
+    if fmt == "csv":
+        chunks, mimetype = _csv_chunks(frames), "text/csv"
+    else:
+        chunks, mimetype = _ndjson_chunks(frames), "application/x-ndjson"
+
+    filename = f"discharge_{reg}_{spatial}_{temporal}.{fmt}"
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+    if request.accept_encodings["gzip"] > 0:
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+        return Response(_gzip_chunks(chunks), mimetype=mimetype, headers=headers)
+    return Response(chunks, mimetype=mimetype, headers=headers)
+
+
+# bounds of the gauge search queries
+MAX_NEAREST = 100
+MAX_RADIUS_KM = 2000.0
+
+
+def _gauge_records(index: np.ndarray, distances: np.ndarray) -> List[dict]:
+    points = mapview.get_map_points()
+    return [
+        dict(
+            GAGEID=str(points.gageid[i]),
+            lat=round(float(points.lat[i]), 5),
+            lon=round(float(points.lon[i]), 5),
+            area=round(float(points.area[i]), 2),
+            distance_km=round(float(d), 3),
+        )
+        for i, d in zip(index, distances)
+    ]
+
+
+def _float_arg(name: str, low: float, high: float) -> float:
+    try:
+        value = float(request.args[name])
+    except (KeyError, ValueError):
+        raise ValueError(f"{name} is required and must be a number")
+    if not low <= value <= high:
+        raise ValueError(f"{name} must be between {low} and {high}")
+    return value
+
+
+@blueprint.route("/gauges/nearest")
+def nearest_gauges() -> Response:
+    """
+    Lists the gauges nearest to a location, nearest first.
+
+    Query parameters
+    ----------------
+    lat: float
+        Latitude in degrees.
+    lon: float
+        Longitude in degrees.
+    k: int
+        Number of gauges, default 5, at most MAX_NEAREST.
+    """
+    try:
+        lat = _float_arg("lat", -90, 90)
+        lon = _float_arg("lon", -180, 180)
+        k = int(request.args.get("k", 5))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    if not 1 <= k <= MAX_NEAREST:
+        return jsonify(error=f"k must be between 1 and {MAX_NEAREST}"), 400
+
+    index, distances = spatialindex.get_index().nearest(lat, lon, k)
+    return jsonify(gauges=_gauge_records(index, distances))
+
+
+@blueprint.route("/gauges/within")
+def gauges_within() -> Response:
+    """
+    Lists the gauges within a radius of a location, nearest first.
+
+    Query parameters
+    ----------------
+    lat: float
+        Latitude in degrees.
+    lon: float
+        Longitude in degrees.
+    radius_km: float
+        Search radius in km, at most MAX_RADIUS_KM.
+    """
+    try:
+        lat = _float_arg("lat", -90, 90)
+        lon = _float_arg("lon", -180, 180)
+        radius_km = _float_arg("radius_km", 0, MAX_RADIUS_KM)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    index, distances = spatialindex.get_index().within(lat, lon, radius_km)
+    return jsonify(gauges=_gauge_records(index, distances))
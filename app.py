@@ -6,23 +6,39 @@ import time
 # local imports
 import layout
 import callbacks
+import api
+import instrumentation
 import logging_config
+import warmup
+import datawatch
 from waitress import serve
 start_time = time.time()
 
 logging_config.configure_logger()
+logger = logging_config.get_logger(__name__)
 
 app = dash.Dash(name=__name__, external_stylesheets=[dbc.themes.MINTY])
 
 server = app.server
 app.title = "Q-TWSA Tool"
 
+# Prometheus metrics of this worker process
+instrumentation.register_metrics_route(server)
+
+# bulk data API
+server.register_blueprint(api.blueprint)
+
+# readiness of this worker, see warmup.py
+warmup.register_readiness_route(server)
+
 
 # set the layouts defined in layout.py
 app.layout = layout.main
 end_time = time.time()
 
-print(f"Runtime setting map layout: {end_time - start_time} seconds")
+logger.info(f"Runtime setting map layout: {end_time - start_time} seconds")
+
+warmup.start()
 if __name__ == "__main__":
     # for available environment variables see:
     # - https://dash.plotly.com/reference#dash.dash
@@ -40,5 +56,6 @@ if __name__ == "__main__":
 
     # app.run_server(debug=True, dev_tools_silence_routes_logging=False)
     # app.run_server(debug=True)
+    datawatch.start()
     serve(app.server, host='0.0.0.0', port=10000)
 
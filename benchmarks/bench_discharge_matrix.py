@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Throughput of the vectorized discharge engine in gauges/sec.
+
+Times engine.compute_discharge_matrix over the full model table for a
+range of chunk sizes, and a per-gauge loop through utils.handle_click
+for reference.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_discharge_matrix --data-dir static/data
+"""
+
+import argparse
+import os
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--data-dir", default="static/data")
+    parser.add_argument("--model", default="GP")
+    parser.add_argument("--temporal-model", default="RF")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--loop-gauges", type=int, default=50)
+    parser.add_argument(
+        "--chunk-sizes", type=int, nargs="+", default=[256, 1024, 4096, 16384]
+    )
+    args = parser.parse_args()
+
+    os.environ["QTWSA_DATA_DIR"] = args.data_dir
+
+    # imported after QTWSA_DATA_DIR is set
+    import datastore
+    import engine
+    import utils
+
+    store = datastore.get_store()
+    n_gauges = len(store.parameters)
+
+    for chunk_size in args.chunk_sizes:
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            discharge = engine.compute_discharge_matrix(
+                args.model, temporal_model=args.temporal_model, chunk_size=chunk_size
+            )
+            best = min(best, time.perf_counter() - start)
+        print(
+            f"engine chunk={chunk_size:<6} {discharge.shape[0]}x{discharge.shape[1]} "
+            f"{best * 1e3:8.2f} ms  {n_gauges / best:12,.0f} gauges/sec"
+        )
+
+    gageids = list(store.gauge_index)[: args.loop_gauges]
+    start = time.perf_counter()
+    for gageid in gageids:
+        try:
+            utils.handle_click(gageid, args.model, "XGB", args.temporal_model)
+        except KeyError:
+            pass
+    elapsed = time.perf_counter() - start
+    print(
+        f"handle_click loop ({len(gageids)} gauges) "
+        f"{elapsed * 1e3:8.2f} ms  {len(gageids) / elapsed:12,.0f} gauges/sec"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Per-click latency of utils.handle_click.
+
+Compares a cold click, where the gauge tables are loaded for every
+request (the behaviour before GaugeDataStore), with warm clicks served
+from the process-wide store.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_handle_click --data-dir static/data --clicks 50
+"""
+
+import argparse
+import os
+import random
+import statistics
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--data-dir", default="static/data")
+    parser.add_argument("--clicks", type=int, default=50)
+    parser.add_argument("--cold-clicks", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ["QTWSA_DATA_DIR"] = args.data_dir
+
+    # imported after QTWSA_DATA_DIR is set
+    import datastore
+    import utils
+
+    gageids = list(datastore.get_store().gauge_index)
+    rng = random.Random(args.seed)
+
+    def click():
+        utils.handle_click(rng.choice(gageids), "GP", "XGB", "RF")
+
+    cold = []
+    for _ in range(args.cold_clicks):
+        datastore._store = None
+        start = time.perf_counter()
+        click()
+        cold.append(time.perf_counter() - start)
+
+    warm = []
+    for _ in range(args.clicks):
+        start = time.perf_counter()
+        click()
+        warm.append(time.perf_counter() - start)
+
+    for name, timings in (("cold", cold), ("warm", warm)):
+        print(
+            f"{name:>5}: n={len(timings):<4} "
+            f"median={statistics.median(timings) * 1e3:9.2f} ms  "
+            f"min={min(timings) * 1e3:9.2f} ms  "
+            f"max={max(timings) * 1e3:9.2f} ms"
+        )
+    print(f"speedup (median): {statistics.median(cold) / statistics.median(warm):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
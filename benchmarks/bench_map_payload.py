@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Initial map payload and build time against gauge count, "full" vs
+"viewport" map mode.
+
+The gauge catalogue is replicated with jittered coordinates to emulate
+larger catalogues.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_map_payload --scales 1 4 16
+"""
+
+import argparse
+import json
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import numpy as np
+    import pandas as pd
+    import plotly
+    import components
+    import mapview
+    import utils
+
+    rng = np.random.default_rng(args.seed)
+    map_data = utils.get_map_data()
+
+    for scale in args.scales:
+        frames = [map_data]
+        for copy in range(1, scale):
+            jittered = map_data.copy()
+            jittered["GAGEID"] = jittered["GAGEID"].astype(str) + f"_{copy}"
+            jittered["Lat"] = (jittered["Lat"] + rng.normal(0, 0.5, len(map_data))).clip(-85, 85)
+            jittered["Lon"] = jittered["Lon"] + rng.normal(0, 0.5, len(map_data))
+            frames.append(jittered)
+        data = pd.concat(frames, ignore_index=True)
+
+        for mode in ("full", "viewport"):
+            mapview._points = None
+            start = time.perf_counter()
+            graph = components.map(data, mode=mode)
+            payload = json.dumps(graph.figure, cls=plotly.utils.PlotlyJSONEncoder)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{len(data):>7} gauges {mode:>8}: "
+                f"{len(payload) / 1024:10,.1f} KiB  {elapsed * 1e3:8.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Memory and per-gauge lookup latency of the model parameter table: the
+DataFrame read from global_gauges_models.csv against the compact
+datastore.ParameterTable.
+
+Lookups read what a click needs: COMID, alpha and beta, the spatial
+group, the number of feasible months and the 12 month flags. They are
+timed for the original boolean filter on GAGEID, a row of the DataFrame
+through the GAGEID index, and a row of the ParameterTable.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_parameters --data-dir static/data
+"""
+
+import argparse
+import os
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--data-dir", default="static/data")
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import numpy as np
+    import pandas as pd
+
+    import datastore
+    import engine
+
+    models = pd.read_csv(
+        os.path.join(args.data_dir, datastore.MODELS_FILE), dtype={"GAGEID": str}
+    )
+    start = time.perf_counter()
+    table = datastore.ParameterTable(models)
+    build = time.perf_counter() - start
+    gauge_index = {}
+    for pos, gageid in enumerate(table.gageid):
+        gauge_index.setdefault(datastore.normalize_gageid(gageid), pos)
+
+    frame_bytes = models.memory_usage(deep=True).sum()
+    print(f"{len(models)} gauges, {len(models.columns)} columns")
+    print(f"    DataFrame        {frame_bytes / 2**20:8.2f} MiB")
+    print(
+        f"    ParameterTable   {table.nbytes / 2**20:8.2f} MiB "
+        f"({frame_bytes / table.nbytes:.1f}x smaller, built in {build * 1e3:.1f} ms)"
+    )
+
+    rng = np.random.default_rng(args.seed)
+    gageids = list(gauge_index)
+    sample = [gageids[i] for i in rng.integers(0, len(gageids), args.lookups)]
+    var_alpha, var_beta = engine.REGIONALISATION_COLUMNS["GP"]
+    var_sd = engine.SPATIAL_COLUMNS["XGB"]
+    var_td = engine.TEMPORAL_COLUMNS["RF"]
+    # the 12 monthly feasibility flag columns of the temporal model
+    columns_months = [f"{month}_RF" for month in datastore.MONTH_NAMES]
+
+    def filtered(gageid):
+        # the lookups of the original handle_click
+        rows = models[models["GAGEID"] == gageid]
+        return (
+            rows["COMID"].values[0], rows[var_alpha].values[0], rows[var_beta].values[0],
+            rows[var_sd].values[0], rows[var_td].values[0],
+            rows[columns_months].values[0] == 1,
+        )
+
+    def frame_row(gageid):
+        row = models.iloc[gauge_index[gageid]]
+        return (
+            row["COMID"], row[var_alpha], row[var_beta], row[var_sd], row[var_td],
+            row[columns_months].values == 1,
+        )
+
+    def table_row(gageid):
+        pos = gauge_index[gageid]
+        row = table.row(pos)
+        return (
+            row["COMID"], row[var_alpha], row[var_beta], row[var_sd], row[var_td],
+            table.predicted_months("RF", pos),
+        )
+
+    for name, lookup, n in [
+        ("DataFrame filter", filtered, max(args.lookups // 10, 1)),
+        ("DataFrame row", frame_row, args.lookups),
+        ("ParameterTable row", table_row, args.lookups),
+    ]:
+        start = time.perf_counter()
+        for gageid in sample[:n]:
+            lookup(gageid)
+        seconds = (time.perf_counter() - start) / n
+        print(f"    {name:<20} {seconds * 1e6:9.1f} us/gauge")
+
+    # the decoded flags are those of the csv
+    flags = models[columns_months].values == 1
+    assert (table.month_flags("RF") == flags).all()
+
+
+if __name__ == "__main__":
+    main()
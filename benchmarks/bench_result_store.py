@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+dcc.Store payload size and render_content latency, JSON round-trip vs
+server-side result store.
+
+"json" serializes the discharge frame into the browser store and parses
+it back with pd.read_json on every tab switch (the previous behaviour);
+"memory" and "sqlite" keep the frame in a sessionstore backend and only
+send its key.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_result_store --data-dir static/data
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--data-dir", default="static/data")
+    parser.add_argument("--gauges", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ["QTWSA_DATA_DIR"] = args.data_dir
+
+    # imported after QTWSA_DATA_DIR is set
+    import pandas as pd
+    import datastore
+    import sessionstore
+    import utils
+
+    rng = random.Random(args.seed)
+    gageids = rng.sample(list(datastore.get_store().gauge_index), args.gauges)
+    frames = {}
+    for gageid in gageids:
+        discharge = utils.handle_click(gageid, "GP", "XGB", "RF")["discharges"]
+        frames[gageid] = discharge.sort_values("datetime")
+
+    tmpdir = tempfile.mkdtemp()
+    backends = dict(
+        memory=sessionstore.MemoryResultStore(),
+        sqlite=sessionstore.SqliteResultStore(os.path.join(tmpdir, "results.sqlite")),
+    )
+
+    def render(df):
+        utils.as_timeseries_scatterplot(df)
+        utils.as_table(df)
+
+    results = {}
+    payloads, timings = [], []
+    for df in frames.values():
+        payload = json.dumps(df.to_json())
+        payloads.append(len(payload))
+        start = time.perf_counter()
+        render(pd.read_json(io.StringIO(json.loads(payload))))
+        timings.append(time.perf_counter() - start)
+    results["json"] = payloads, timings
+
+    for name, backend in backends.items():
+        payloads, timings = [], []
+        for gageid, df in frames.items():
+            key = sessionstore.make_key(gageid, "GP", "XGB", "RF")
+            backend.put(key, df)
+            payload = json.dumps(key)
+            payloads.append(len(payload))
+            start = time.perf_counter()
+            render(backend.get(json.loads(payload)))
+            timings.append(time.perf_counter() - start)
+        results[name] = payloads, timings
+
+    for name, (payloads, timings) in results.items():
+        print(
+            f"{name:>6}: payload median={statistics.median(payloads):9,.0f} bytes  "
+            f"render_content median={statistics.median(timings) * 1e3:8.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
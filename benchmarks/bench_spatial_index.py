@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Nearest-gauge and radius query latency of the spatial index against a
+brute-force scan of every gauge.
+
+The gauge catalogue is replicated with jittered coordinates to emulate
+larger catalogues. Query locations are drawn uniformly over the globe,
+so most of them are far from any gauge, the slow case of nearest().
+
+Run from the repository root:
+
+    python -m benchmarks.bench_spatial_index --scales 1 4 16
+"""
+
+import argparse
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--radius-km", type=float, default=100.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import numpy as np
+    import spatialindex
+    import utils
+
+    rng = np.random.default_rng(args.seed)
+    map_data = utils.get_map_data()
+    queries = np.column_stack(
+        [
+            np.degrees(np.arcsin(rng.uniform(-1, 1, args.queries))),
+            rng.uniform(-180, 180, args.queries),
+        ]
+    )
+
+    for scale in args.scales:
+        lat = np.concatenate(
+            [map_data["Lat"].values]
+            + [(map_data["Lat"].values + rng.normal(0, 0.5, len(map_data))).clip(-90, 90)
+               for _ in range(1, scale)]
+        )
+        lon = np.concatenate(
+            [map_data["Lon"].values]
+            + [(map_data["Lon"].values + rng.normal(0, 0.5, len(map_data)) + 180) % 360 - 180
+               for _ in range(1, scale)]
+        )
+        start = time.perf_counter()
+        index = spatialindex.GridIndex(lat, lon)
+        build = time.perf_counter() - start
+
+        timings = {}
+        for name, query in [
+            (f"nearest k={args.k}", lambda a, b: index.nearest(a, b, args.k)),
+            (f"within {args.radius_km:g} km", lambda a, b: index.within(a, b, args.radius_km)),
+            (f"brute force k={args.k}", lambda a, b: np.argsort(
+                spatialindex.haversine_km(a, b, lat, lon))[:args.k]),
+        ]:
+            start = time.perf_counter()
+            for a, b in queries:
+                query(a, b)
+            timings[name] = (time.perf_counter() - start) / len(queries)
+
+        print(f"{len(lat):>7} gauges, index built in {build * 1e3:.1f} ms")
+        for name, seconds in timings.items():
+            print(f"    {name:<22} {seconds * 1e6:9.1f} us/query")
+
+
+if __name__ == "__main__":
+    main()
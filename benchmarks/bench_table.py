@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Render cost of the Tabular tab against row count.
+
+Compares the previous full HTML table (dbc.Table.from_dataframe over
+every row) with utils.as_table, which serializes only the first page,
+and utils.table_page serving a sorted page.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_table --rows 200 2000 20000
+"""
+
+import argparse
+import json
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[200, 2000, 20000])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import numpy as np
+    import pandas as pd
+    import dash_bootstrap_components as dbc
+    import plotly
+    import utils
+
+    rng = np.random.default_rng(args.seed)
+
+    def serialized(component):
+        return len(json.dumps(component, cls=plotly.utils.PlotlyJSONEncoder))
+
+    for rows in args.rows:
+        q_pred = rng.gamma(2, 3, rows)
+        df = pd.DataFrame(
+            dict(
+                datetime=pd.date_range("2002-04-16", periods=rows, freq="D"),
+                Q_pred=q_pred,
+                Q_pred_selmonths=np.where(rng.random(rows) < 0.7, q_pred, np.nan),
+                Q_mon=rng.gamma(2, 3, rows),
+            )
+        )
+
+        start = time.perf_counter()
+        full = df[list(utils.TABLE_COLUMNS)].round(4)
+        full.columns = list(utils.TABLE_COLUMNS.values())
+        size_full = serialized(dbc.Table.from_dataframe(full))
+        time_full = time.perf_counter() - start
+
+        start = time.perf_counter()
+        size_paged = serialized(utils.as_table(df))
+        time_paged = time.perf_counter() - start
+
+        start = time.perf_counter()
+        utils.table_page(df, 3, sort_by=[dict(column_id="Q_pred", direction="desc")])
+        time_sorted = time.perf_counter() - start
+
+        print(
+            f"{rows:>7} rows  full: {time_full * 1e3:9.1f} ms {size_full / 1024:10,.1f} KiB"
+            f"   paged: {time_paged * 1e3:7.1f} ms {size_paged / 1024:6,.1f} KiB"
+            f"   sorted page: {time_sorted * 1e3:7.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Drives the app's Dash callbacks through the Flask test client, the way
+the browser does, for benchmarks and load tests.
+"""
+
+import json
+import time
+
+# typing imports
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+def _prop(prop_id: str, value: Any = None) -> Dict[str, Any]:
+    component_id, prop = prop_id.rsplit(".", 1)
+    return {"id": component_id, "property": prop, "value": value}
+
+
+# outputs of callbacks.figure_clicked_callback
+FIGURE_OUTPUTS = [
+    "store-qtwsa.data",
+    "spatial_dependency.children",
+    "temporal_dependency.children",
+    "selection-status.children",
+    "active-gauges.data",
+    "job.data",
+    "job-poll.disabled",
+]
+
+# seconds between polls of an unfinished job, as the job-poll interval
+POLL_SECONDS = 0.5
+
+MODEL_PROPS = [
+    "Model Regionalisation.value",
+    "Model Spatial Feasibility.value",
+    "Model Temporal Feasibility.value",
+]
+
+
+class DashClient:
+    """
+    Minimal client for the /_dash-update-component endpoint.
+
+    Parameters
+    ----------
+    client:
+        Flask test client of `app.server`, or any object with a compatible
+        `post(path, json=...)` method.
+    poll_seconds: float
+        Seconds between polls of an unfinished figure callback job.
+    """
+
+    def __init__(self, client, poll_seconds: float = POLL_SECONDS):
+        self.client = client
+        self.poll_seconds = poll_seconds
+
+    def update(
+        self,
+        outputs: Sequence[str],
+        inputs: List[Tuple[str, Any]],
+        state: Sequence[Tuple[str, Any]] = (),
+        changed: Optional[Sequence[str]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Triggers the callback that produces `outputs`.
+
+        Parameters
+        ----------
+        outputs: Sequence[str]
+            "component.property" ids of the callback outputs.
+        inputs: List[Tuple[str, Any]]
+            ("component.property", value) of the callback inputs.
+        state: Sequence[Tuple[str, Any]]
+            ("component.property", value) of the callback states.
+        changed: Sequence[str]
+            Ids of the inputs that triggered the callback, the first input
+            if None.
+
+        Returns
+        -------
+        Dict[str, Any]
+            Callback response by component id, empty if the update was
+            prevented.
+        """
+        output_specs = [_prop(o) for o in outputs]
+        for spec in output_specs:
+            del spec["value"]
+        if len(outputs) > 1:
+            output = ".." + "...".join(outputs) + ".."
+        else:
+            output = outputs[0]
+        body = dict(
+            output=output,
+            outputs=output_specs if len(outputs) > 1 else output_specs[0],
+            inputs=[_prop(k, v) for k, v in inputs],
+            state=[_prop(k, v) for k, v in state],
+            changedPropIds=list(changed or [inputs[0][0]]),
+        )
+        response = self.client.post("/_dash-update-component", json=body)
+        if response.status_code == 204:
+            return {}
+        if response.status_code != 200:
+            raise RuntimeError(f"{output} failed with HTTP {response.status_code}")
+        return json.loads(response.get_data())["response"]
+
+    def click(
+        self,
+        gageid: str,
+        model_regionalisation: str = "GP",
+        model_spatial_feasibility: str = "XGB",
+        model_temporal_feasibility: str = "RF",
+        ensemble: bool = False,
+    ) -> Optional[str]:
+        """
+        Clicks a gauge on the map, returns the key of the stored result.
+        """
+        return self._figure_event(
+            "usgs_sites.clickData",
+            {"points": [{"hovertext": gageid}]},
+            (model_regionalisation, model_spatial_feasibility, model_temporal_feasibility),
+            ensemble=ensemble,
+        )
+
+    def select(
+        self,
+        selected_data: Dict[str, Any],
+        model_regionalisation: str = "GP",
+        model_spatial_feasibility: str = "XGB",
+        model_temporal_feasibility: str = "RF",
+    ) -> Optional[str]:
+        """
+        Box or lasso selects gauges on the map, returns the key of the
+        stored result.
+        """
+        return self._figure_event(
+            "usgs_sites.selectedData",
+            selected_data,
+            (model_regionalisation, model_spatial_feasibility, model_temporal_feasibility),
+        )
+
+    def set_models(
+        self,
+        active: Dict[str, Any],
+        model_regionalisation: str = "GP",
+        model_spatial_feasibility: str = "XGB",
+        model_temporal_feasibility: str = "RF",
+        changed: str = "Model Regionalisation.value",
+        ensemble: bool = False,
+    ) -> Optional[str]:
+        """
+        Changes a model dropdown while the `active` gauges are shown (the
+        active-gauges store: {"click": gageid} or {"selection": [gageids]}),
+        returns the key of the stored result.
+        """
+        return self._figure_event(
+            changed,
+            None,
+            (model_regionalisation, model_spatial_feasibility, model_temporal_feasibility),
+            active,
+            ensemble,
+        )
+
+    def _figure_event(
+        self,
+        prop_id: str,
+        value: Any,
+        models: Sequence[str],
+        active: Optional[Dict[str, Any]] = None,
+        ensemble: bool = False,
+    ) -> Optional[str]:
+        inputs = {"usgs_sites.clickData": None, "usgs_sites.selectedData": None}
+        inputs.update(zip(MODEL_PROPS, models))
+        inputs["ensemble.value"] = ["ensemble"] if ensemble else []
+        inputs["job-poll.n_intervals"] = None
+        if prop_id in ("usgs_sites.clickData", "usgs_sites.selectedData"):
+            inputs[prop_id] = value
+        job = None
+        while True:
+            response = self.update(
+                FIGURE_OUTPUTS,
+                list(inputs.items()),
+                [("active-gauges.data", active), ("job.data", job)],
+                changed=[prop_id],
+            )
+            job = response.get("job", {}).get("data")
+            if job is None:
+                return response.get("store-qtwsa", {}).get("data")
+            # the job is not done yet, poll it as the browser does
+            time.sleep(self.poll_seconds)
+            prop_id = "job-poll.n_intervals"
+            inputs[prop_id] = (inputs[prop_id] or 0) + 1
+
+    def render(
+        self, tab: str, qtwsa_key: Optional[str], model_regionalisation: str = "GP"
+    ) -> Dict[str, Any]:
+        """
+        Switches to a results tab.
+        """
+        return self.update(
+            ["tab-content.children"],
+            [
+                ("tabs-results.value", tab),
+                ("store-qtwsa.data", qtwsa_key),
+                ("Model Regionalisation.value", model_regionalisation),
+            ],
+        )
+
+    def discharge_map_frame(
+        self, month: int, model_regionalisation: str = "GP", model_temporal_feasibility: str = "RF"
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Moves the month slider of the discharge map, returns the frame.
+        """
+        response = self.update(
+            ["discharge-map-frame.data"],
+            [
+                ("discharge-map-month.value", month),
+                ("Model Regionalisation.value", model_regionalisation),
+                ("Model Temporal Feasibility.value", model_temporal_feasibility),
+            ],
+        )
+        return response.get("discharge-map-frame", {}).get("data")
@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+"""
+Concurrent load test replaying browser sessions against the app.
+
+Each virtual user clicks gauges drawn from a Zipf popularity distribution
+over the gauges of global_gauges_models.csv, changes model dropdowns and
+switches result tabs, through the same Dash callbacks as the browser.
+Users run on a thread pool, against `app.server` through the Flask test
+client (default), against a gunicorn started for the run (--gunicorn),
+or against a running server (--url).
+
+Reports the throughput, the p50/p95/p99 latency of every callback and
+the peak resident memory of the serving processes.
+
+Run from the repository root:
+
+    python -m benchmarks.loadtest --data-dir static/data --users 8 --duration 30
+    python -m benchmarks.loadtest --data-dir static/data --gunicorn --workers 2 --threads 8
+    python -m benchmarks.loadtest --data-dir static/data --url http://localhost:8000
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# typing imports
+from typing import Any, Dict, List, Optional, Tuple
+
+from benchmarks.dashclient import DashClient
+from benchmarks.suite import git_revision
+
+
+# tabs a user switches between, with their relative frequency
+TABS = {
+    "tab-timeseries": 6,
+    "tab-table": 2,
+    "tab-leaderboard": 1,
+    "tab-discharge-map": 1,
+}
+
+# default relative frequency of the actions of a user
+DEFAULT_MIX = "click=6,model=2,tab=2"
+
+# months fetched when a user scrubs the discharge map slider
+SCRUB_MONTHS = 10
+
+
+def zipf_weights(n: int, exponent: float) -> List[float]:
+    """
+    Popularity of n items by rank, 1 / rank**exponent. 0 is uniform.
+    """
+    return [1 / rank**exponent for rank in range(1, n + 1)]
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, weight = part.split("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - {"click", "model", "tab"}
+    if unknown:
+        raise ValueError(f"Unknown actions in --mix: {sorted(unknown)}")
+    return mix
+
+
+class Catalogue:
+    """
+    Gauges and models to draw the actions of the users from.
+
+    Parameters
+    ----------
+    data_dir: str
+        Directory containing global_gauges_models.csv.
+    exponent: float
+        Zipf exponent of the gauge popularity.
+    seed: int
+        Seed of the popularity ranking.
+    """
+
+    def __init__(self, data_dir: str, exponent: float, seed: int):
+        import pandas as pd
+
+        import datastore
+        import engine
+
+        path = os.path.join(data_dir, datastore.MODELS_FILE)
+        columns = pd.read_csv(path, nrows=0).columns
+        gageids = pd.read_csv(path, usecols=["GAGEID"], dtype=str)["GAGEID"]
+        gageids = list(dict.fromkeys(datastore.normalize_gageid(g) for g in gageids))
+        # the most popular gauges are spread over the catalogue
+        random.Random(seed).shuffle(gageids)
+        self.gageids = gageids
+        self.weights = zipf_weights(len(gageids), exponent)
+        self.regionalisation = [
+            model
+            for model, (alpha, beta) in engine.REGIONALISATION_COLUMNS.items()
+            if alpha in columns and beta in columns
+        ]
+        self.spatial = list(engine.SPATIAL_MODELS)
+        self.temporal = list(engine.TEMPORAL_MODELS)
+
+    def gauges(self, rng: random.Random, k: int) -> List[str]:
+        return rng.choices(self.gageids, weights=self.weights, k=k)
+
+
+class HttpClient:
+    """
+    `post(path, json=...)` over HTTP, the interface of the Flask test
+    client used by DashClient.
+    """
+
+    class Response:
+        def __init__(self, status_code: int, data: bytes):
+            self.status_code = status_code
+            self.data = data
+
+        def get_data(self) -> bytes:
+            return self.data
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+
+    def post(self, path: str, json: Any = None) -> "HttpClient.Response":
+        import json as json_module
+
+        request = urllib.request.Request(
+            self.url + path,
+            data=json_module.dumps(json).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=300) as response:
+                return self.Response(response.status, response.read())
+        except urllib.error.HTTPError as e:
+            return self.Response(e.code, e.read())
+
+
+class User:
+    """
+    One browser session, keeping the shown gauge, models and tab.
+    """
+
+    def __init__(self, client: DashClient, catalogue: Catalogue, rng: random.Random):
+        self.client = client
+        self.catalogue = catalogue
+        self.rng = rng
+        # the defaults of the dropdowns
+        self.models = [
+            "GP" if "GP" in catalogue.regionalisation else catalogue.regionalisation[0],
+            "XGB",
+            "RF",
+        ]
+        self.tab = "tab-timeseries"
+        self.gageid = None  # type: Optional[str]
+        self.key = None  # type: Optional[str]
+        self.timings = []  # type: List[Tuple[str, float, bool]]
+
+    def timed(self, name: str, func, *args, **kwargs) -> Any:
+        start = time.perf_counter()
+        ok = True
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            ok = False
+            return None
+        finally:
+            self.timings.append((name, time.perf_counter() - start, ok))
+
+    def render(self):
+        # the browser re-renders the tab when the result key changes
+        self.timed(
+            f"render_{self.tab}", self.client.render, self.tab, self.key, self.models[0]
+        )
+
+    def act(self, action: str):
+        if action == "click" or self.gageid is None:
+            self.gageid = self.catalogue.gauges(self.rng, 1)[0]
+            self.key = self.timed("click", self.client.click, self.gageid, *self.models)
+            self.render()
+        elif action == "model":
+            position = self.rng.randrange(3)
+            options = [self.catalogue.regionalisation, self.catalogue.spatial,
+                       self.catalogue.temporal][position]
+            self.models[position] = self.rng.choice(options)
+            key = self.timed(
+                "model_change",
+                self.client.set_models,
+                dict(click=self.gageid),
+                *self.models,
+                changed=[
+                    "Model Regionalisation.value",
+                    "Model Spatial Feasibility.value",
+                    "Model Temporal Feasibility.value",
+                ][position],
+            )
+            if key is not None:
+                self.key = key
+                self.render()
+        else:
+            self.tab = self.rng.choices(list(TABS), weights=list(TABS.values()))[0]
+            self.render()
+            if self.tab == "tab-discharge-map":
+                start = self.rng.randrange(200)
+                for month in range(start, start + SCRUB_MONTHS):
+                    self.timed(
+                        "discharge_map_frame",
+                        self.client.discharge_map_frame,
+                        month,
+                        self.models[0],
+                        self.models[2],
+                    )
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    return sorted_values[min(int(len(sorted_values) * q), len(sorted_values) - 1)]
+
+
+def summarize(timings: List[Tuple[str, float, bool]], seconds: float) -> Dict[str, Dict[str, float]]:
+    by_name = {}  # type: Dict[str, List[Tuple[float, bool]]]
+    for name, duration, ok in timings:
+        by_name.setdefault(name, []).append((duration, ok))
+    by_name["all"] = [(duration, ok) for _, duration, ok in timings]
+    results = {}
+    for name, values in by_name.items():
+        durations = sorted(d for d, _ in values)
+        results[name] = dict(
+            n=len(values),
+            errors=sum(not ok for _, ok in values),
+            per_second=len(values) / seconds,
+            p50_ms=percentile(durations, 0.50) * 1e3,
+            p95_ms=percentile(durations, 0.95) * 1e3,
+            p99_ms=percentile(durations, 0.99) * 1e3,
+            max_ms=durations[-1] * 1e3,
+        )
+    return results
+
+
+def _proc_bytes(path: str, field: str) -> int:
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith(field):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def _process_tree(pid: int) -> List[int]:
+    pids = [pid]
+    for p in pids:
+        try:
+            for task in os.listdir(f"/proc/{p}/task"):
+                with open(f"/proc/{p}/task/{task}/children") as f:
+                    pids.extend(int(c) for c in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+class MemorySampler(threading.Thread):
+    """
+    Samples the memory of a process and its children, keeping the peak
+    resident memory of each process and the peak sum of their resident and
+    proportional memory. Pages shared by preforked gunicorn workers count
+    fully in the resident memory of each, and for their share in the
+    proportional memory. Linux only.
+    """
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_total = 0
+        self.peak_proportional = 0
+        self.peak_by_pid = {}  # type: Dict[int, int]
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            total = proportional = 0
+            for pid in _process_tree(self.pid):
+                rss = _proc_bytes(f"/proc/{pid}/status", "VmRSS:")
+                total += rss
+                proportional += _proc_bytes(f"/proc/{pid}/smaps_rollup", "Pss:")
+                self.peak_by_pid[pid] = max(self.peak_by_pid.get(pid, 0), rss)
+            self.peak_total = max(self.peak_total, total)
+            self.peak_proportional = max(self.peak_proportional, proportional)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def start_gunicorn(data_dir: str, workers: int, threads: int) -> Tuple[subprocess.Popen, str]:
+    """
+    Starts gunicorn with the repository's settings on a free local port
+    and waits until every worker is warmed up.
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, QTWSA_DATA_DIR=data_dir)
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn",
+            "--config", "gunicorn.conf.py",
+            "--bind", f"127.0.0.1:{port}",
+            "--workers", str(workers),
+            "--threads", str(threads),
+            "--timeout", "0",
+            "app:server",
+        ],
+        env=env,
+    )
+    deadline = time.monotonic() + 300
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {process.returncode}")
+        try:
+            # every worker answers /ready once it is warmed up, so require
+            # a few successive 200s
+            if all(urllib.request.urlopen(url + "/ready", timeout=5).status == 200
+                   for _ in range(2 * workers)):
+                return process, url
+        except (OSError, urllib.error.HTTPError):
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("gunicorn did not become ready")
+
+
+def run(
+    make_client,
+    catalogue: Catalogue,
+    users: int,
+    duration: float,
+    mix: Dict[str, float],
+    think: float,
+    seed: int,
+) -> Tuple[List[Tuple[str, float, bool]], float]:
+    """
+    Runs `users` sessions concurrently for `duration` seconds.
+
+    Returns
+    -------
+    Tuple[List[Tuple[str, float, bool]], float]
+        (callback, seconds, succeeded) of every request and the wall time
+    """
+    deadline = time.monotonic() + duration
+    actions, weights = list(mix), list(mix.values())
+
+    def session(i: int) -> List[Tuple[str, float, bool]]:
+        rng = random.Random(seed * 1000 + i)
+        user = User(make_client(), catalogue, rng)
+        while time.monotonic() < deadline:
+            user.act(rng.choices(actions, weights=weights)[0])
+            if think:
+                time.sleep(rng.expovariate(1 / think))
+        return user.timings
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        timings = [t for result in pool.map(session, range(users)) for t in result]
+    return timings, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--data-dir", help="gauge datasets, synthetic if omitted")
+    parser.add_argument("--url", help="drive a running server instead of app.server")
+    parser.add_argument("--gunicorn", action="store_true", help="start gunicorn for the run")
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn threads per worker")
+    parser.add_argument("--users", type=int, default=8, help="concurrent sessions")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--zipf", type=float, default=1.1, help="popularity exponent, 0 is uniform")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="relative frequency of the actions")
+    parser.add_argument("--think", type=float, default=0, help="mean seconds between actions")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="qtwsa-load-")
+    if args.data_dir is None:
+        from benchmarks import synthetic
+
+        args.data_dir = synthetic.generate(os.path.join(tmpdir, "data"), seed=args.seed)
+    args.data_dir = os.path.abspath(args.data_dir)
+    os.environ["QTWSA_DATA_DIR"] = args.data_dir
+    os.environ.setdefault("QTWSA_RESULT_STORE_PATH", os.path.join(tmpdir, "results.sqlite"))
+    os.environ.setdefault("QTWSA_JOB_STORE_PATH", os.path.join(tmpdir, "jobs.sqlite"))
+
+    catalogue = Catalogue(args.data_dir, args.zipf, args.seed)
+    mix = parse_mix(args.mix)
+
+    server = None
+    sampler = None
+    if args.gunicorn:
+        server, args.url = start_gunicorn(args.data_dir, args.workers, args.threads)
+        sampler = MemorySampler(server.pid)
+        sampler.start()
+    try:
+        if args.url:
+            def make_client():
+                return DashClient(HttpClient(args.url))
+            mode = "gunicorn" if args.gunicorn else "url"
+        else:
+            import app
+            import warmup
+
+            while not warmup.status()["ready"]:
+                time.sleep(0.1)
+            # Dash registers the callbacks on the first request, as a browser
+            # loading the page would do before using them
+            app.server.test_client().get("/")
+
+            def make_client():
+                return DashClient(app.server.test_client())
+            mode = "in-process"
+            sampler = MemorySampler(os.getpid())
+            sampler.start()
+
+        timings, seconds = run(
+            make_client, catalogue, args.users, args.duration, mix, args.think, args.seed
+        )
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    results = summarize(timings, seconds)
+    print(f"{mode}, {args.users} users, {seconds:.1f} s, zipf {args.zipf}, mix {args.mix}")
+    for name, stats in sorted(results.items()):
+        print(
+            f"{name:<32} n={stats['n']:6d} err={stats['errors']:4d} "
+            f"{stats['per_second']:8.1f}/s  p50={stats['p50_ms']:8.1f} ms  "
+            f"p95={stats['p95_ms']:8.1f} ms  p99={stats['p99_ms']:8.1f} ms"
+        )
+    memory = None
+    if sampler is not None:
+        memory = dict(
+            peak_total_bytes=sampler.peak_total,
+            peak_proportional_bytes=sampler.peak_proportional,
+            peak_by_process_bytes={str(p): b for p, b in sampler.peak_by_pid.items() if b},
+        )
+        print(
+            f"peak RSS {sampler.peak_total / 2**20:.0f} MiB, peak PSS "
+            f"{sampler.peak_proportional / 2**20:.0f} MiB over "
+            f"{len(memory['peak_by_process_bytes'])} process(es)"
+        )
+        for pid, rss in sorted(memory["peak_by_process_bytes"].items()):
+            print(f"  pid {pid}: {rss / 2**20:.0f} MiB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                dict(
+                    revision=git_revision(),
+                    timestamp=time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                    python=platform.python_version(),
+                    platform=platform.platform(),
+                    mode=mode,
+                    config={k: v for k, v in vars(args).items() if k != "output"},
+                    seconds=seconds,
+                    results=results,
+                    memory=memory,
+                ),
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
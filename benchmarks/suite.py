@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the app's hot paths.
+
+Covers get_map_data, handle_click (cold, cached and on a model change), the discharge
+engine, the skill scores, as_timeseries_scatterplot, as_table, render_content and the full
+Dash click callback through the Flask test client. Results are written
+as JSON so that runs on different commits can be compared.
+
+Without --data-dir a synthetic, full-size dataset is generated first
+(see benchmarks.synthetic).
+
+Run from the repository root:
+
+    python -m benchmarks.suite --output bench.json
+    python -m benchmarks.suite --output new.json --compare bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+
+# typing imports
+from typing import Any, Callable, Dict, List
+
+
+def summarize(timings: List[float]) -> Dict[str, float]:
+    timings = sorted(timings)
+    return dict(
+        n=len(timings),
+        median_ms=statistics.median(timings) * 1e3,
+        mean_ms=statistics.mean(timings) * 1e3,
+        p95_ms=timings[min(int(len(timings) * 0.95), len(timings) - 1)] * 1e3,
+        min_ms=timings[0] * 1e3,
+    )
+
+
+def measure(func: Callable[[], Any], repeat: int, setup: Callable[[], Any] = None):
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return summarize(timings)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(repeat: int, seed: int) -> Dict[str, Dict[str, float]]:
+    # imported after QTWSA_DATA_DIR is set
+    import datastore
+    import engine
+    import utils
+
+    results = {}
+    rng = random.Random(seed)
+    gageids = list(datastore.get_store().gauge_index)
+
+    def pick():
+        return rng.choice(gageids)
+
+    def clear_click_caches():
+        utils.click_cache.clear()
+        utils.series_cache.clear()
+
+    results["get_map_data"] = measure(utils.get_map_data, repeat)
+    results["datastore_load"] = measure(
+        lambda: datastore.GaugeDataStore.load(datastore.DATA_DIR), max(repeat // 5, 1)
+    )
+    results["handle_click_uncached"] = measure(
+        lambda: utils.handle_click(pick(), "GP", "XGB", "RF"),
+        repeat,
+        setup=clear_click_caches,
+    )
+    cached = pick()
+    utils.handle_click(cached, "GP", "XGB", "RF")
+    results["handle_click_cached"] = measure(
+        lambda: utils.handle_click(cached, "GP", "XGB", "RF"), repeat
+    )
+    # model changes on a shown gauge: only the gauge series is cached
+    regionalisation_models = engine.regionalisation_models()
+    results["handle_click_model_change"] = measure(
+        lambda: utils.handle_click(
+            cached, rng.choice(regionalisation_models), "XGB", rng.choice(engine.TEMPORAL_MODELS)
+        ),
+        repeat,
+        setup=utils.click_cache.clear,
+    )
+
+    results["compute_discharge_matrix"] = measure(
+        lambda: engine.compute_discharge_matrix("GP", temporal_model="RF"),
+        max(repeat // 5, 1),
+    )
+
+    import skill
+
+    results["skill_compute_scores"] = measure(
+        lambda: skill.compute_scores("GP"), max(repeat // 5, 1)
+    )
+
+    df = utils.handle_click(cached, "GP", "XGB", "RF")["discharges"]
+    df.sort_values("datetime", inplace=True)
+    results["as_timeseries_scatterplot"] = measure(
+        lambda: utils.as_timeseries_scatterplot(df), repeat
+    )
+    results["as_table"] = measure(lambda: utils.as_table(df), repeat)
+
+    import app
+    from benchmarks.dashclient import DashClient
+
+    client = DashClient(app.server.test_client())
+    results["callback_click_uncached"] = measure(
+        lambda: client.click(pick()), repeat, setup=clear_click_caches
+    )
+    key = client.click(cached)
+    results["callback_click_cached"] = measure(lambda: client.click(cached), repeat)
+    results["callback_model_change"] = measure(
+        lambda: client.set_models(dict(click=cached), rng.choice(regionalisation_models)),
+        repeat,
+        setup=utils.click_cache.clear,
+    )
+    # scrubbing the month slider of the discharge map, frames built once
+    n_months = len(datastore.get_store().axis.columns)
+    client.discharge_map_frame(0)
+    results["callback_discharge_map_frame"] = measure(
+        lambda: client.discharge_map_frame(rng.randrange(n_months)), repeat
+    )
+    selection = {"points": [{"hovertext": pick()} for _ in range(utils.SELECTION_MAX_GAUGES)]}
+    results["callback_selection_uncached"] = measure(
+        lambda: client.select(selection), max(repeat // 5, 1),
+        setup=clear_click_caches,
+    )
+    for tab in ("tab-timeseries", "tab-table"):
+        results[f"render_content_{tab}"] = measure(
+            lambda: client.render(tab, key), repeat
+        )
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline_file: str):
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    print(f"\ncompared with {baseline_file} ({baseline.get('revision')})")
+    for name, stats in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        ratio = stats["median_ms"] / before["median_ms"]
+        print(
+            f"{name:<34} {before['median_ms']:10.2f} -> {stats['median_ms']:10.2f} ms "
+            f"({ratio:5.2f}x)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--data-dir", help="gauge datasets, synthetic if omitted")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="qtwsa-bench-")
+    if args.data_dir is None:
+        from benchmarks import synthetic
+
+        args.data_dir = synthetic.generate(os.path.join(tmpdir, "data"), seed=args.seed)
+    os.environ["QTWSA_DATA_DIR"] = args.data_dir
+    os.environ.setdefault(
+        "QTWSA_RESULT_STORE_PATH", os.path.join(tmpdir, "results.sqlite")
+    )
+    os.environ.setdefault("QTWSA_JOB_STORE_PATH", os.path.join(tmpdir, "jobs.sqlite"))
+
+    results = run(args.repeat, args.seed)
+
+    for name, stats in results.items():
+        print(
+            f"{name:<34} median={stats['median_ms']:10.2f} ms  "
+            f"p95={stats['p95_ms']:10.2f} ms  n={stats['n']}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                dict(
+                    revision=git_revision(),
+                    timestamp=time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                    python=platform.python_version(),
+                    platform=platform.platform(),
+                    data_dir=args.data_dir,
+                    repeat=args.repeat,
+                    results=results,
+                ),
+                f,
+                indent=2,
+            )
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Synthetic stand-ins for the gauge datasets that are not in the repository.
+
+Writes TWSA_gauges_global.csv and global_gauges_q.csv with the schemas
+read by datastore.GaugeDataStore, one TWSA row per COMID and one
+observation series per GAGEID of global_gauges_models.csv, and copies
+the dates and model files next to them so the output directory can be
+used as QTWSA_DATA_DIR.
+
+TWSA follows a seasonal cycle with a trend and autocorrelated noise;
+observed discharge is the GP model prediction with log-normal error, so
+skill metrics computed on the data are meaningful.
+
+Run from the repository root:
+
+    python -m benchmarks.synthetic --out-dir /tmp/qtwsa-data
+"""
+
+import argparse
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+# local imports
+import datastore
+
+
+def generate(
+    out_dir: str,
+    source_dir: str = datastore.DATA_DIR,
+    seed: int = 0,
+    first_observation: str = "1980-01-01",
+    min_record_months: int = 24,
+) -> str:
+    """
+    Writes a synthetic, full-size data directory.
+
+    Parameters
+    ----------
+    out_dir: str
+        Directory to write the csv files to.
+    source_dir: str
+        Directory containing the dates and model csv files.
+    seed: int
+        Random seed.
+    first_observation: str
+        Earliest month of the observed discharge records.
+    min_record_months: int
+        Shortest observed discharge record.
+
+    Returns
+    -------
+    str
+        out_dir
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    for name in (datastore.DATES_FILE, datastore.MODELS_FILE):
+        if os.path.abspath(source_dir) != os.path.abspath(out_dir):
+            shutil.copy(os.path.join(source_dir, name), os.path.join(out_dir, name))
+
+    dates = pd.read_csv(os.path.join(out_dir, datastore.DATES_FILE), usecols=range(2))
+    models = pd.read_csv(
+        os.path.join(out_dir, datastore.MODELS_FILE), dtype={"GAGEID": str}
+    )
+    twsa_months = datastore.to_month_index(
+        pd.to_datetime(dates["datetime"]).values
+    )
+
+    # monthly TWSA [cm] of every gauge from first_observation to the last GRACE month
+    first = datastore.to_month_index(np.array([first_observation], "datetime64[D]"))[0]
+    months = np.arange(first, twsa_months.max() + 1)
+    n_gauges, n_months = len(models), len(months)
+    amplitude = rng.gamma(2, 4, (n_gauges, 1))
+    phase = rng.uniform(0, 2 * np.pi, (n_gauges, 1))
+    trend = rng.normal(0, 0.01, (n_gauges, 1))
+    noise = rng.normal(0, 2, (n_gauges, n_months))
+    for t in range(1, n_months):
+        noise[:, t] += 0.6 * noise[:, t - 1]
+    twsa = (
+        amplitude * np.sin(2 * np.pi * months / 12 + phase)
+        + trend * (months - months[-1])
+        + noise
+    ).astype("float32")
+
+    twsa_frame = pd.DataFrame(
+        twsa[:, twsa_months - first].round(3), columns=dates["date"].astype(str)
+    )
+    twsa_frame.insert(0, "COMID", models["COMID"].values)
+    twsa_frame.drop_duplicates("COMID").to_csv(
+        os.path.join(out_dir, datastore.TWSA_FILE), index=False
+    )
+
+    q = models[["GP_alpha"]].values * np.exp(twsa * models[["GP_beta"]].values)
+    q *= rng.lognormal(0, 0.3, q.shape)
+    lengths = rng.integers(min_record_months, n_months + 1, n_gauges)
+    starts = rng.integers(0, n_months - lengths + 1)
+    records = []
+    # one record per GAGEID, using the first model row of duplicated ids
+    for row in np.flatnonzero(~models["GAGEID"].duplicated().values):
+        span = slice(starts[row], starts[row] + lengths[row])
+        records.append(
+            pd.DataFrame(
+                dict(
+                    GAGEID=models["GAGEID"].iloc[row],
+                    date=months[span].astype("datetime64[M]").astype("datetime64[D]"),
+                    Q_mon=q[row, span].round(3),
+                )
+            )
+        )
+    pd.concat(records).to_csv(
+        os.path.join(out_dir, datastore.OBSERVATIONS_FILE), index=False
+    )
+    return out_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--out-dir", required=True)
+    parser.add_argument("--source-dir", default="static/data")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate(args.out_dir, args.source_dir, args.seed)
+    print(f"Synthetic gauge datasets written to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# typing imports
+from typing import Any, Callable, Dict, Hashable
+
+# local imports
+from logging_config import get_logger
+
+
+# instantiate logger
+logger = get_logger(__name__)
+
+
+def _array_bytes(values: np.ndarray) -> int:
+    if values.dtype == object:
+        return values.nbytes + sum(map(sys.getsizeof, values))
+    return values.nbytes
+
+
+def sizeof(value: Any) -> int:
+    """
+    Estimates the memory held by a cached value in bytes.
+
+    Parameters
+    ----------
+    value: Any
+        DataFrame, array, container of those or any other object.
+
+    Returns
+    -------
+    int
+        Approximate size in bytes
+    """
+    if isinstance(value, pd.DataFrame):
+        # DataFrame.memory_usage builds a Series and costs hundreds of
+        # microseconds, summing the column arrays is much cheaper
+        return int(value.index.memory_usage(deep=True)) + sum(
+            _array_bytes(value[column].values) for column in value.columns
+        )
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            sizeof(k) + sizeof(v) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache bounded by the total size of its values.
+
+    Parameters
+    ----------
+    max_bytes: int
+        Byte budget. Least recently used entries are evicted once the
+        cached values exceed it; values larger than the budget are not
+        cached at all.
+    name: str
+        Name used in log messages and statistics.
+    """
+
+    def __init__(self, max_bytes: int, name: str = "results"):
+        self.max_bytes = max_bytes
+        self.name = name
+        self._entries = OrderedDict()  # type: OrderedDict[Hashable, Any]
+        self._sizes = {}  # type: Dict[Hashable, int]
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+        size = sizeof(value)
+        if size > self.max_bytes:
+            logger.debug(f"{self.name} cache: {size} byte value for {key} not cached")
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._sizes.pop(key)
+                del self._entries[key]
+            self._entries[key] = value
+            self._sizes[key] = size
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                evicted, _ = self._entries.popitem(last=False)
+                self.current_bytes -= self._sizes.pop(evicted)
+                self.evictions += 1
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Returns the cached value of `key`, computing and caching it on a miss.
+
+        Concurrent misses on the same key may compute it more than once.
+        """
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the hit/miss/eviction counters and the current usage.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return dict(
+                name=self.name,
+                entries=len(self._entries),
+                bytes=self.current_bytes,
+                max_bytes=self.max_bytes,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                hit_rate=self.hits / lookups if lookups else 0.0,
+            )
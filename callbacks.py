@@ -1,15 +1,24 @@
 #!/usr/bin/env python3
 
-from dash import dcc, html, Input, Output, State, callback
-import dash_bootstrap_components as dbc
+from dash import (
+    dash_table, dcc, html, Input, Output, State,
+    callback, callback_context, clientside_callback, no_update,
+)
 from dash.exceptions import PreventUpdate
 import pandas as pd
-import time
 # local imports
+import components
+import datastore
+import jobs
+import mapview
+import sessionstore
+import skill
+import spatialindex
 import utils
+from instrumentation import span
 
 # typing imports
-from typing import Dict, Any, Union
+from typing import Dict, Any, Callable, List, Optional, Tuple, Union
 
 
 @callback(
@@ -43,11 +52,14 @@ def toggle_modal(n1: int, n2: int, is_open: bool) -> bool:
     Output("tab-content", "children"),
     Input("tabs-results", "value"),
     Input("store-qtwsa", "data"),
+    Input("Model Regionalisation", "value"),
 )
+@span("callback.render_content")
 def render_content(
     tab: str, 
-    qtwsa_data: pd.DataFrame
-) -> Union[html.P, dcc.Graph, dbc.Table, None]:
+    qtwsa_key: Union[str, None],
+    model_regionalisation: str,
+) -> Union[html.P, dcc.Graph, dash_table.DataTable, None]:
     """
     Renders the tab view content
 
@@ -55,9 +67,11 @@ def render_content(
     ----------
     tab: str
         The name of the tab element that is active
-    qtwsa_data: pandas.DataFrame
-        cached data needed to populate the graph and table
-        tab views.
+    qtwsa_key: str
+        key of the server-side result needed to populate the graph
+        and table tab views.
+    model_regionalisation: str
+        Regionalisation model of the leaderboard.
 
     Returns
     -------
@@ -66,12 +80,30 @@ def render_content(
             An html status message
         graph: dcc.Graph
             Graph containing observed and simulated data 
-        table: dbc.Table
-            Table containing observed and simulated data 
+        table: dash_table.DataTable
+            Paged table containing observed and simulated data 
 
     """
+    if tab == "tab-leaderboard":
+        return utils.as_leaderboard(
+            skill.get_scores(model_regionalisation).leaderboard, model_regionalisation
+        )
+
+    if tab == "tab-discharge-map":
+        # built once when the tab opens, the slider callbacks update it
+        if callback_context.triggered[0]["prop_id"] != "tabs-results.value":
+            raise PreventUpdate
+        return components.discharge_map(mapview.get_map_points(), mapview.month_labels())
 
-    df = pd.read_json(qtwsa_data) if qtwsa_data is not None else None
+    df = None
+    if qtwsa_key is not None:
+        with span("result_store.get"):
+            df = sessionstore.get_result_store().get(qtwsa_key)
+        if df is None:
+            return html.P(
+                "This result has expired, please select the location on the map again",
+                style={"margin-top": "1rem"},
+            )
 
     if tab == "tab-timeseries":
         return utils.as_timeseries_scatterplot(df)
@@ -83,89 +115,694 @@ def render_content(
 
 
 
+@callback(
+    Output("discharge-table", "data"),
+    Output("discharge-table", "page_count"),
+    Input("discharge-table", "page_current"),
+    Input("discharge-table", "page_size"),
+    Input("discharge-table", "sort_by"),
+    Input("discharge-table", "filter_query"),
+    State("store-qtwsa", "data"),
+    prevent_initial_call=True,
+)
+@span("callback.table_page")
+def update_table_page(
+    page_current: int,
+    page_size: int,
+    sort_by: List[Dict[str, str]],
+    filter_query: str,
+    qtwsa_key: Union[str, None],
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Serves one page of the Tabular tab, sorted and filtered server-side
+    against the stored result.
+
+    Parameters
+    ----------
+    page_current: int
+        Zero-based page requested by the table.
+    page_size: int
+        Number of rows per page.
+    sort_by: List[Dict[str, str]]
+        Columns and directions to sort by.
+    filter_query: str
+        Filter expression entered in the table.
+    qtwsa_key: str
+        key of the server-side result shown in the table.
+
+    Returns
+    -------
+    Tuple[List[Dict[str, Any]], int]
+        Records of the page and the number of pages
+    """
+    df = sessionstore.get_result_store().get(qtwsa_key) if qtwsa_key else None
+    if df is None:
+        raise PreventUpdate
+    return utils.table_page(df, page_current, page_size, sort_by, filter_query)
+
+
+@callback(
+    Output("leaderboard-table", "data"),
+    Output("leaderboard-table", "page_count"),
+    Input("leaderboard-table", "page_current"),
+    Input("leaderboard-table", "page_size"),
+    Input("leaderboard-table", "sort_by"),
+    Input("leaderboard-table", "filter_query"),
+    State("Model Regionalisation", "value"),
+    prevent_initial_call=True,
+)
+@span("callback.leaderboard_page")
+def update_leaderboard_page(
+    page_current: int,
+    page_size: int,
+    sort_by: List[Dict[str, str]],
+    filter_query: str,
+    model_regionalisation: str,
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Serves one page of the Leaderboard tab, sorted and filtered
+    server-side, see update_table_page.
+    """
+    return utils.leaderboard_page(
+        skill.get_scores(model_regionalisation).leaderboard,
+        page_current, page_size, sort_by, filter_query,
+    )
+
+
+@callback(
+    Output("skill-scores", "children"),
+    Input("active-gauges", "data"),
+    Input("Model Regionalisation", "value"),
+    prevent_initial_call=True,
+)
+@span("callback.skill_scores")
+def update_skill_scores(
+    active: Union[Dict[str, Any], None], model_regionalisation: str
+) -> Union[html.Div, str, None]:
+    """
+    Shows the skill of the simulated discharge against the observations
+    of the clicked gauge, or the median skill of a selection.
+
+    Parameters
+    ----------
+    active: Dict[str, Any]
+        {"click": gageid} or {"selection": [gageids]} of the shown results.
+    model_regionalisation: str
+        Selected regionalisation model.
+
+    Returns
+    -------
+    Union[html.Div, str, None]
+        Scores, or a message if there are none
+    """
+    if not active:
+        return None
+    scores = skill.get_scores(model_regionalisation)
+    if "click" in active:
+        values = scores.get(active["click"])
+        if values is None or pd.isna(values["KGE"]):
+            return "No observations to score this gauge against"
+        title = f"Skill against {values['months']} observed months: "
+    else:
+        rows = [scores.get(g) for g in active["selection"][:utils.SELECTION_MAX_GAUGES]]
+        rows = pd.DataFrame([r for r in rows if r is not None]).dropna()
+        if rows.empty:
+            return "No observations to score these gauges against"
+        values = rows.median()
+        title = f"Median skill of {len(rows)} scored gauges: "
+    return html.Div(
+        [
+            title,
+            html.Br(),
+            f"KGE {values['KGE']:.2f} · NSE {values['NSE']:.2f} · "
+            f"bias {values['pbias']:+.1f} %",
+        ]
+    )
+
+
+@callback(
+    Output("discharge-map-frame", "data"),
+    Input("discharge-map-month", "value"),
+    Input("Model Regionalisation", "value"),
+    Input("Model Temporal Feasibility", "value"),
+)
+@span("callback.discharge_map_frame")
+def update_discharge_map_frame(
+    month: Union[int, None], model_regionalisation: str, model_temporal_feasibility: str
+) -> Dict[str, Any]:
+    """
+    Sends the marker colours of the discharge map for the month of the
+    slider, see mapview.DischargeFrames.frame.
+
+    Parameters
+    ----------
+    month: int
+        Position of the month in the served months.
+    model_regionalisation: str
+        Selected regionalisation model.
+    model_temporal_feasibility: str
+        Selected temporal feasibility model, infeasible months are grey.
+
+    Returns
+    -------
+    Dict[str, Any]
+        Month label, base64-encoded colour levels and colour bar ticks
+    """
+    if month is None:
+        raise PreventUpdate
+    frames = mapview.get_discharge_frames(model_regionalisation, model_temporal_feasibility)
+    return frames.frame(month)
+
+
+# swaps the colours of a frame into the discharge map in the browser, so
+# that the figure is not rebuilt or sent again for every month
+clientside_callback(
+    """
+    function (frame, figure) {
+        if (!frame || !figure) {
+            return window.dash_clientside.no_update;
+        }
+        const raw = atob(frame.colors);
+        const colors = new Uint8Array(raw.length);
+        for (let i = 0; i < raw.length; i++) {
+            colors[i] = raw.charCodeAt(i);
+        }
+        const trace = Object.assign({}, figure.data[0]);
+        const colorbar = Object.assign({}, trace.marker.colorbar, {
+            tickvals: frame.tickvals,
+            ticktext: frame.ticktext,
+        });
+        trace.marker = Object.assign({}, trace.marker, {color: colors, colorbar: colorbar});
+        const layout = Object.assign({}, figure.layout, {title: {text: frame.label}});
+        return Object.assign({}, figure, {data: [trace], layout: layout});
+    }
+    """,
+    Output("discharge-map", "figure"),
+    Input("discharge-map-frame", "data"),
+    State("discharge-map", "figure"),
+)
+
+
+@callback(
+    Output("usgs_sites", "figure"),
+    Input("usgs_sites", "relayoutData"),
+    Input("map-focus", "data"),
+    prevent_initial_call=True,
+)
+@span("callback.map_viewport")
+def update_map_viewport(
+    relayout_data: Dict[str, Any], focus: Union[Dict[str, float], None]
+) -> Dict[str, Any]:
+    """
+    Refreshes the map markers for the visible area after a pan or zoom,
+    or moves the map to the location of a location search.
+
+    Parameters
+    ----------
+    relayout_data: Dict[str, Any]
+        relayoutData of the map, containing the new mapbox view.
+    focus: Dict[str, float]
+        lat, lon and zoom of the last location search.
+
+    Returns
+    -------
+    plotly.graph_objects.Figure
+        Map figure with the decimated gauges of the view
+    """
+    triggered = [t["prop_id"] for t in callback_context.triggered]
+    if "map-focus.data" in triggered and focus:
+        center = {"lat": focus["lat"], "lon": focus["lon"]}
+        zoom = focus["zoom"]
+        bounds = mapview.bounds_from_view(center, zoom)
+        # a new uirevision lets the figure move the user's view
+        uirevision = f"focus-{center['lat']}-{center['lon']}-{zoom}"
+    else:
+        view = mapview.view_from_relayout(relayout_data)
+        if mapview.MAP_MODE != "viewport" or view is None:
+            raise PreventUpdate
+        bounds, center, zoom = view
+        uirevision = "map"
+
+    if mapview.MAP_MODE == "viewport":
+        points = mapview.get_map_points()
+        index, counts = mapview.decimate(points, bounds, zoom)
+        fig = components.map_figure(points, index, counts)
+    else:
+        fig = components.map(utils.get_map_data(), mode=mapview.MAP_MODE).figure
+    fig.update_layout(
+        mapbox_center=center,
+        mapbox_zoom=zoom,
+        margin=dict(t=0, l=0, b=0, r=0),
+        uirevision=uirevision,
+    )
+    return fig
+
+
+# number of GAGEIDs offered by the gauge search dropdown
+GAGEID_SUGGESTIONS = 20
+
+
+@callback(
+    Output("gauge-search", "options"),
+    Input("gauge-search", "search_value"),
+    State("gauge-search", "value"),
+    prevent_initial_call=True,
+)
+@span("callback.gauge_options")
+def update_gauge_options(
+    search_value: Union[str, None], value: Union[str, None]
+) -> List[Dict[str, str]]:
+    """
+    Offers the GAGEIDs starting with the typed text, so that the full list
+    of ids is never sent to the browser.
+
+    Parameters
+    ----------
+    search_value: str
+        Text typed in the dropdown.
+    value: str
+        Selected GAGEID, kept in the options.
+
+    Returns
+    -------
+    List[Dict[str, str]]
+        Dropdown options
+    """
+    if not search_value:
+        if value:
+            return [dict(label=value, value=value)]
+        raise PreventUpdate
+    gageids = datastore.get_store().gageid_index.search(search_value, GAGEID_SUGGESTIONS)
+    # "search" keeps zero-padded typed ids matching on the browser side
+    return [dict(label=g, value=g, search=f"{g} {search_value}") for g in gageids]
+
+
+@callback(
+    Output("usgs_sites", "clickData"),
+    Output("usgs_sites", "selectedData"),
+    Output("map-focus", "data"),
+    Output("location-search-status", "children"),
+    Input("location-search-button", "n_clicks"),
+    Input("location-search", "n_submit"),
+    Input("gauge-search", "value"),
+    State("location-search", "value"),
+    prevent_initial_call=True,
+)
+@span("callback.location_search")
+def search_location(
+    n_clicks: int, n_submit: int, gageid: Union[str, None], text: Union[str, None]
+) -> Tuple[Any, Any, Any, str]:
+    """
+    Finds the gauge nearest to a "lat, lon" search, or the gauges within
+    the radius of a "lat, lon, radius km" search, or the gauge picked in
+    the GAGEID search. The map zooms to the location and the gauges are
+    computed as if clicked or selected on the map.
+
+    Parameters
+    ----------
+    n_clicks: int
+        Number of clicks on the Find button.
+    n_submit: int
+        Number of times Enter was pressed in the search box.
+    gageid: str
+        GAGEID picked in the gauge search.
+    text: str
+        Location search text.
+
+    Returns
+    -------
+    Tuple[Any, Any, Any, str]
+        Map clickData, map selectedData, map focus and a status message
+    """
+    points = mapview.get_map_points()
+    triggered = [t["prop_id"] for t in callback_context.triggered]
+    if "gauge-search.value" in triggered:
+        if not gageid:
+            raise PreventUpdate
+        gageid = datastore.normalize_gageid(gageid)
+        click = {"points": [{"hovertext": gageid}]}
+        pos = points.index.get(gageid)
+        if pos is None:
+            return click, no_update, no_update, f"Gauge {gageid} is not on the map"
+        focus = {"lat": float(points.lat[pos]), "lon": float(points.lon[pos]),
+                 "zoom": mapview.SEARCH_ZOOM}
+        return click, no_update, focus, f"Gauge {gageid}"
+
+    location = spatialindex.parse_location(text)
+    if location is None:
+        return no_update, no_update, no_update, "Enter a location as: lat, lon[, radius km]"
+    lat, lon, radius_km = location
+    index = spatialindex.get_index()
+
+    if radius_km is None:
+        nearest, distances = index.nearest(lat, lon, 1)
+        gageid = str(points.gageid[nearest[0]])
+        click = {"points": [{"hovertext": gageid, "lat": float(points.lat[nearest[0]]),
+                             "lon": float(points.lon[nearest[0]])}]}
+        focus = {"lat": float(points.lat[nearest[0]]), "lon": float(points.lon[nearest[0]]),
+                 "zoom": mapview.SEARCH_ZOOM}
+        return click, no_update, focus, f"Nearest gauge: {gageid}, {distances[0]:.1f} km away"
+
+    within, _ = index.within(lat, lon, radius_km)
+    focus = {"lat": lat, "lon": lon, "zoom": mapview.zoom_for_radius(radius_km)}
+    if len(within) == 0:
+        return no_update, no_update, focus, f"No gauges within {radius_km:g} km"
+    selection = {"points": [{"hovertext": str(g)} for g in points.gageid[within]]}
+    plural = "s" if len(within) > 1 else ""
+    return no_update, selection, focus, f"{len(within)} gauge{plural} within {radius_km:g} km"
+
+
+DEPENDENCY_QUALITY = {
+    0: ("red", "Poor"),
+    1: ("lightgreen", "Good"),
+    2: ("green", "Very Good"),
+    3: ("darkgreen", "Excellent"),
+}
+
+
+def get_dependency_color(value) -> Tuple[str, str]:
+    try:
+        # Convert the dependency value to a float.
+        val = int(value)
+    except (TypeError, ValueError):
+        return "black", "Unknown"  # default if conversion fails
+    return DEPENDENCY_QUALITY.get(val, ("black", "Unknown"))
+
+
+def quality_badge(color: str, quality: str) -> html.Div:
+    return html.Div(
+        str(quality),
+        style={
+            "background-color": color,
+            "color": "white",      # adjust text color for contrast
+            "padding": "10px",
+            "margin-left": "10px",
+            "display": "inline-block",
+            "border-radius": "5px"
+        }
+    )
+
+
 @callback(
     [
         Output("store-qtwsa", "data"),
         Output("spatial_dependency", "children"),
         Output("temporal_dependency", "children"),
+        Output("selection-status", "children"),
+        Output("active-gauges", "data"),
+        Output("job", "data"),
+        Output("job-poll", "disabled"),
     ],
     [
         Input("usgs_sites", "clickData"),
-        # Input("store-map", "data"),
-    ],
-    [
-        State("Model Regionalisation", "value"),
-        State("Model Spatial Feasibility", "value"),
-        State("Model Temporal Feasibility", "value"),
+        Input("usgs_sites", "selectedData"),
+        Input("Model Regionalisation", "value"),
+        Input("Model Spatial Feasibility", "value"),
+        Input("Model Temporal Feasibility", "value"),
+        Input("ensemble", "value"),
+        Input("job-poll", "n_intervals"),
     ],
+    State("active-gauges", "data"),
+    State("job", "data"),
     prevent_initial_call=True
 )
+@span("callback.figure_clicked")
 def figure_clicked_callback(
+    clickData: Dict[Any, Any],
     selectedData: Dict[Any, Any],
     model_regionalisation: str,
     model_spatial_feasibility: str,
     model_temporal_feasibility: str,
-) -> Union[str, None]:
-    
-    
-    start_time = time.time()
-    if selectedData is None:
+    ensemble: Union[List[str], None],
+    n_intervals: Union[int, None],
+    active: Union[Dict[str, Any], None],
+    job: Union[Dict[str, str], None],
+) -> Tuple[Any, ...]:
+    """
+    Computes the discharges of a clicked gauge, or of all gauges of a box
+    or lasso selection on the map, and recomputes them when a model
+    dropdown changes.
+
+    The gauges shown are kept in the active-gauges store, so a model
+    change recomputes them without a new click. handle_click caches the
+    model-independent series of each gauge, so a model change only redoes
+    the part of the computation that depends on that model.
+
+    The computation runs as a job of the jobs.JobQueue, so that it does
+    not hold a server thread. The callback waits up to
+    jobs.JOB_WAIT_SECONDS for the job and otherwise shows its progress,
+    and the job-poll interval calls back until it is done. A new click
+    releases the job of the previous one, which is cancelled unless
+    another browser waits for the same job. A running job stops at its
+    next click stage or selection gauge.
+
+    Parameters
+    ----------
+    clickData: Dict[Any, Any]
+        clickData of the map.
+    selectedData: Dict[Any, Any]
+        selectedData of the map.
+    model_regionalisation: str
+    model_spatial_feasibility: str
+    model_temporal_feasibility: str
+        Selected models.
+    ensemble: List[str]
+        ["ensemble"] to add the range of all regionalisation models to
+        the discharges of a clicked gauge.
+    n_intervals: int
+        Number of job-poll ticks.
+    active: Dict[str, Any]
+        {"click": gageid} or {"selection": [gageids]} of the shown
+        results, None before the first click.
+    job: Dict[str, str]
+        {"key": job key} of the unfinished job, None if there is none.
+
+    Returns
+    -------
+    Tuple[str, Any, Any, Any, Dict[str, Any], Dict[str, str], bool]
+        Result store key, spatial and temporal feasibility, the
+        selection status, the active gauges, the unfinished job and
+        whether polling is disabled
+    """
+    models = (model_regionalisation, model_spatial_feasibility, model_temporal_feasibility)
+    ensemble = "ensemble" in (ensemble or [])
+    triggered = [t["prop_id"] for t in callback_context.triggered]
+    if triggered == ["job-poll.n_intervals"]:
+        if job is None:
+            raise PreventUpdate
+        return job_outputs(job["key"], timeout=0)
+
+    # the job computes from the datasets of this request, and neither the
+    # job nor its results are shared with requests on other datasets
+    store = datastore.get_store()
+    if "usgs_sites.selectedData" in triggered:
+        gageids = mapview.selected_gauges(mapview.get_map_points(), selectedData)
+        if not gageids:
+            # the selection was cleared
+            raise PreventUpdate
+        key = sessionstore.make_key(
+            "job-selection", store.fingerprint, *sorted(gageids), *models
+        )
+
+        def work(context: jobs.JobContext) -> Tuple[Any, ...]:
+            res = selection_result(gageids, *models, progress=context.progress, store=store)
+            return res + (dict(selection=gageids),)
+
+    elif "usgs_sites.clickData" in triggered or (active is not None and "click" in active):
+        if "usgs_sites.clickData" in triggered:
+            if clickData is None:
+                raise PreventUpdate
+            station_id = datastore.normalize_gageid(clickData["points"][0]["hovertext"])
+        else:
+            station_id = active["click"]
+        # the discharges do not depend on the spatial model
+        spatial_only = triggered == ["Model Spatial Feasibility.value"]
+        key = sessionstore.make_key(
+            "job-click", store.fingerprint, station_id, *models, ensemble, spatial_only
+        )
+
+        def work(context: jobs.JobContext) -> Tuple[Any, ...]:
+            return click_result(
+                station_id,
+                *models,
+                ensemble=ensemble,
+                spatial_only=spatial_only,
+                progress=context.progress,
+                store=store,
+            )
+
+    elif active is None:
+        # a model changed before any gauge was shown
         raise PreventUpdate
+    else:
+        if triggered == ["ensemble.value"]:
+            # selections are shown without the model range
+            raise PreventUpdate
+        gageids = active["selection"]
+        key = sessionstore.make_key(
+            "job-selection-models", store.fingerprint, *sorted(gageids), *models
+        )
 
-    station_id = selectedData["points"][0]["hovertext"]
+        def work(context: jobs.JobContext) -> Tuple[Any, ...]:
+            res = selection_result(gageids, *models, progress=context.progress, store=store)
+            return res + (no_update,)
 
+    queue = jobs.get_job_queue()
+    rejoin = job is not None and job["key"] == key
+    if job is not None and not rejoin:
+        # the user moved on, the previous job is cancelled unless shared
+        queue.release(job["key"])
+    # e.g. the same gauge clicked again while it is computed: this browser
+    # waits for the job already and must not be counted twice
+    queue.submit(key, lambda context: _job_result(work(context)), rejoin=rejoin)
+    return job_outputs(key, timeout=jobs.JOB_WAIT_SECONDS)
+
+
+# job results are stored as JSON, which cannot hold no_update
+NO_UPDATE = "__no_update__"
+
+
+def _job_result(outputs: Tuple[Any, ...]) -> List[Any]:
+    return [NO_UPDATE if output is no_update else output for output in outputs]
+
+
+def _callback_outputs(result: List[Any]) -> Tuple[Any, ...]:
+    return tuple(no_update if output == NO_UPDATE else output for output in result)
+
+
+def job_outputs(key: str, timeout: float) -> Tuple[Any, ...]:
+    """
+    Waits up to `timeout` seconds for a job of figure_clicked_callback and
+    returns its outputs, or its progress if it is not done.
+    """
+    queue = jobs.get_job_queue()
+    with span("job.wait"):
+        status = queue.wait(key, timeout)
+    if status is None or status["status"] == jobs.CANCELLED:
+        message = "The computation was interrupted, please select the location again"
+        return no_update, no_update, no_update, message, no_update, None, True
+    if status["status"] == jobs.FAILED:
+        message = f"The computation failed: {status['message']}"
+        return no_update, no_update, no_update, message, no_update, None, True
+    if status["status"] == jobs.DONE:
+        return _callback_outputs(queue.result(key)) + (None, True)
+    message = status["message"] or "Computing..."
+    return no_update, no_update, no_update, message, no_update, dict(key=key), False
+
+
+def click_result(
+    station_id: str,
+    model_regionalisation: str,
+    model_spatial_feasibility: str,
+    model_temporal_feasibility: str,
+    ensemble: bool = False,
+    spatial_only: bool = False,
+    progress: Optional[Callable[[int, int, str], None]] = None,
+    store: Optional[datastore.GaugeDataStore] = None,
+) -> Tuple[Any, ...]:
+    """
+    Computes and stores the discharges of a clicked gauge, see
+    figure_clicked_callback for the returned outputs. With `spatial_only`
+    only the spatial feasibility is updated. `progress` is called with
+    the stages of the click done and to do, see utils.handle_click. The
+    result is stored under a key of the datasets of `store`, the
+    process-wide store if None.
+    """
+    models = (model_regionalisation, model_spatial_feasibility, model_temporal_feasibility)
+    store = store or datastore.get_store()
+
+    def report(done: int, total: int):
+        progress(done, total, f"Computing gauge {station_id}")
 
-    
     res = utils.handle_click(
-    station_id,
-    model_regionalisation,
-    model_spatial_feasibility,
-    model_temporal_feasibility,
+        station_id,
+        *models,
+        ensemble=ensemble,
+        store=store,
+        progress=report if progress else None,
     )
 
     discharge = res["discharges"]
 
-    # TODO: add a message to the UI indicating that USGS data was not available
-    if (discharge.empty):
-        return None
+    if res["message"] is not None:
+        # e.g. an unknown gauge typed in the search box
+        return None, None, None, res["message"], dict(click=station_id)
 
-    discharge.sort_values("datetime", inplace=True)
-    
     value_sd = res['spatial_discrepency']
     
-    def get_dependency_color(value):
-        try:
-            # Convert the dependency value to a float.
-            val = int(value)
-        except (TypeError, ValueError):
-           return "black" # default if conversion fails
-       
-        if val == 0:
-            return "red", "Poor"
-        elif val == 1:
-            return "lightgreen", "Good"
-        elif val == 2:
-            return "green", "Very Good"
-        elif val == 3:
-            return "darkgreen", "Excellent"
-        
     color_sd, quality_sd = get_dependency_color(value_sd)
     spatial_confidence = html.Div(["Spatial Feasibility: ",
-    html.Div(
-        str(quality_sd),
-        style={
-            "background-color": color_sd,
-            "color": "white",      # adjust text color for contrast
-            "padding": "10px",
-            "margin-left": "10px",
-            "display": "inline-block",
-            "border-radius": "5px"
-        }
-    )
-])
+        quality_badge(color_sd, quality_sd)
+    ])
     
     spatial_dependency = spatial_confidence
     temporal_dependency = f"Number of months with confident results: {res['temporal_discrepency']}"
-    end_time = time.time()
-    print("Generate Q Timeseries:      ", end_time - start_time)
-    return discharge.to_json(),spatial_dependency, temporal_dependency
+    if spatial_only:
+        return no_update, spatial_dependency, no_update, no_update, no_update
+
+    discharge.sort_values("datetime", inplace=True)
+    # keep the frame on the server, the browser only holds its key
+    key = sessionstore.make_key(store.fingerprint, station_id, *models, ensemble)
+    with span("result_store.put"):
+        sessionstore.get_result_store().put(key, discharge)
+
+    return key, spatial_dependency, temporal_dependency, None, dict(click=station_id)
+
+
+@span("callback.selection")
+def selection_result(
+    gageids: List[str],
+    model_regionalisation: str,
+    model_spatial_feasibility: str,
+    model_temporal_feasibility: str,
+    progress: Optional[Callable[[int, int, str], None]] = None,
+    store: Optional[datastore.GaugeDataStore] = None,
+) -> Tuple[Union[str, None], Any, Any, Any]:
+    """
+    Computes and stores the discharges of the gauges of a map selection,
+    see figure_clicked_callback for the returned outputs. `progress` is
+    called with the number of gauges done and to do. The result is
+    stored under a key of the datasets of `store`, the process-wide
+    store if None.
+    """
+    models = (model_regionalisation, model_spatial_feasibility, model_temporal_feasibility)
+    store = store or datastore.get_store()
+
+    def report(done: int, total: int):
+        progress(done, total, f"Computed {done} of {total} gauges")
+
+    res = utils.handle_selection(
+        gageids, *models, progress=report if progress else None, store=store
+    )
+    if res["computed"] == 0:
+        return None, None, None, f"No results for the {res['selected']} selected gauges"
+
+    # count gauges per spatial feasibility group, best group first
+    qualities = pd.Series(
+        [get_dependency_color(v) for v in res["spatial_discrepency"].values()]
+    ).value_counts()
+    spatial_dependency = html.Div(
+        ["Spatial Feasibility: "]
+        + [
+            quality_badge(color, f"{qualities[(color, quality)]} {quality}")
+            for color, quality in list(reversed(DEPENDENCY_QUALITY.values()))
+            + [("black", "Unknown")]
+            if (color, quality) in qualities
+        ]
+    )
+    months = pd.to_numeric(pd.Series(res["temporal_discrepency"]), errors="coerce")
+    temporal_dependency = (
+        f"Mean number of months with confident results: {months.mean():.1f}"
+    )
+
+    status = f"Computed {res['computed']} of {res['selected']} selected gauges"
+    if res["selected"] > utils.SELECTION_MAX_GAUGES:
+        status += f" (selections are limited to {utils.SELECTION_MAX_GAUGES} gauges)"
+
+    key = sessionstore.make_key(
+        "selection", store.fingerprint, *sorted(res["spatial_discrepency"]), *models
+    )
+    with span("result_store.put"):
+        sessionstore.get_result_store().put(key, res["discharges"])
+
+    return key, spatial_dependency, temporal_dependency, status
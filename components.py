@@ -1,13 +1,17 @@
 #!/usr/bin/env python3
 
-from dash import dcc
+from dash import dcc, html
 import dash_bootstrap_components as dbc
-from plotly import express as px
+import plotly.graph_objects as go
+import numpy as np
 import pandas as pd
 
+# local imports
+import mapview
+
 # typing imports
 import plotly.graph_objs._figure as graph_objects
-from typing import Dict, Tuple, Any
+from typing import List
 
 # shadow types
 MapDataframe = pd.DataFrame
@@ -52,8 +56,7 @@ def help(txt: str) -> dbc.Modal:
     return help_modal
 
 
-def map(map_data: MapDataframe,
-) -> Tuple[dcc.Graph, Dict[Any, Any]]:
+def map(map_data: MapDataframe, mode: str = mapview.MAP_MODE) -> dcc.Graph:
     """
     Builds the Dash map object
 
@@ -62,25 +65,36 @@ def map(map_data: MapDataframe,
     map_data: pandas.DataFrame
         Dataframe containing the USGS points as metadata to be displayed 
         on the map.
+    mode: str
+        "viewport" to send decimated points of the initial view, which are
+        refreshed as the map is panned and zoomed, or "full" to send every
+        gauge up front.
 
     Returns
     -------
     dcc.Graph
             Dash graph object
-    Dict[Any, Any]
-            Dictionary of map data
     """
-    # build the map object
-    fig = px.scatter_mapbox(
-        map_data,
-        lat='Lat',
-        lon='Lon',
-        hover_name="GAGEID",
-        hover_data=["GAGEID","area"],
-        mapbox_style="open-street-map",
-        zoom=1.5,
-        center={"lat": 20, "lon": 0}
-    )  # type: graph_objects.Figure
+    if mode == "viewport":
+        points = mapview.get_map_points(map_data)
+        bounds = mapview.bounds_from_view(mapview.INITIAL_CENTER, mapview.INITIAL_ZOOM)
+        index, counts = mapview.decimate(points, bounds, mapview.INITIAL_ZOOM)
+        fig = map_figure(points, index, counts)
+    else:
+        # plotly.express is slow to import and only used in this mode
+        from plotly import express as px
+
+        # build the map object
+        fig = px.scatter_mapbox(
+            map_data,
+            lat='Lat',
+            lon='Lon',
+            hover_name="GAGEID",
+            hover_data=["GAGEID","area"],
+            mapbox_style="open-street-map",
+            zoom=mapview.INITIAL_ZOOM,
+            center=mapview.INITIAL_CENTER,
+        )  # type: graph_objects.Figure
 
     # default 80 https://plotly.com/python/reference/layout/#layout-margin
     fig_margin = 0
@@ -96,4 +110,128 @@ def map(map_data: MapDataframe,
         id="usgs_sites",
         figure=fig,
         style={"height": "80vh"},
-    ), map_data.to_dict(orient="records")
+    )
+
+
+def map_figure(
+    points: mapview.MapPoints,
+    index: np.ndarray,
+    counts: np.ndarray,
+) -> graph_objects.Figure:
+    """
+    Builds the map figure for a decimated set of gauges.
+
+    Parameters
+    ----------
+    points: MapPoints
+        All gauge locations.
+    index: numpy.ndarray
+        Gauges to draw, see mapview.decimate.
+    counts: numpy.ndarray
+        Number of gauges each marker stands for.
+
+    Returns
+    -------
+    plotly.graph_objects.Figure
+            Map figure, with uirevision set so that the user's view is kept
+            when the markers are refreshed.
+    """
+    fig = go.Figure(
+        go.Scattermapbox(
+            lat=np.round(points.lat[index], 4),
+            lon=np.round(points.lon[index], 4),
+            # hovertext carries the GAGEID read by the click callbacks
+            hovertext=points.gageid[index],
+            customdata=np.column_stack([np.round(points.area[index]), counts]),
+            hovertemplate=(
+                "<b>%{hovertext}</b><br>area=%{customdata[0]}"
+                "<br>%{customdata[1]} gauge(s)<extra></extra>"
+            ),
+            marker=dict(size=np.minimum(6 + 2 * np.log2(counts), 16).round(1)),
+        )
+    )
+    fig.update_layout(
+        mapbox_style="open-street-map",
+        mapbox_zoom=mapview.INITIAL_ZOOM,
+        mapbox_center=mapview.INITIAL_CENTER,
+        uirevision="map",
+    )
+    return fig
+
+
+def discharge_map_colorscale() -> list:
+    """
+    Viridis over the discharge levels of mapview.DischargeFrames, with the
+    top level mapview.FRAME_GREY drawn grey.
+    """
+    from plotly.colors import sequential
+
+    top = (mapview.FRAME_LEVELS - 1) / mapview.FRAME_GREY
+    colors = sequential.Viridis
+    scale = [[top * i / (len(colors) - 1), c] for i, c in enumerate(colors)]
+    return scale + [[(top + 1) / 2, "lightgrey"], [1.0, "lightgrey"]]
+
+
+def discharge_map(points: mapview.MapPoints, labels: List[str]) -> html.Div:
+    """
+    Builds the discharge map: every gauge coloured by its predicted
+    discharge in the month of the slider below it.
+
+    The figure is sent once with grey markers. Moving the slider fetches
+    the colours of the month, see mapview.DischargeFrames, and a clientside
+    callback swaps them into the figure.
+
+    Parameters
+    ----------
+    points: MapPoints
+        All gauge locations.
+    labels: List[str]
+        Served months as YYYY-MM, see mapview.DischargeFrames.
+
+    Returns
+    -------
+    html.Div
+            Map, month slider and the store receiving the colours
+    """
+    fig = go.Figure(
+        go.Scattermapbox(
+            lat=np.round(points.lat, 4),
+            lon=np.round(points.lon, 4),
+            hovertext=points.gageid,
+            hoverinfo="text",
+            marker=dict(
+                size=6,
+                color=np.full(len(points), mapview.FRAME_GREY, dtype="uint8"),
+                cmin=0,
+                cmax=mapview.FRAME_GREY,
+                colorscale=discharge_map_colorscale(),
+                colorbar=dict(title="Q"),
+            ),
+        )
+    )
+    fig.update_layout(
+        mapbox_style="open-street-map",
+        mapbox_zoom=mapview.INITIAL_ZOOM,
+        mapbox_center=mapview.INITIAL_CENTER,
+        margin=dict(t=30, l=0, b=0, r=0),
+        uirevision="discharge-map",
+    )
+    last = max(len(labels) - 1, 0)
+    # a mark every other January
+    marks = {i: label[:4] for i, label in enumerate(labels) if label.endswith("-01")}
+    marks = {i: marks[i] for i in list(marks)[::2]}
+    return html.Div(
+        [
+            dcc.Graph(id="discharge-map", figure=fig, style={"height": "70vh"}),
+            dcc.Slider(
+                id="discharge-map-month",
+                min=0,
+                max=last,
+                step=1,
+                value=last,
+                marks=marks,
+                updatemode="drag",
+            ),
+            dcc.Store(id="discharge-map-frame"),
+        ]
+    )
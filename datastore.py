@@ -0,0 +1,874 @@
+#!/usr/bin/env python3
+
+import copy
+import hashlib
+import itertools
+import json
+import os
+import re
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+# typing imports
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# local imports
+from logging_config import get_logger
+
+
+# instantiate logger
+logger = get_logger(__name__)
+
+
+DATA_DIR = os.environ.get("QTWSA_DATA_DIR", "static/data")
+
+# last TWSA date served by the app; unset, every month of the TWSA data
+# is served, including months appended later, see GaugeDataStore.refresh
+TWSA_CUTOFF = os.environ.get("QTWSA_TWSA_CUTOFF")
+
+DATES_FILE = "datesnumberfrombase_TWSA1.csv"
+MODELS_FILE = "global_gauges_models.csv"
+TWSA_FILE = "TWSA_gauges_global.csv"
+OBSERVATIONS_FILE = "global_gauges_q.csv"
+
+BINARY_DIR = "binary"
+
+# files written by convert_to_binary, relative to BINARY_DIR
+TWSA_VALUES_FILE = "twsa_values.npy"
+TWSA_COMIDS_FILE = "twsa_comids.npy"
+OBSERVATION_GAGEIDS_FILE = "obs_gageids.npy"
+OBSERVATION_OFFSETS_FILE = "obs_offsets.npy"
+OBSERVATION_DATES_FILE = "obs_dates.npy"
+OBSERVATION_MONTHS_FILE = "obs_months.npy"
+OBSERVATION_Q_FILE = "obs_q.npy"
+BINARY_FILES = [
+    TWSA_VALUES_FILE,
+    TWSA_COMIDS_FILE,
+    OBSERVATION_GAGEIDS_FILE,
+    OBSERVATION_OFFSETS_FILE,
+    OBSERVATION_DATES_FILE,
+    OBSERVATION_MONTHS_FILE,
+    OBSERVATION_Q_FILE,
+]
+
+# files each dataset is read from, in either layout; a store reloads the
+# datasets whose files changed, see GaugeDataStore.refresh
+DATASET_FILES = {
+    "dates": [DATES_FILE],
+    "models": [MODELS_FILE],
+    "twsa": [
+        TWSA_FILE,
+        os.path.join(BINARY_DIR, TWSA_COMIDS_FILE),
+        os.path.join(BINARY_DIR, TWSA_VALUES_FILE),
+    ],
+    "observations": [OBSERVATIONS_FILE] + [
+        os.path.join(BINARY_DIR, name)
+        for name in BINARY_FILES
+        if name not in (TWSA_COMIDS_FILE, TWSA_VALUES_FILE)
+    ],
+}
+
+# prefixes of the monthly 0/1 feasibility flag columns, "<month>_<model>"
+MONTH_NAMES = [
+    "Jan", "Feb", "March", "April", "May", "June",
+    "July", "Aug", "Sept", "Oct", "Nov", "Dec",
+]
+
+# bit of each calendar month in the month bitmasks of ParameterTable
+MONTH_BITS = (1 << np.arange(12)).astype("uint16")
+
+
+# numeric USGS ids, possibly zero-padded or read as floats ("01646500", "1646500.0")
+NUMERIC_GAGEID = re.compile(r"^\d+(\.0*)?$")
+
+
+def normalize_gageid(gageid) -> str:
+    """
+    Canonical string key of a GAGEID.
+
+    Numeric ids, whether given as int, float or zero-padded string, map
+    to their integer digits; prefixed ids such as ADHI_1038 are kept as
+    they are, without surrounding whitespace.
+
+    Parameters
+    ----------
+    gageid: Union[str, int, float]
+        Gauge identifier
+
+    Returns
+    -------
+    str
+        Canonical GAGEID
+    """
+    text = str(gageid).strip()
+    if NUMERIC_GAGEID.match(text):
+        return str(int(text.split(".")[0]))
+    return text
+
+
+class GageIdIndex:
+    """
+    Sorted, case-insensitive index of GAGEIDs for prefix search.
+
+    A prefix query is two binary searches over the sorted keys, and its
+    cost does not grow with the catalogue beyond the log of its size.
+
+    Parameters
+    ----------
+    gageids: Iterable[str]
+        Canonical GAGEIDs, see normalize_gageid.
+    """
+
+    def __init__(self, gageids: Iterable[str]):
+        gageids = np.array(list(gageids), dtype="U")
+        keys = np.char.lower(gageids)
+        order = np.argsort(keys, kind="stable")
+        self.gageids = gageids[order]
+        self.keys = keys[order]
+
+    def __len__(self) -> int:
+        return len(self.gageids)
+
+    def search(self, prefix: str, limit: int = 20) -> List[str]:
+        """
+        GAGEIDs starting with `prefix`, in sorted order.
+
+        Parameters
+        ----------
+        prefix: str
+            Start of the GAGEID, case-insensitive. Leading zeros of
+            numeric ids are ignored.
+        limit: int
+            Maximum number of GAGEIDs returned.
+
+        Returns
+        -------
+        List[str]
+            Matching canonical GAGEIDs
+        """
+        prefix = prefix.strip().lower()
+        if prefix.isdigit():
+            prefix = prefix.lstrip("0")
+        start = self.keys.searchsorted(prefix, "left")
+        stop = self.keys.searchsorted(prefix + "\U0010ffff", "left")
+        return self.gageids[start:min(stop, start + limit)].tolist()
+
+
+def to_month_index(dates: np.ndarray) -> np.ndarray:
+    """
+    Converts dates into months since 1970-01.
+
+    Parameters
+    ----------
+    dates: numpy.ndarray
+        datetime64 values
+
+    Returns
+    -------
+    numpy.ndarray
+        int32 month indices
+    """
+    return np.asarray(dates).astype("datetime64[M]").astype("int32")
+
+
+def parse_cutoff(cutoff: Optional[str]) -> Optional[np.datetime64]:
+    if cutoff is None or str(cutoff).lower() in ("", "none"):
+        return None
+    return np.datetime64(pd.Timestamp(cutoff).normalize().to_datetime64(), "ns")
+
+
+class MonthAxis:
+    """
+    Monthly time axis of the TWSA matrix, built once at load time.
+
+    Every TWSA column is mapped to an integer month index (months since
+    1970-01) so that observations can be aligned by a vectorized gather
+    instead of parsing dates and merging per request.
+
+    Parameters
+    ----------
+    datetimes: numpy.ndarray
+        datetime64 of each TWSA column.
+    cutoff: str
+        Last date served by the app, every column if None or "none".
+    """
+
+    def __init__(self, datetimes: np.ndarray, cutoff: Optional[str] = TWSA_CUTOFF):
+        self.datetimes = np.asarray(datetimes, dtype="datetime64[ns]")
+        self.months = to_month_index(self.datetimes)
+        self.month_of_year = (self.months % 12 + 1).astype("int8")
+        self.year = (self.months // 12 + 1970).astype("int16")
+        self.cutoff = parse_cutoff(cutoff)
+        if self.cutoff is None:
+            self.columns = np.arange(len(self.datetimes))
+        else:
+            self.columns = np.flatnonzero(self.datetimes <= self.cutoff)
+
+    def __len__(self) -> int:
+        return len(self.columns)
+
+    def align(self, obs_months: np.ndarray, obs_values: np.ndarray) -> np.ndarray:
+        """
+        Gathers a monthly series onto the served TWSA columns.
+
+        Parameters
+        ----------
+        obs_months: numpy.ndarray
+            Sorted month indices of the series.
+        obs_values: numpy.ndarray
+            Values of the series.
+
+        Returns
+        -------
+        numpy.ndarray
+            float64 values, one per served TWSA column, NaN for months
+            without a value.
+        """
+        months = self.months[self.columns]
+        aligned = np.full(len(months), np.nan)
+        if len(obs_months):
+            pos = np.searchsorted(obs_months, months)
+            pos[pos == len(obs_months)] = 0
+            found = obs_months[pos] == months
+            aligned[found] = obs_values[pos[found]]
+        return aligned
+
+
+class ParameterTable:
+    """
+    Compact, array-backed copy of the model parameter table.
+
+    Float columns such as alpha and beta are float32 and integer columns
+    that fit, such as the spatial groups and numbers of feasible months,
+    uint8. The 12 monthly flag columns of each temporal model are packed
+    into one uint16 bitmask per gauge, January in bit 0, and decoded with
+    bit operations. Columns are read by name, e.g. `table["GP_alpha"]`,
+    and one gauge at a time with row().
+
+    Parameters
+    ----------
+    models: pandas.DataFrame
+        Model table as read from MODELS_FILE.
+    """
+
+    def __init__(self, models: pd.DataFrame):
+        self.gageid = models["GAGEID"].values.astype("U")
+        self.comid = models["COMID"].values.astype("int64")
+
+        groups = {}  # type: Dict[str, Dict[str, str]]
+        for name in models.columns:
+            month, _, model = name.partition("_")
+            if month in MONTH_NAMES and model:
+                groups.setdefault(model, {})[month] = name
+        packed = {model: group for model, group in groups.items() if len(group) == 12}
+        self.month_masks = {}  # type: Dict[str, np.ndarray]
+        for model, group in packed.items():
+            flags = models[[group[month] for month in MONTH_NAMES]].values == 1
+            self.month_masks[model] = (flags * MONTH_BITS).sum(axis=1).astype("uint16")
+        flag_columns = {name for group in packed.values() for name in group.values()}
+
+        self.columns = {}  # type: Dict[str, np.ndarray]
+        for name in models.columns:
+            if name in ("GAGEID", "COMID") or name in flag_columns:
+                continue
+            values = models[name].values
+            if values.dtype.kind == "f":
+                values = values.astype("float32")
+            elif values.dtype.kind in "iu" and (
+                len(values) == 0 or (values.min() >= 0 and values.max() <= 255)
+            ):
+                values = values.astype("uint8")
+            self.columns[name] = values
+
+    def __len__(self) -> int:
+        return len(self.comid)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.columns
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.gageid, self.comid]
+        arrays += list(self.columns.values()) + list(self.month_masks.values())
+        return sum(a.nbytes for a in arrays)
+
+    def month_flags(self, temporal_model: str) -> np.ndarray:
+        """
+        Decodes the monthly flags of a temporal model.
+
+        Returns
+        -------
+        numpy.ndarray
+            bool gauges x 12 calendar months
+        """
+        return self.month_masks[temporal_model][:, None] & MONTH_BITS != 0
+
+    def predicted_months(self, temporal_model: str, row: int) -> np.ndarray:
+        """
+        Returns the 12 monthly flags of a temporal model for one gauge.
+        """
+        return int(self.month_masks[temporal_model][row]) & MONTH_BITS != 0
+
+    def row(self, row: int) -> Dict[str, object]:
+        """
+        Returns every value of one gauge as Python scalars: COMID, the
+        columns and the month bitmask of each temporal model.
+        """
+        values = dict(GAGEID=str(self.gageid[row]), COMID=int(self.comid[row]))
+        values.update((name, column[row].item()) for name, column in self.columns.items())
+        values.update((model, int(mask[row])) for model, mask in self.month_masks.items())
+        return values
+
+
+# GaugeDataStore.version of each store built by this process
+_versions = itertools.count(1)
+
+
+class GaugeDataStore:
+    """
+    Read-only, indexed copy of the gauge datasets used to compute QTWSA.
+
+    The tables are loaded once and indexed by GAGEID and COMID so that a
+    map click resolves its rows through dictionary lookups instead of
+    scanning the full tables.
+
+    Model parameters are held in a compact ParameterTable. TWSA is held
+    as a COMID x month float32 matrix. Observations are held
+    CSR-style: the series of gauge `obs_gageids[i]` is stored in
+    `obs_dates[obs_offsets[i]:obs_offsets[i + 1]]`, sorted by date, and the
+    matching slices of `obs_months` and `obs_q`. When loaded from the
+    binary layout all of these arrays are memory-mapped, so a lookup only
+    touches the pages of that gauge.
+
+    A store is never modified once built: refresh() returns a new store
+    when the files change, and `version` tells the two apart.
+    """
+
+    def __init__(
+        self,
+        dates: pd.DataFrame,
+        models: pd.DataFrame,
+        twsa_comids: np.ndarray,
+        twsa_values: np.ndarray,
+        obs_gageids: np.ndarray,
+        obs_offsets: np.ndarray,
+        obs_dates: np.ndarray,
+        obs_months: np.ndarray,
+        obs_q: np.ndarray,
+        cutoff: Optional[str] = TWSA_CUTOFF,
+    ):
+        self.version = next(_versions)
+        # last TWSA date served, as given
+        self.cutoff = cutoff
+        # set by the loaders, see refresh
+        self.data_dir = None  # type: Optional[str]
+        self.binary = False
+        self.sources = {}  # type: Dict[str, list]
+        self.twsa_header = None  # type: Optional[List[str]]
+
+        self.dates = dates
+        self.twsa_comids = twsa_comids
+        self.twsa_values = twsa_values
+        self.axis = MonthAxis(
+            dates["datetime"].values[: twsa_values.shape[1]], cutoff
+        )
+        self._index_twsa()
+        self._index_parameters(ParameterTable(models))
+        self._index_observations(obs_gageids, obs_offsets, obs_dates, obs_months, obs_q)
+
+    def _index_twsa(self):
+        self.comid_index = {}  # type: Dict[int, int]
+        for pos, comid in enumerate(self.twsa_comids):
+            self.comid_index.setdefault(int(comid), pos)
+
+    def _index_parameters(self, parameters: ParameterTable):
+        self.parameters = parameters
+        # first occurrence wins, matching the previous `.values[0]` lookups;
+        # keys are canonical GAGEIDs, see normalize_gageid
+        self.gauge_index = {}  # type: Dict[str, int]
+        for pos, gageid in enumerate(parameters.gageid):
+            self.gauge_index.setdefault(normalize_gageid(gageid), pos)
+        self.gageid_index = GageIdIndex(self.gauge_index)
+
+        # TWSA row of every gauge in the model table, -1 if it has none
+        self.gauge_twsa_rows = np.array(
+            [self.comid_index.get(int(comid), -1) for comid in parameters.comid],
+            dtype="int64",
+        )
+
+    def _index_observations(
+        self,
+        obs_gageids: np.ndarray,
+        obs_offsets: np.ndarray,
+        obs_dates: np.ndarray,
+        obs_months: np.ndarray,
+        obs_q: np.ndarray,
+    ):
+        self.obs_gageids = obs_gageids
+        self.obs_offsets = obs_offsets
+        self.obs_dates = obs_dates
+        self.obs_months = obs_months
+        self.obs_q = obs_q
+        # first occurrence wins, as in gauge_index
+        self.observation_index = {}  # type: Dict[str, int]
+        for pos, gageid in enumerate(obs_gageids):
+            self.observation_index.setdefault(normalize_gageid(gageid), pos)
+
+    @classmethod
+    def load(
+        cls, data_dir: str = DATA_DIR, cutoff: Optional[str] = TWSA_CUTOFF
+    ) -> "GaugeDataStore":
+        """
+        Loads the gauge datasets, preferring the binary layout written by
+        `convert_to_binary` when it is present and up to date.
+
+        Parameters
+        ----------
+        data_dir: str
+            Directory containing the TWSA, model and observation files.
+        cutoff: str
+            Last TWSA date served, see MonthAxis.
+
+        Returns
+        -------
+        GaugeDataStore
+            Indexed datasets
+        """
+        if binary_is_current(data_dir):
+            return cls.from_binary(data_dir, cutoff)
+        return cls.from_csv(data_dir, cutoff)
+
+    @classmethod
+    def from_csv(
+        cls, data_dir: str = DATA_DIR, cutoff: Optional[str] = TWSA_CUTOFF
+    ) -> "GaugeDataStore":
+        """
+        Loads the gauge datasets from the csv files in `data_dir`.
+
+        Parameters
+        ----------
+        data_dir: str
+            Directory containing the TWSA, model and observation csv files.
+        cutoff: str
+            Last TWSA date served, see MonthAxis.
+
+        Returns
+        -------
+        GaugeDataStore
+            Indexed datasets
+        """
+        sources = source_files(data_dir)
+        twsa_header, twsa_comids, twsa_values = _read_twsa_csv(data_dir)
+        store = cls(
+            _read_dates(data_dir),
+            _read_models(data_dir),
+            twsa_comids,
+            twsa_values,
+            *_read_observations_csv(data_dir),
+            cutoff,
+        )
+        store.data_dir, store.sources = data_dir, sources
+        store.twsa_header = twsa_header
+        logger.info(f"Loaded gauge datasets from csv files in {data_dir}")
+        return store
+
+    @classmethod
+    def from_binary(
+        cls, data_dir: str = DATA_DIR, cutoff: Optional[str] = TWSA_CUTOFF
+    ) -> "GaugeDataStore":
+        """
+        Memory-maps the binary layout written by `convert_to_binary`.
+
+        Parameters
+        ----------
+        data_dir: str
+            Directory containing the csv files and the binary directory.
+        cutoff: str
+            Last TWSA date served, see MonthAxis.
+
+        Returns
+        -------
+        GaugeDataStore
+            Indexed datasets backed by read-only memory maps
+        """
+        sources = source_files(data_dir)
+        store = cls(
+            _read_dates(data_dir),
+            _read_models(data_dir),
+            *_map_twsa_binary(data_dir),
+            *_map_observations_binary(data_dir),
+            cutoff,
+        )
+        store.data_dir, store.sources = data_dir, sources
+        store.binary = True
+        logger.info(f"Memory-mapped gauge datasets from {os.path.join(data_dir, BINARY_DIR)}")
+        return store
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Identifies the datasets across processes, e.g. in the keys of the
+        job and result stores shared by the workers: stores loaded from the
+        same files with the same cutoff have the same fingerprint, while
+        `version` only tells apart the stores of one process.
+        """
+        if not self.sources:
+            return f"{os.getpid()}-{self.version}"
+        identity = [self.data_dir, str(self.cutoff), self.sources]
+        return hashlib.sha1(json.dumps(identity, sort_keys=True).encode()).hexdigest()[:16]
+
+    def changes(self) -> Set[str]:
+        """
+        Datasets whose files changed since they were loaded, see
+        DATASET_FILES. Only the size and mtime of the files are read.
+        """
+        if self.data_dir is None:
+            return set()
+        return changed_datasets(self.sources, source_files(self.data_dir))
+
+    def refresh(self) -> "GaugeDataStore":
+        """
+        Returns the datasets as their files are now.
+
+        Only the datasets whose files changed are read again, the others
+        are shared with this store. TWSA months appended to the csv file
+        are read alone and added to the loaded matrix, and served unless
+        they are after the cutoff, see TWSA_CUTOFF. A switch between
+        the csv and binary layouts, see binary_is_current, reloads
+        everything.
+
+        Returns
+        -------
+        GaugeDataStore
+            This store if no file changed, else a new store
+        """
+        if self.data_dir is None:
+            return self
+        sources = source_files(self.data_dir)
+        changed = changed_datasets(self.sources, sources)
+        if not changed:
+            return self
+        binary = binary_is_current(self.data_dir)
+        if binary != self.binary:
+            logger.info(f"Gauge datasets in {self.data_dir} changed layout, reloading")
+            return self.from_binary(self.data_dir, self.cutoff) if binary else (
+                self.from_csv(self.data_dir, self.cutoff)
+            )
+
+        start = time.perf_counter()
+        store = copy.copy(self)
+        store.version = next(_versions)
+        store.sources = sources
+        if "twsa" in changed:
+            if binary:
+                store.twsa_comids, store.twsa_values = _map_twsa_binary(self.data_dir)
+            else:
+                twsa = _append_twsa_csv(self.data_dir, self) or _read_twsa_csv(self.data_dir)
+                store.twsa_header, store.twsa_comids, store.twsa_values = twsa
+            store._index_twsa()
+        if changed & {"dates", "twsa"}:
+            store.dates = _read_dates(self.data_dir)
+            store.axis = MonthAxis(
+                store.dates["datetime"].values[: store.twsa_values.shape[1]],
+                self.cutoff,
+            )
+        if changed & {"models", "twsa"}:
+            parameters = self.parameters
+            if "models" in changed:
+                parameters = ParameterTable(_read_models(self.data_dir))
+            store._index_parameters(parameters)
+        if "observations" in changed:
+            if binary:
+                store._index_observations(*_map_observations_binary(self.data_dir))
+            else:
+                store._index_observations(*_read_observations_csv(self.data_dir))
+        logger.info(
+            f"Reloaded {', '.join(sorted(changed))} from {self.data_dir} "
+            f"in {time.perf_counter() - start:.2f} s"
+        )
+        return store
+
+    def gauge_row(self, gageid: str) -> int:
+        """
+        Returns the position of a gauge in the model table, raising
+        KeyError for unknown gauges.
+
+        Parameters
+        ----------
+        gageid: str
+            Gauge identifier, in any form accepted by normalize_gageid
+
+        Returns
+        -------
+        int
+            Row of the model parameter table
+        """
+        return self.gauge_index[normalize_gageid(gageid)]
+
+    def twsa(self, comid: int) -> np.ndarray:
+        """
+        Returns the monthly TWSA series of a catchment.
+
+        Parameters
+        ----------
+        comid: int
+            Catchment identifier
+
+        Returns
+        -------
+        numpy.ndarray
+            TWSA values, one per row of the dates table
+        """
+        return self.twsa_values[self.comid_index[int(comid)]]
+
+    def observation_series(self, gageid: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the in-situ discharge observations of a gauge.
+
+        Parameters
+        ----------
+        gageid: str
+            Gauge identifier
+
+        Returns
+        -------
+        Tuple[numpy.ndarray, numpy.ndarray]
+            Sorted month indices and observed discharge, empty if the
+            gauge has no observations.
+        """
+        pos = self.observation_index.get(normalize_gageid(gageid))
+        if pos is None:
+            return self.obs_months[:0], self.obs_q[:0]
+        start, stop = self.obs_offsets[pos], self.obs_offsets[pos + 1]
+        return self.obs_months[start:stop], self.obs_q[start:stop]
+
+
+def _read_dates(data_dir: str) -> pd.DataFrame:
+    dates = pd.read_csv(os.path.join(data_dir, DATES_FILE), usecols=range(2))
+    dates["datetime"] = pd.to_datetime(dates["datetime"]).dt.normalize()
+    return dates
+
+
+def _read_models(data_dir: str) -> pd.DataFrame:
+    return pd.read_csv(os.path.join(data_dir, MODELS_FILE), dtype={"GAGEID": str})
+
+
+def _read_twsa_csv(data_dir: str) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    # month column names, COMIDs and the float32 TWSA matrix
+    twsa = pd.read_csv(os.path.join(data_dir, TWSA_FILE))
+    twsa_comids = twsa["COMID"].values.astype("int64")
+    twsa = twsa.drop(columns="COMID")
+    return list(twsa.columns), twsa_comids, twsa.values.astype("float32")
+
+
+def _append_twsa_csv(
+    data_dir: str, store: "GaugeDataStore"
+) -> Optional[Tuple[List[str], np.ndarray, np.ndarray]]:
+    # reads only the month columns added after those of `store`, None if
+    # the file changed otherwise; the last known month is read again as a
+    # check that the file was appended to
+    path = os.path.join(data_dir, TWSA_FILE)
+    header = list(pd.read_csv(path, nrows=0).columns.drop("COMID"))
+    known = store.twsa_header
+    if known is None or len(header) <= len(known) or header[: len(known)] != known:
+        return None
+    added = header[len(known):]
+    twsa = pd.read_csv(path, usecols=["COMID"] + known[-1:] + added)
+    if not np.array_equal(twsa["COMID"].values, store.twsa_comids):
+        return None
+    if known and not np.array_equal(
+        twsa[known[-1]].values.astype("float32"), store.twsa_values[:, -1], equal_nan=True
+    ):
+        return None
+    logger.info(f"{len(added)} months appended to {path}")
+    values = np.hstack([store.twsa_values, twsa[added].values.astype("float32")])
+    return header, store.twsa_comids, values
+
+
+def _read_observations_csv(data_dir: str) -> Tuple[np.ndarray, ...]:
+    # observations in the CSR layout of GaugeDataStore
+    observations = pd.read_csv(
+        os.path.join(data_dir, OBSERVATIONS_FILE),
+        usecols=["GAGEID", "date", "Q_mon"],
+        dtype={"GAGEID": str},
+    )
+    observations["date"] = pd.to_datetime(observations["date"])
+    # ids of one gauge spelled differently, e.g. "01646500" and "1646500":
+    # the first in the file wins, as in the model table
+    first = {}  # type: Dict[str, str]
+    for gageid in observations["GAGEID"].unique():
+        first.setdefault(normalize_gageid(gageid), gageid)
+    if len(first) < observations["GAGEID"].nunique(dropna=False):
+        observations = observations[observations["GAGEID"].isin(list(first.values()))]
+    observations = observations.sort_values(["GAGEID", "date"], kind="stable")
+    gageids = observations["GAGEID"].values
+    starts = np.flatnonzero(np.r_[True, gageids[1:] != gageids[:-1]])
+    if not len(gageids):
+        starts = starts[:0]
+    obs_gageids = gageids[starts].astype("str")
+    obs_offsets = np.r_[starts, len(gageids)].astype("int64")
+    obs_dates = observations["date"].values.astype("datetime64[D]")
+    obs_months = to_month_index(obs_dates)
+    obs_q = observations["Q_mon"].values.astype("float32")
+    return obs_gageids, obs_offsets, obs_dates, obs_months, obs_q
+
+
+def _map_twsa_binary(data_dir: str) -> Tuple[np.ndarray, np.ndarray]:
+    binary_dir = os.path.join(data_dir, BINARY_DIR)
+    return (
+        np.load(os.path.join(binary_dir, TWSA_COMIDS_FILE)),
+        np.load(os.path.join(binary_dir, TWSA_VALUES_FILE), mmap_mode="r"),
+    )
+
+
+def _map_observations_binary(data_dir: str) -> Tuple[np.ndarray, ...]:
+    binary_dir = os.path.join(data_dir, BINARY_DIR)
+
+    def mmap(name):
+        return np.load(os.path.join(binary_dir, name), mmap_mode="r")
+
+    return (
+        np.load(os.path.join(binary_dir, OBSERVATION_GAGEIDS_FILE)),
+        np.load(os.path.join(binary_dir, OBSERVATION_OFFSETS_FILE)),
+        mmap(OBSERVATION_DATES_FILE),
+        mmap(OBSERVATION_MONTHS_FILE),
+        mmap(OBSERVATION_Q_FILE),
+    )
+
+
+def source_files(data_dir: str = DATA_DIR) -> Dict[str, list]:
+    """
+    Size and mtime of the files of every dataset, see DATASET_FILES.
+
+    Parameters
+    ----------
+    data_dir: str
+        Directory containing the gauge datasets.
+
+    Returns
+    -------
+    Dict[str, list]
+        [name, size, mtime] of each file of a dataset, size and mtime
+        are None for missing files
+    """
+    sources = {}
+    for dataset, names in DATASET_FILES.items():
+        sources[dataset] = []
+        for name in names:
+            try:
+                st = os.stat(os.path.join(data_dir, name))
+            except OSError:
+                sources[dataset].append([name, None, None])
+            else:
+                sources[dataset].append([name, st.st_size, st.st_mtime_ns])
+    return sources
+
+
+def changed_datasets(old: Dict[str, list], new: Dict[str, list]) -> Set[str]:
+    """
+    Datasets whose files differ between two source_files results.
+    """
+    return {dataset for dataset in new if new[dataset] != old.get(dataset)}
+
+
+def binary_is_current(data_dir: str = DATA_DIR) -> bool:
+    """
+    Checks whether the binary layout exists and is newer than the csv
+    files it was converted from.
+
+    Parameters
+    ----------
+    data_dir: str
+        Directory containing the csv files and the binary directory.
+
+    Returns
+    -------
+    bool
+        True if `GaugeDataStore.from_binary` can be used
+    """
+    binary_file = os.path.join(data_dir, BINARY_DIR, TWSA_VALUES_FILE)
+    for name in BINARY_FILES:
+        if not os.path.exists(os.path.join(data_dir, BINARY_DIR, name)):
+            return False
+    converted = os.path.getmtime(binary_file)
+    for name in (TWSA_FILE, OBSERVATIONS_FILE):
+        source = os.path.join(data_dir, name)
+        if os.path.exists(source) and os.path.getmtime(source) > converted:
+            logger.warning(f"{source} is newer than its binary copy, using csv")
+            return False
+    return True
+
+
+def convert_to_binary(data_dir: str = DATA_DIR) -> str:
+    """
+    Converts the TWSA and observation csv files into the binary layout
+    read by `GaugeDataStore.from_binary`.
+
+    Parameters
+    ----------
+    data_dir: str
+        Directory containing the TWSA and observation csv files.
+
+    Returns
+    -------
+    str
+        Path of the binary directory
+    """
+    store = GaugeDataStore.from_csv(data_dir)
+    binary_dir = os.path.join(data_dir, BINARY_DIR)
+    os.makedirs(binary_dir, exist_ok=True)
+
+    # the TWSA matrix goes last, its mtime marks the conversion as complete
+    arrays = [
+        (TWSA_COMIDS_FILE, store.twsa_comids),
+        (OBSERVATION_GAGEIDS_FILE, store.obs_gageids),
+        (OBSERVATION_OFFSETS_FILE, store.obs_offsets),
+        (OBSERVATION_DATES_FILE, store.obs_dates),
+        (OBSERVATION_MONTHS_FILE, store.obs_months),
+        (OBSERVATION_Q_FILE, store.obs_q),
+        (TWSA_VALUES_FILE, np.ascontiguousarray(store.twsa_values)),
+    ]
+    for name, values in arrays:
+        path = os.path.join(binary_dir, name)
+        with open(path + ".tmp", "wb") as f:
+            np.save(f, values)
+        os.replace(path + ".tmp", path)
+        logger.info(f"Wrote {path} {values.dtype} {values.shape}")
+
+    return binary_dir
+
+
+_store = None  # type: Optional[GaugeDataStore]
+_store_lock = threading.Lock()
+
+
+def get_store() -> GaugeDataStore:
+    """
+    Returns the process-wide GaugeDataStore, loading it on first use.
+
+    Returns
+    -------
+    GaugeDataStore
+        Shared, read-only datasets
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = GaugeDataStore.load(DATA_DIR)
+    return _store
+
+
+def set_store(store: GaugeDataStore):
+    """
+    Replaces the process-wide GaugeDataStore, e.g. by a refreshed one.
+    Requests that already hold the previous store keep using it.
+    """
+    global _store
+    with _store_lock:
+        _store = store
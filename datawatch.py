@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+import os
+import threading
+import time
+
+# typing imports
+from typing import Optional, Set
+
+# local imports
+import datastore
+import mapview
+import precompute
+import skill
+import utils
+import warmup
+from logging_config import get_logger
+
+
+# instantiate logger
+logger = get_logger(__name__)
+
+
+# seconds between two looks at the data files, 0 disables the watcher
+WATCH_SECONDS = float(os.environ.get("QTWSA_DATA_WATCH_SECONDS", 60))
+
+# caches derived from each dataset, see invalidate
+DERIVED_FROM = {
+    "dates": {"clicks", "partitions", "frames", "skill"},
+    "twsa": {"clicks", "partitions", "frames", "skill"},
+    "models": {"clicks", "partitions", "frames", "skill"},
+    "observations": {"clicks", "skill"},
+}
+
+_reload_lock = threading.Lock()
+
+
+def invalidate(changed: Set[str]):
+    """
+    Empties the caches derived from the changed datasets. The map points
+    and their spatial index come from the shapefile and are kept.
+
+    The partitions, frames and scores go first: the click caches are
+    keyed by store version, but are filled from those caches, so a click
+    computed meanwhile could otherwise keep values of the old datasets
+    under the new version.
+
+    Parameters
+    ----------
+    changed: Set[str]
+        Changed datasets, keys of datastore.DATASET_FILES.
+    """
+    caches = set().union(*(DERIVED_FROM[dataset] for dataset in changed))
+    if "partitions" in caches:
+        precompute.clear_partitions()
+    if "frames" in caches:
+        mapview.clear_frames()
+    if "skill" in caches:
+        skill.clear_scores()
+    if "clicks" in caches:
+        utils.clear_caches()
+
+
+def reload() -> Set[str]:
+    """
+    Reloads the datasets whose files changed and swaps them in.
+
+    The refreshed store is built while the current one keeps serving,
+    then replaces it in one assignment: requests that already hold the
+    previous store finish with it. The caches derived from the changed
+    datasets are emptied and loaded again.
+
+    Returns
+    -------
+    Set[str]
+        Reloaded datasets, empty if no file changed
+    """
+    with _reload_lock:
+        start = time.perf_counter()
+        store = datastore.get_store()
+        refreshed = store.refresh()
+        if refreshed is store:
+            return set()
+        changed = datastore.changed_datasets(store.sources, refreshed.sources)
+        datastore.set_store(refreshed)
+        # after the swap: the caches only keep what is built from the
+        # current store, so nothing built from the old one outlives this
+        invalidate(changed)
+        warmup.load_caches()
+        logger.info(
+            f"Serving datasets version {refreshed.version} ({len(refreshed.axis)} months), "
+            f"reloaded {', '.join(sorted(changed))} in {time.perf_counter() - start:.2f} s"
+        )
+        return changed
+
+
+class DataWatcher:
+    """
+    Polls the size and mtime of the data files and reloads the datasets
+    that changed, see reload.
+
+    A change is acted on once the files are the same at two polls in a
+    row, so that files still being written are not read. Partitions
+    written by a precompute run are picked up as well.
+
+    Parameters
+    ----------
+    data_dir: str
+        Directory containing the gauge datasets.
+    interval: float
+        Seconds between two polls.
+    """
+
+    def __init__(self, data_dir: str = datastore.DATA_DIR, interval: float = WATCH_SECONDS):
+        self.data_dir = data_dir
+        self.interval = interval
+        self._pending = None  # type: Optional[dict]
+        self._manifests = precompute.manifest_versions(data_dir)
+        self._stop = threading.Event()
+        self._thread = None  # type: Optional[threading.Thread]
+
+    def check(self) -> Set[str]:
+        """
+        Polls the data files once.
+
+        Returns
+        -------
+        Set[str]
+            Reloaded datasets
+        """
+        manifests = precompute.manifest_versions(self.data_dir)
+        if manifests != self._manifests:
+            self._manifests = manifests
+            precompute.clear_partitions()
+            logger.info(f"Precomputed results in {self.data_dir} changed")
+
+        store = datastore.get_store()
+        sources = datastore.source_files(self.data_dir)
+        if sources == store.sources:
+            self._pending = None
+            return set()
+        if sources != self._pending:
+            # seen for the first time, wait until the files settle
+            self._pending = sources
+            return set()
+        self._pending = None
+        return reload()
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                # the current datasets keep serving, retried at the next poll
+                logger.exception(f"Reloading the datasets of {self.data_dir} failed")
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="datawatch", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+_watcher = None  # type: Optional[DataWatcher]
+_watcher_lock = threading.Lock()
+
+
+def start(interval: float = WATCH_SECONDS) -> Optional[DataWatcher]:
+    """
+    Starts the watcher of this process, unless `interval` is 0 or it runs
+    already. Worker processes each start their own, see gunicorn.conf.py.
+    """
+    global _watcher
+    if interval <= 0:
+        return None
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = DataWatcher(interval=interval)
+            _watcher.start()
+            logger.info(f"Watching {_watcher.data_dir} every {interval:g} s")
+    return _watcher
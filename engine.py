@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+# typing imports
+from typing import Iterator, List, Optional, Sequence, Tuple, Union
+
+# local imports
+import datastore
+
+
+# alpha and beta columns of each regionalisation model
+REGIONALISATION_COLUMNS = {
+    "NuSVR": ("NUSVR_alpha", "NuSVR_beta"),
+    "GP": ("GP_alpha", "GP_beta"),
+    "GB": ("GB_alpha", "GB_beta"),
+}
+
+# group and month-count columns of each feasibility model
+SPATIAL_COLUMNS = {"XGB": "xgb_sd", "SVC": "svc_sd"}
+TEMPORAL_COLUMNS = {"XT": "XT_td", "NN": "NN_td", "RF": "RF_td"}
+
+SPATIAL_MODELS = tuple(SPATIAL_COLUMNS)
+TEMPORAL_MODELS = tuple(TEMPORAL_COLUMNS)
+
+DEFAULT_CHUNK_SIZE = 1024
+
+Months = Union[None, slice, Sequence[int], np.ndarray]
+
+
+def regionalisation_models(
+    store: Optional[datastore.GaugeDataStore] = None,
+) -> List[str]:
+    """
+    Regionalisation models whose alpha and beta columns are in the model
+    table.
+    """
+    parameters = (store or datastore.get_store()).parameters
+    return [
+        model
+        for model, (var_alpha, var_beta) in REGIONALISATION_COLUMNS.items()
+        if var_alpha in parameters and var_beta in parameters
+    ]
+
+
+def _month_positions(store: datastore.GaugeDataStore, months: Months) -> np.ndarray:
+    positions = np.arange(store.twsa_values.shape[1])
+    if months is None:
+        return positions
+    return positions[months]
+
+
+def iter_discharge_chunks(
+    regionalisation_model: str,
+    months: Months = None,
+    temporal_model: Optional[str] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    store: Optional[datastore.GaugeDataStore] = None,
+) -> Iterator[Tuple[slice, np.ndarray]]:
+    """
+    Computes Q = alpha * exp(beta * TWSA) for blocks of gauges.
+
+    Parameters
+    ----------
+    regionalisation_model: str
+        Regionalisation model providing alpha and beta, see
+        REGIONALISATION_COLUMNS.
+    months: Union[None, slice, Sequence[int], numpy.ndarray]
+        TWSA months (columns of the TWSA matrix) to compute, all if None.
+    temporal_model: str
+        Temporal feasibility model. If given, months that are not feasible
+        for a gauge are set to NaN.
+    chunk_size: int
+        Number of gauges computed per block, bounds the peak memory.
+    store: GaugeDataStore
+        Datasets to use, the process-wide store if None.
+
+    Returns
+    -------
+    Iterator[Tuple[slice, numpy.ndarray]]
+        Rows of the model table covered by the block and the float32
+        gauges x months discharge block. Gauges without TWSA are NaN.
+    """
+    store = store or datastore.get_store()
+    var_alpha, var_beta = REGIONALISATION_COLUMNS[regionalisation_model]
+    alpha = store.parameters[var_alpha]
+    beta = store.parameters[var_beta]
+
+    positions = _month_positions(store, months)
+    if temporal_model is not None:
+        flags = store.parameters.month_flags(temporal_model)
+        month_of_year = store.axis.month_of_year[positions] - 1
+
+    n_gauges = len(store.parameters)
+    for start in range(0, n_gauges, chunk_size):
+        rows = slice(start, min(start + chunk_size, n_gauges))
+        twsa_rows = store.gauge_twsa_rows[rows]
+        has_twsa = twsa_rows >= 0
+
+        block = np.asarray(store.twsa_values[twsa_rows[has_twsa]][:, positions])
+        q = np.full((len(twsa_rows), len(positions)), np.nan, dtype="float32")
+        np.multiply(block, beta[rows][has_twsa, None], out=block)
+        np.exp(block, out=block)
+        np.multiply(block, alpha[rows][has_twsa, None], out=block)
+        q[has_twsa] = block
+
+        if temporal_model is not None:
+            q[~flags[rows][:, month_of_year]] = np.nan
+
+        yield rows, q
+
+
+def compute_discharge_matrix(
+    regionalisation_model: str,
+    months: Months = None,
+    temporal_model: Optional[str] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    store: Optional[datastore.GaugeDataStore] = None,
+) -> np.ndarray:
+    """
+    Computes the discharge of every gauge in the model table in one pass.
+
+    Parameters
+    ----------
+    regionalisation_model: str
+        Regionalisation model providing alpha and beta.
+    months: Union[None, slice, Sequence[int], numpy.ndarray]
+        TWSA months (columns of the TWSA matrix) to compute, all if None.
+    temporal_model: str
+        Temporal feasibility model used to mask infeasible months with NaN.
+    chunk_size: int
+        Number of gauges computed per block, bounds the temporary memory.
+    store: GaugeDataStore
+        Datasets to use, the process-wide store if None.
+
+    Returns
+    -------
+    numpy.ndarray
+        float32 gauges x months discharge, rows in the order of
+        `store.parameters`.
+    """
+    store = store or datastore.get_store()
+    n_months = len(_month_positions(store, months))
+    discharge = np.empty((len(store.parameters), n_months), dtype="float32")
+    for rows, q in iter_discharge_chunks(
+        regionalisation_model, months, temporal_model, chunk_size, store
+    ):
+        discharge[rows] = q
+    return discharge
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Gunicorn settings of the app, e.g.:
+
+    gunicorn --config gunicorn.conf.py --bind :8000 --workers 4 app:server
+
+With QTWSA_PRELOAD=1 (the default) the app is imported and warmed up in
+the master before the workers are forked, so the gauge datasets, the map
+points and the precomputed results are loaded once and their pages are
+shared copy-on-write by every worker. Memory-mapped binary datasets are
+shared through the page cache either way.
+"""
+
+import gc
+import os
+
+
+preload_app = os.environ.get("QTWSA_PRELOAD", "1") != "0"
+
+if preload_app:
+    # warm up while the master imports the app, before forking
+    os.environ.setdefault("QTWSA_WARMUP", "sync")
+
+
+def when_ready(server):
+    if preload_app:
+        # keep the preloaded objects out of the workers' garbage collection,
+        # which would otherwise write to (and so copy) their shared pages
+        gc.freeze()
+        server.log.info(f"Preloaded app, {gc.get_freeze_count()} objects frozen")
+
+
+def post_worker_init(worker):
+    # threads do not survive the fork, each worker watches the data files
+    import datawatch
+
+    datawatch.start()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+import bisect
+import contextlib
+import logging
+import os
+import resource
+import threading
+import time
+
+# typing imports
+from typing import Any, Dict, List, Optional
+
+# local imports
+from logging_config import get_logger
+
+
+# instantiate logger
+logger = get_logger(__name__)
+
+
+def _span_log_level(name: str) -> int:
+    # getLevelName maps a known name to its level and anything else to a
+    # "Level ..." string, which logger.log would reject at every span
+    level = logging.getLevelName(name.strip().upper())
+    if not isinstance(level, int):
+        logger.warning(f"Unknown QTWSA_SPAN_LOG_LEVEL {name!r}, logging spans at DEBUG")
+        return logging.DEBUG
+    return level
+
+
+SPAN_LOG_LEVEL = _span_log_level(os.environ.get("QTWSA_SPAN_LOG_LEVEL", "DEBUG"))
+
+# upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Histogram:
+    """
+    Thread-safe cumulative latency histogram in the Prometheus layout.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+_histograms = {}  # type: Dict[str, Histogram]
+_histograms_lock = threading.Lock()
+
+# objects exposing stats() -> Dict, see cache.ResultCache
+_caches = []  # type: List[Any]
+
+
+def observe(name: str, seconds: float):
+    """
+    Adds a duration to the histogram of span `name`.
+    """
+    histogram = _histograms.get(name)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(name, Histogram())
+    histogram.observe(seconds)
+
+
+class span(contextlib.ContextDecorator):
+    """
+    Times a hot-path stage, as a context manager or a decorator.
+
+    The duration is logged as a structured record (the span name, duration
+    and fields are also attached to the record as `span`, `duration_ms`
+    and `fields`) and added to the latency histograms served at /metrics.
+
+    Example:
+
+    >>> with span("click.gauge_lookup", gageid=gageid):
+    ...     gauge = store.parameters.row(store.gauge_row(gageid))
+
+    >>> @span("figure.timeseries")
+    ... def as_timeseries_scatterplot(df): ...
+
+    Parameters
+    ----------
+    name: str
+        Stage name, dotted by component.
+    fields:
+        Extra key/value pairs for the log record.
+    """
+
+    def __init__(self, name: str, **fields):
+        self.name = name
+        self.fields = fields
+        self.start = None  # type: Optional[float]
+
+    def _recreate_cm(self):
+        # a fresh timer per call, the decorator may run on several threads
+        return type(self)(self.name, **self.fields)
+
+    def __enter__(self) -> "span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        seconds = time.perf_counter() - self.start
+        observe(self.name, seconds)
+        if logger.isEnabledFor(SPAN_LOG_LEVEL):
+            duration_ms = seconds * 1e3
+            details = "".join(f" {k}={v}" for k, v in self.fields.items())
+            status = " error=" + exc_type.__name__ if exc_type is not None else ""
+            logger.log(
+                SPAN_LOG_LEVEL,
+                f"span={self.name} duration_ms={duration_ms:.3f}{details}{status}",
+                extra=dict(span=self.name, duration_ms=duration_ms, fields=self.fields),
+            )
+        return False
+
+
+def register_cache(cache: Any):
+    """
+    Exports the stats() of a cache, e.g. cache.ResultCache, at /metrics.
+    """
+    _caches.append(cache)
+
+
+def resident_memory_bytes() -> int:
+    """
+    Current resident set size of the process, the peak if unavailable.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return max_resident_memory_bytes()
+
+
+def proportional_memory_bytes() -> Optional[int]:
+    """
+    Proportional set size of the process: pages shared with other
+    processes, e.g. preforked gunicorn workers, count for their share.
+    None where /proc/self/smaps_rollup is unavailable.
+    """
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def max_resident_memory_bytes() -> int:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def render_metrics() -> str:
+    """
+    Renders the span histograms, cache counters and process memory in the
+    Prometheus text exposition format.
+    """
+    lines = [
+        "# HELP qtwsa_span_duration_seconds Duration of instrumented hot-path stages.",
+        "# TYPE qtwsa_span_duration_seconds histogram",
+    ]
+    for name, histogram in sorted(_histograms.items()):
+        counts, total, count = histogram.snapshot()
+        cumulative = 0
+        for bound, n in zip(list(histogram.buckets) + ["+Inf"], counts):
+            cumulative += n
+            labels = f'span="{name}",le="{bound}"'
+            lines.append(f"qtwsa_span_duration_seconds_bucket{{{labels}}} {cumulative}")
+        lines.append(f'qtwsa_span_duration_seconds_sum{{span="{name}"}} {total}')
+        lines.append(f'qtwsa_span_duration_seconds_count{{span="{name}"}} {count}')
+
+    cache_metrics = [
+        ("hits", "counter", "Cache hits."),
+        ("misses", "counter", "Cache misses."),
+        ("evictions", "counter", "Cache evictions."),
+        ("entries", "gauge", "Cached entries."),
+        ("bytes", "gauge", "Estimated size of the cached values."),
+        ("hit_rate", "gauge", "Hits divided by lookups."),
+    ]
+    stats = [c.stats() for c in _caches]
+    for key, kind, help_text in cache_metrics:
+        suffix = "_total" if kind == "counter" else ""
+        metric = f"qtwsa_cache_{key}{suffix}"
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for s in stats:
+            lines.append(f'{metric}{{cache="{s["name"]}"}} {s[key]}')
+
+    lines += [
+        "# HELP qtwsa_process_resident_memory_bytes Resident set size.",
+        "# TYPE qtwsa_process_resident_memory_bytes gauge",
+        f"qtwsa_process_resident_memory_bytes {resident_memory_bytes()}",
+        "# HELP qtwsa_process_max_resident_memory_bytes Peak resident set size.",
+        "# TYPE qtwsa_process_max_resident_memory_bytes gauge",
+        f"qtwsa_process_max_resident_memory_bytes {max_resident_memory_bytes()}",
+    ]
+    pss = proportional_memory_bytes()
+    if pss is not None:
+        lines += [
+            "# HELP qtwsa_process_proportional_memory_bytes Proportional set size, "
+            "shared pages divided among the processes sharing them.",
+            "# TYPE qtwsa_process_proportional_memory_bytes gauge",
+            f"qtwsa_process_proportional_memory_bytes {pss}",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def register_metrics_route(server, path: str = "/metrics"):
+    """
+    Adds the Prometheus metrics route to the Flask server.
+
+    Metrics are per process; with several gunicorn workers each scrape
+    reports the worker that served it.
+
+    Parameters
+    ----------
+    server: flask.Flask
+        The app's Flask server.
+    path: str
+        URL of the route.
+    """
+    from flask import Response
+
+    def metrics() -> Response:
+        return Response(
+            render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+
+    server.add_url_rule(path, "metrics", metrics)
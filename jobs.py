@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import plotly.utils
+
+# typing imports
+from typing import Any, Callable, Dict, Optional
+
+# local imports
+import localstate
+from logging_config import get_logger
+
+
+# instantiate logger
+logger = get_logger(__name__)
+
+
+# local SQLite file holding the state of the jobs of all worker processes,
+# in localstate.state_dir() if unset
+JOB_STORE_PATH = os.environ.get("QTWSA_JOB_STORE_PATH")
+
+# threads running jobs in each worker process
+JOB_WORKERS = int(os.environ.get("QTWSA_JOB_WORKERS", 4))
+
+# a callback waits this long for its job before returning and polling
+JOB_WAIT_SECONDS = float(os.environ.get("QTWSA_JOB_WAIT_SECONDS", 0.5))
+
+# finished jobs are kept this long for the browsers polling them
+JOB_KEEP_SECONDS = 600
+
+# an unfinished job without progress for this long is assumed dead, e.g.
+# its worker thread hangs, and is started again when requested; jobs of a
+# worker process that exited are failed at once, see JobQueue
+JOB_STALE_SECONDS = 120
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+UNFINISHED = (PENDING, RUNNING)
+
+
+class JobCancelled(Exception):
+    """
+    Raised in a job whose result is no longer waited for.
+    """
+
+
+class JobContext:
+    """
+    Handle passed to the function of a job to report its progress.
+
+    Parameters
+    ----------
+    queue: JobQueue
+        Queue running the job.
+    key: str
+        Key of the job.
+    """
+
+    def __init__(self, queue: "JobQueue", key: str):
+        self.queue = queue
+        self.key = key
+
+    def progress(self, done: int, total: int, message: str = ""):
+        """
+        Records the progress of the job.
+
+        Raises
+        ------
+        JobCancelled
+            If nobody waits for the job anymore.
+        """
+        if self.queue._update(self.key, done=done, total=total, message=message):
+            raise JobCancelled(self.key)
+
+
+class JobQueue:
+    """
+    Runs slow callback work on a local thread pool, so that the request
+    threads of the server are not held by it.
+
+    The job state lives in a local SQLite file shared by all worker
+    processes of an instance, so a browser polling a job can be answered
+    by any worker. Identical jobs requested while one is unfinished share
+    it, and a job is cancelled once every browser waiting for it has
+    moved on, see release.
+
+    Each job records the process running it. Unfinished jobs of processes
+    that no longer exist, e.g. after a restart, are marked as failed when
+    a queue is created and are never shared.
+
+    Parameters
+    ----------
+    path: str
+        SQLite file of the job state, in localstate.state_dir() if None.
+    workers: int
+        Number of threads running jobs in this process.
+    """
+
+    def __init__(self, path: Optional[str] = JOB_STORE_PATH, workers: int = JOB_WORKERS):
+        self.path = path or os.path.join(localstate.state_dir(), "jobs.sqlite")
+        self._local = threading.local()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        # jobs running in this process, set when they finish
+        self._finished = {}  # type: Dict[str, threading.Event]
+        con = self._connection()
+        columns = [row[1] for row in con.execute("PRAGMA table_info(jobs)")]
+        if columns and "pid" not in columns:
+            # written by an older version, the jobs are transient
+            con.execute("DROP TABLE jobs")
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "key TEXT PRIMARY KEY, status TEXT, done INTEGER, total INTEGER, "
+            "message TEXT, waiters INTEGER, cancel INTEGER, result TEXT, "
+            "updated REAL, pid INTEGER)"
+        )
+        self._fail_orphans()
+
+    def _connection(self) -> sqlite3.Connection:
+        return localstate.connect(self.path, self._local, isolation_level=None)
+
+    def _fail_orphans(self):
+        # unfinished jobs whose process is gone would otherwise be polled
+        # until JOB_STALE_SECONDS
+        con = self._connection()
+        rows = con.execute(
+            f"SELECT DISTINCT pid FROM jobs WHERE status IN {UNFINISHED}"
+        ).fetchall()
+        dead = [pid for (pid,) in rows if not _process_alive(pid)]
+        if dead:
+            con.executemany(
+                "UPDATE jobs SET status = ?, message = ?, updated = ? "
+                f"WHERE pid = ? AND status IN {UNFINISHED}",
+                [(FAILED, "The job was interrupted by a restart", time.time(), pid)
+                 for pid in dead],
+            )
+            logger.info(f"Failed the unfinished jobs of exited processes {dead}")
+
+    def submit(self, key: str, func: Callable[[JobContext], Any], rejoin: bool = False) -> str:
+        """
+        Starts `func` as the job `key`, or waits for the job `key` if it is
+        already unfinished. Finished jobs are not reused: their results
+        may refer to entries of the result store that have been evicted.
+
+        Parameters
+        ----------
+        key: str
+            Identifies the work, equal keys must compute equal results.
+        func: Callable[[JobContext], Any]
+            Work of the job, its return value must be JSON-serializable
+            with plotly's encoder, which also takes Dash components.
+        rejoin: bool
+            The caller already waits for the job `key`, e.g. a browser
+            clicking the gauge it is computing again, and is not counted
+            a second time, see release.
+
+        Returns
+        -------
+        str
+            `key`
+        """
+        now = time.time()
+        con = self._connection()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            row = con.execute(
+                "SELECT status, updated, pid FROM jobs WHERE key = ?", (key,)
+            ).fetchone()
+            # a cancelled job that is still running is taken over again
+            shared = (
+                row is not None
+                and row[0] in UNFINISHED
+                and now - row[1] < JOB_STALE_SECONDS
+                and _process_alive(row[2])
+            )
+            if shared:
+                con.execute(
+                    "UPDATE jobs SET waiters = MAX(waiters, 0) + ?, cancel = 0 WHERE key = ?",
+                    (0 if rejoin else 1, key),
+                )
+            else:
+                con.execute(
+                    "INSERT OR REPLACE INTO jobs VALUES (?, ?, 0, 0, '', 1, 0, NULL, ?, ?)",
+                    (key, PENDING, now, os.getpid()),
+                )
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        if not shared:
+            finished = self._finished[key] = threading.Event()
+            self._pool.submit(self._run, key, func, finished)
+        return key
+
+    def release(self, key: str):
+        """
+        Stops waiting for the job `key`. The job is cancelled when nobody
+        waits for it anymore.
+        """
+        with self._connection() as con:
+            con.execute(
+                "UPDATE jobs SET waiters = waiters - 1, "
+                f"cancel = (waiters <= 1 AND status IN {UNFINISHED}) WHERE key = ?",
+                (key,),
+            )
+
+    def status(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the status, progress and message of a job, None if it is
+        unknown or was pruned.
+        """
+        row = self._connection().execute(
+            "SELECT status, done, total, message, updated FROM jobs WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        status, done, total, message, updated = row
+        if status in UNFINISHED and time.time() - updated >= JOB_STALE_SECONDS:
+            status, message = FAILED, "The job stopped responding"
+        return dict(status=status, done=done, total=total, message=message)
+
+    def result(self, key: str) -> Any:
+        """
+        Returns the result of a done job, decoded from JSON: tuples are
+        lists and Dash components their dictionaries.
+        """
+        row = self._connection().execute(
+            "SELECT result FROM jobs WHERE key = ? AND status = ?", (key, DONE)
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def wait(self, key: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Waits up to `timeout` seconds for a job to finish, returns its
+        status.
+        """
+        finished = self._finished.get(key)
+        if finished is not None:
+            finished.wait(timeout)
+            return self.status(key)
+        # running in another process
+        deadline = time.monotonic() + timeout
+        while True:
+            status = self.status(key)
+            if status is None or status["status"] not in UNFINISHED:
+                return status
+            if time.monotonic() >= deadline:
+                return status
+            time.sleep(0.02)
+
+    def _update(self, key: str, **values) -> bool:
+        # records progress, returns True if the job is to be cancelled
+        columns = ", ".join(f"{name} = ?" for name in values)
+        con = self._connection()
+        con.execute(
+            f"UPDATE jobs SET {columns}, updated = ? WHERE key = ?",
+            (*values.values(), time.time(), key),
+        )
+        row = con.execute("SELECT cancel FROM jobs WHERE key = ?", (key,)).fetchone()
+        return row is None or bool(row[0])
+
+    def _run(self, key: str, func: Callable[[JobContext], Any], finished: threading.Event):
+        start = time.perf_counter()
+        try:
+            if self._update(key, status=RUNNING):
+                raise JobCancelled(key)
+            result = func(JobContext(self, key))
+            self._update(
+                key,
+                status=DONE,
+                result=json.dumps(result, cls=plotly.utils.PlotlyJSONEncoder),
+            )
+            logger.debug(f"Job {key} done in {time.perf_counter() - start:.3f} s")
+        except JobCancelled:
+            self._update(key, status=CANCELLED)
+            logger.info(f"Job {key} cancelled after {time.perf_counter() - start:.3f} s")
+        except Exception as e:
+            logger.exception(f"Job {key} failed")
+            self._update(key, status=FAILED, message=f"{type(e).__name__}: {e}")
+        finally:
+            if self._finished.get(key) is finished:
+                del self._finished[key]
+            finished.set()
+            self._prune()
+
+    def _prune(self):
+        with self._connection() as con:
+            con.execute(
+                f"DELETE FROM jobs WHERE status NOT IN {UNFINISHED} AND updated < ?",
+                (time.time() - JOB_KEEP_SECONDS,),
+            )
+
+
+def _process_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # exists, owned by another user
+        return True
+    return True
+
+
+_job_queue = None  # type: Optional[JobQueue]
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """
+    Returns the process-wide JobQueue.
+    """
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = JobQueue()
+    return _job_queue
@@ -22,6 +22,34 @@ sidebar = dbc.Card(
     [
         # html.Div([html.P(dcc.Markdown(desc_text))]),
         html.Hr(),
+        html.Div(
+            [
+                html.P("Find a gauge by GAGEID"),
+                # options are filled server-side from the typed prefix
+                dcc.Dropdown(
+                    id="gauge-search",
+                    options=[],
+                    placeholder="e.g. 1646502 or ADHI_1038",
+                    searchable=True,
+                    clearable=True,
+                    style={"margin-bottom": "1rem"},
+                ),
+                html.P("Find gauges near a location"),
+                dbc.InputGroup(
+                    [
+                        dbc.Input(
+                            id="location-search",
+                            type="text",
+                            placeholder="lat, lon[, radius km]",
+                            debounce=True,
+                        ),
+                        dbc.Button("Find", id="location-search-button", n_clicks=0),
+                    ],
+                ),
+                html.Div(id="location-search-status", style={"margin-top": "0.5rem"}),
+            ],
+        ),
+        html.Hr(),
         html.Div(
             [
                 html.P("Model Regionalisation"),
@@ -35,6 +63,13 @@ sidebar = dbc.Card(
                     ],
                     style={"margin-bottom": "1rem"},
                 ),
+                dbc.Checklist(
+                    id="ensemble",
+                    options=[dict(label="Show the range of all models", value="ensemble")],
+                    value=[],
+                    switch=True,
+                    style={"margin-bottom": "1rem"},
+                ),
             ],
             title="Model Regionalisation",
         ),
@@ -75,8 +110,15 @@ sidebar = dbc.Card(
         html.Hr(),
         
         # Placeholders for spatial and temporal dependency outputs
-        html.Div(id="spatial_dependency", style={"margin-top": "1rem"}),
-        html.Div(id="temporal_dependency", style={"margin-top": "1rem"}),
+        # the spinner shows while a click or selection is computed
+        dcc.Loading(
+            [
+                html.Div(id="spatial_dependency", style={"margin-top": "1rem"}),
+                html.Div(id="temporal_dependency", style={"margin-top": "1rem"}),
+                html.Div(id="selection-status", style={"margin-top": "1rem"}),
+                html.Div(id="skill-scores", style={"margin-top": "1rem"}),
+            ]
+        ),
         
     ],
     body=True,
@@ -90,7 +132,7 @@ sidebar = dbc.Card(
 mapdf = utils.get_map_data()
 
 # build the map
-map_component, map_data_dict = components.map(mapdf)
+map_component = components.map(mapdf)
 
 # main layout definition
 main = dbc.Container(
@@ -114,9 +156,11 @@ main = dbc.Container(
                                 ),
                                 dcc.Tab(label="Timeseries", value="tab-timeseries"),
                                 dcc.Tab(label="Tabular", value="tab-table"),
+                                dcc.Tab(label="Leaderboard", value="tab-leaderboard"),
+                                dcc.Tab(label="Discharge map", value="tab-discharge-map"),
                             ],
                         ),
-                        html.Div(id="tab-content"),
+                        dcc.Loading(html.Div(id="tab-content")),
                     ],
                     md=9,
                 ),
@@ -125,7 +169,13 @@ main = dbc.Container(
             justify="center",
         ),
         dcc.Store(id="store-qtwsa"),
-        dcc.Store(id="store-map", data=map_data_dict),
+        # gauges of the shown results, recomputed when a model changes
+        dcc.Store(id="active-gauges"),
+        # location the map is zoomed to after a location search
+        dcc.Store(id="map-focus"),
+        # unfinished job of the figure callback, polled until it is done
+        dcc.Store(id="job"),
+        dcc.Interval(id="job-poll", interval=500, disabled=True),
     ],
     fluid=True,
 )
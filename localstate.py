@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+import stat
+import tempfile
+import threading
+
+# local imports
+from logging_config import get_logger
+
+
+# instantiate logger
+logger = get_logger(__name__)
+
+
+# directory of the files shared by the worker processes of an instance,
+# a private directory in the temporary directory if unset
+STATE_DIR = os.environ.get("QTWSA_STATE_DIR")
+
+
+def state_dir() -> str:
+    """
+    Returns the directory of the local state of the app, such as the
+    result store, creating it if needed.
+
+    Without QTWSA_STATE_DIR this is a directory of the temporary directory
+    named after the user and created with mode 0700. Since the temporary
+    directory is writable by every local user, the directory is refused
+    if another user owns it or may write to it.
+
+    Returns
+    -------
+    str
+        Path of the directory
+
+    Raises
+    ------
+    PermissionError
+        If the default directory is not private to the user.
+    """
+    if STATE_DIR:
+        os.makedirs(STATE_DIR, exist_ok=True)
+        return STATE_DIR
+    path = os.path.join(tempfile.gettempdir(), f"qtwsa-{os.getuid()}")
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if (
+        not stat.S_ISDIR(st.st_mode)
+        or st.st_uid != os.getuid()
+        or st.st_mode & (stat.S_IRWXG | stat.S_IRWXO)
+    ):
+        raise PermissionError(
+            f"{path} is not a directory private to this user, "
+            "remove it or set QTWSA_STATE_DIR"
+        )
+    return path
+
+
+def connect(path: str, local: threading.local, **kwargs) -> sqlite3.Connection:
+    """
+    Returns the connection of the calling thread to a SQLite file shared
+    by the worker processes, opened in WAL mode on first use. SQLite
+    connections cannot be shared between threads, so each thread keeps
+    its own in `local`.
+
+    Parameters
+    ----------
+    path: str
+        SQLite file.
+    local: threading.local
+        Per-thread storage of the owner of the connections.
+    **kwargs
+        Passed to sqlite3.connect.
+
+    Returns
+    -------
+    sqlite3.Connection
+        Connection of this thread
+    """
+    con = getattr(local, "con", None)
+    if con is None:
+        con = sqlite3.connect(path, timeout=30, **kwargs)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        local.con = con
+    return con
@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+
+import base64
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+# typing imports
+from typing import Any, Dict, List, Optional, Tuple
+
+# local imports
+import datastore
+import engine
+import utils
+from logging_config import get_logger
+
+
+# instantiate logger
+logger = get_logger(__name__)
+
+
+# "viewport" sends decimated points for the visible area, "full" sends every gauge
+MAP_MODE = os.environ.get("QTWSA_MAP_MODE", "viewport")
+
+# upper bound on the markers sent for one view
+MAX_POINTS = int(os.environ.get("QTWSA_MAP_MAX_POINTS", 2000))
+
+# gauges closer than this many screen pixels share one marker
+CLUSTER_PIXELS = 8
+
+INITIAL_CENTER = {"lat": 20, "lon": 0}
+INITIAL_ZOOM = 1.5
+
+# zoom after a location search for the nearest gauge
+SEARCH_ZOOM = 9
+
+# assumed map size when the browser does not report the visible bounds
+VIEWPORT_PIXELS = (1200, 800)
+
+Bounds = Tuple[float, float, float, float]
+
+
+class MapPoints:
+    """
+    Compact, array-backed copy of the gauge locations shown on the map.
+
+    Parameters
+    ----------
+    map_data: pandas.DataFrame
+        Map data with GAGEID, Lat, Lon and area columns.
+    """
+
+    def __init__(self, map_data: pd.DataFrame):
+        self.gageid = np.array(
+            [datastore.normalize_gageid(g) for g in map_data["GAGEID"]], dtype=object
+        )
+        self.index = {g: i for i, g in enumerate(self.gageid)}  # type: Dict[str, int]
+        self.lat = map_data["Lat"].values.astype("float32")
+        self.lon = map_data["Lon"].values.astype("float32")
+        self.area = map_data["area"].values.astype("float32")
+
+    def __len__(self) -> int:
+        return len(self.gageid)
+
+
+def bounds_from_view(center: Dict[str, float], zoom: float) -> Bounds:
+    """
+    Approximates the visible (west, south, east, north) bounds of a
+    web-mercator map of VIEWPORT_PIXELS.
+    """
+    degrees_per_pixel = 360 / (512 * 2**zoom)
+    half_width = VIEWPORT_PIXELS[0] / 2 * degrees_per_pixel
+    half_height = VIEWPORT_PIXELS[1] / 2 * degrees_per_pixel
+    return (
+        center["lon"] - half_width,
+        max(center["lat"] - half_height, -90),
+        center["lon"] + half_width,
+        min(center["lat"] + half_height, 90),
+    )
+
+
+def zoom_for_radius(radius_km: float) -> float:
+    """
+    Zoom at which a circle of `radius_km` fits the height of a map of
+    VIEWPORT_PIXELS.
+    """
+    degrees = max(radius_km, 1.0) / 111.2
+    zoom = np.log2(VIEWPORT_PIXELS[1] / 2 * 360 / (512 * degrees))
+    return float(np.clip(zoom, 1, SEARCH_ZOOM))
+
+
+def view_from_relayout(
+    relayout_data: Dict[str, Any]
+) -> Optional[Tuple[Bounds, Dict[str, float], float]]:
+    """
+    Extracts the visible bounds, center and zoom from the relayoutData of
+    a mapbox figure.
+
+    Parameters
+    ----------
+    relayout_data: Dict[str, Any]
+        relayoutData of the map dcc.Graph.
+
+    Returns
+    -------
+    Optional[Tuple[Bounds, Dict[str, float], float]]
+        Bounds as (west, south, east, north), center and zoom. None if the
+        event did not change the map view.
+    """
+    if not relayout_data or "mapbox.zoom" not in relayout_data:
+        return None
+    zoom = float(relayout_data["mapbox.zoom"])
+    center = relayout_data.get("mapbox.center", INITIAL_CENTER)
+    derived = relayout_data.get("mapbox._derived", {}).get("coordinates")
+    if derived:
+        lons = [c[0] for c in derived]
+        lats = [c[1] for c in derived]
+        bounds = (min(lons), min(lats), max(lons), max(lats))
+    else:
+        bounds = bounds_from_view(center, zoom)
+    return bounds, center, zoom
+
+
+def decimate(
+    points: MapPoints, bounds: Bounds, zoom: float, max_points: int = MAX_POINTS
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Selects the gauges inside `bounds` and clusters them on a grid whose
+    cells are about CLUSTER_PIXELS wide at `zoom`.
+
+    The number of markers returned depends on the visible area rather
+    than on the size of the catalogue, and never exceeds `max_points`.
+
+    Parameters
+    ----------
+    points: MapPoints
+        Gauge locations.
+    bounds: Bounds
+        Visible (west, south, east, north) bounds in degrees.
+    zoom: float
+        Map zoom level.
+    max_points: int
+        Maximum number of markers.
+
+    Returns
+    -------
+    Tuple[numpy.ndarray, numpy.ndarray]
+        Index of the gauge representing each marker and the number of
+        gauges it stands for.
+    """
+    west, south, east, north = bounds
+    if east - west >= 360:
+        in_lon = np.ones(len(points), dtype=bool)
+    else:
+        # wrap into [-180, 180), the view may cross the antimeridian
+        west = (west + 180) % 360 - 180
+        east = (east + 180) % 360 - 180
+        if west <= east:
+            in_lon = (points.lon >= west) & (points.lon <= east)
+        else:
+            in_lon = (points.lon >= west) | (points.lon <= east)
+    inside = np.flatnonzero(in_lon & (points.lat >= south) & (points.lat <= north))
+
+    cell = CLUSTER_PIXELS * 360 / (512 * 2**zoom)
+    counts = np.ones(len(inside), dtype="int64")
+    while len(inside) > 0:
+        col = np.floor(points.lon[inside] / cell).astype("int64")
+        row = np.floor((points.lat[inside] + 90) / cell).astype("int64")
+        _, first, counts = np.unique(
+            col * 2**20 + row, return_index=True, return_counts=True
+        )
+        if len(first) <= max_points:
+            return inside[first], counts
+        cell *= 2
+    return inside, counts
+
+
+def _inside_polygon(lon: np.ndarray, lat: np.ndarray, polygon: np.ndarray) -> np.ndarray:
+    # even-odd ray casting, vectorized over the points
+    inside = np.zeros(len(lon), dtype=bool)
+    x0, y0 = polygon[-1]
+    for x1, y1 in polygon:
+        crosses = (y1 > lat) != (y0 > lat)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_cross = (x0 - x1) * (lat - y1) / (y0 - y1) + x1
+        inside ^= crosses & (lon < x_cross)
+        x0, y0 = x1, y1
+    return inside
+
+
+def selected_gauges(points: MapPoints, selected_data: Dict[str, Any]) -> List[str]:
+    """
+    Resolves a box or lasso selection on the map into GAGEIDs.
+
+    The selection area is matched against every gauge, not only the drawn
+    markers, so gauges hidden in a cluster marker are included.
+
+    Parameters
+    ----------
+    points: MapPoints
+        All gauge locations.
+    selected_data: Dict[str, Any]
+        selectedData of the map dcc.Graph.
+
+    Returns
+    -------
+    List[str]
+        Selected GAGEIDs
+    """
+    if not selected_data:
+        return []
+    box = selected_data.get("range", {}).get("mapbox")
+    lasso = selected_data.get("lassoPoints", {}).get("mapbox")
+    if box:
+        (west, north), (east, south) = box
+        mask = (
+            (points.lon >= min(west, east))
+            & (points.lon <= max(west, east))
+            & (points.lat >= min(north, south))
+            & (points.lat <= max(north, south))
+        )
+    elif lasso:
+        mask = _inside_polygon(points.lon, points.lat, np.asarray(lasso, dtype="float64"))
+    else:
+        selected = [p["hovertext"] for p in selected_data.get("points", [])]
+        return list(dict.fromkeys(selected))
+    return list(points.gageid[mask])
+
+
+_points = None  # type: Optional[MapPoints]
+_points_lock = threading.Lock()
+
+
+def get_map_points(map_data: Optional[pd.DataFrame] = None) -> MapPoints:
+    """
+    Returns the process-wide MapPoints.
+
+    Parameters
+    ----------
+    map_data: pandas.DataFrame
+        Map data to build the points from on first use, read with
+        utils.get_map_data if None.
+
+    Returns
+    -------
+    MapPoints
+        Gauge locations
+    """
+    global _points
+    if _points is None:
+        with _points_lock:
+            if _points is None:
+                if map_data is None:
+                    map_data = utils.get_map_data()
+                _points = MapPoints(map_data)
+    return _points
+
+
+# colour levels of the discharge map, 0..FRAME_LEVELS-1 index a log-scaled
+# colour scale and FRAME_GREY marks months without a feasible discharge
+FRAME_LEVELS = 255
+FRAME_GREY = 255
+
+
+def month_labels(store: Optional[datastore.GaugeDataStore] = None) -> List[str]:
+    """
+    Served TWSA months as YYYY-MM.
+    """
+    axis = (store or datastore.get_store()).axis
+    return list(np.datetime_as_string(axis.datetimes[axis.columns], unit="M"))
+
+
+class DischargeLevels:
+    """
+    Predicted discharge of every map gauge in every served month of one
+    regionalisation model, quantized to one byte per gauge and month on a
+    log scale. The DischargeFrames of every temporal model are derived
+    from it, so the discharge is computed once per regionalisation model.
+
+    Parameters
+    ----------
+    points: MapPoints
+        Gauges of the map, in the order of its markers.
+    model_regionalisation: str
+        Regionalisation model, see engine.REGIONALISATION_COLUMNS.
+    store: GaugeDataStore
+        Datasets, the process-wide store if None.
+    """
+
+    def __init__(
+        self,
+        points: MapPoints,
+        model_regionalisation: str,
+        store: Optional[datastore.GaugeDataStore] = None,
+    ):
+        store = store or datastore.get_store()
+        columns = store.axis.columns
+        self.version = store.version
+        self.labels = month_labels(store)
+
+        # model rows of the map gauges, -1 for gauges without parameters
+        self.rows = np.array([store.gauge_index.get(g, -1) for g in points.gageid], dtype="int64")
+        has_model = self.rows >= 0
+        q = np.full((len(points), len(columns)), np.nan, dtype="float32")
+        q[has_model] = engine.compute_discharge_matrix(
+            model_regionalisation, columns, store=store
+        )[self.rows[has_model]]
+
+        # one log scale over all months and feasibility models, clipped to
+        # the 1st and 99th percentile so that outliers do not wash it out
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_q = np.log10(q)
+        valid = np.isfinite(log_q)
+        if valid.any():
+            self.low, self.high = np.percentile(log_q[valid], [1, 99])
+        else:
+            self.low, self.high = 0.0, 1.0
+        self.high = max(self.high, self.low + 1e-6)
+        scaled = (np.where(valid, log_q, self.low) - self.low) / (self.high - self.low)
+        # gauges x months, FRAME_GREY where there is no discharge
+        self.levels = np.rint(np.clip(scaled, 0, 1) * (FRAME_LEVELS - 1)).astype("uint8")
+        self.levels[~valid] = FRAME_GREY
+
+    def __sizeof__(self) -> int:
+        return self.levels.nbytes + self.rows.nbytes
+
+
+class DischargeFrames:
+    """
+    Predicted discharge of every map gauge in every served month, quantized
+    to one byte per gauge and month, for the month slider of the discharge
+    map.
+
+    A frame is the colour column of one month, so scrubbing through the
+    months only sends and swaps the marker colours of the map.
+
+    Parameters
+    ----------
+    levels: DischargeLevels
+        Quantized discharge of the regionalisation model.
+    model_temporal_feasibility: str
+        Temporal feasibility model, infeasible months are grey.
+    store: GaugeDataStore
+        Datasets `levels` was computed from, the process-wide store if None.
+    """
+
+    def __init__(
+        self,
+        levels: DischargeLevels,
+        model_temporal_feasibility: str,
+        store: Optional[datastore.GaugeDataStore] = None,
+    ):
+        store = store or datastore.get_store()
+        columns = store.axis.columns
+        self.labels = levels.labels
+        self.low, self.high = levels.low, levels.high
+
+        rows = levels.rows
+        has_model = rows >= 0
+        flags = store.parameters.month_flags(model_temporal_feasibility)
+        feasible = np.zeros(levels.levels.shape, dtype=bool)
+        feasible[has_model] = flags[rows[has_model]][:, store.axis.month_of_year[columns] - 1]
+        # months x gauges, so that a frame is a contiguous row
+        self.levels = np.ascontiguousarray(np.where(feasible, levels.levels, FRAME_GREY).T)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def __sizeof__(self) -> int:
+        return self.levels.nbytes
+
+    def ticks(self) -> Tuple[List[float], List[str]]:
+        """
+        Colour bar ticks at the powers of ten of the discharge scale.
+        """
+        exponents = np.arange(np.ceil(self.low), np.floor(self.high) + 1)
+        if len(exponents) == 0:
+            exponents = np.array([self.low, self.high])
+        values = (exponents - self.low) / (self.high - self.low) * (FRAME_LEVELS - 1)
+        return list(np.round(values, 1)), [f"{10 ** e:.3g}" for e in exponents]
+
+    def frame(self, month: int) -> Dict[str, Any]:
+        """
+        Colours of one month as base64-encoded bytes, one per map gauge,
+        with the month label and the colour bar ticks.
+
+        Parameters
+        ----------
+        month: int
+            Position of the month in the served months.
+        """
+        month = int(np.clip(month, 0, len(self) - 1))
+        tickvals, ticktext = self.ticks()
+        return dict(
+            label=self.labels[month],
+            colors=base64.b64encode(self.levels[month].tobytes()).decode("ascii"),
+            tickvals=tickvals,
+            ticktext=ticktext,
+        )
+
+
+_levels = {}  # type: Dict[str, DischargeLevels]
+_frames = {}  # type: Dict[Tuple[str, str], DischargeFrames]
+_frames_lock = threading.Lock()
+
+
+def get_discharge_frames(
+    model_regionalisation: str, model_temporal_feasibility: str
+) -> DischargeFrames:
+    """
+    Returns the process-wide DischargeFrames of a model pair. The
+    DischargeLevels of the regionalisation model are shared by the
+    frames of every temporal model.
+    """
+    key = (model_regionalisation, model_temporal_feasibility)
+    frames = _frames.get(key)
+    if frames is None:
+        with _frames_lock:
+            frames = _frames.get(key)
+            if frames is None:
+                store = datastore.get_store()
+                levels = _levels.get(model_regionalisation)
+                if levels is None or levels.version != store.version:
+                    levels = DischargeLevels(get_map_points(), model_regionalisation, store)
+                frames = DischargeFrames(levels, model_temporal_feasibility, store)
+                # not kept if the datasets were replaced meanwhile
+                if datastore.get_store() is store:
+                    _levels[model_regionalisation] = levels
+                    _frames[key] = frames
+    return frames
+
+
+def clear_frames():
+    """
+    Forgets the DischargeLevels and DischargeFrames built so far, e.g.
+    after the datasets were reloaded.
+    """
+    with _frames_lock:
+        _levels.clear()
+        _frames.clear()
@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+
+import itertools
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+# typing imports
+from typing import Dict, List, Optional, Tuple
+
+# local imports
+import datastore
+import engine
+from logging_config import get_logger
+
+
+# instantiate logger
+logger = get_logger(__name__)
+
+
+PRECOMPUTED_DIR = "precomputed"
+
+# set to 0 to always compute clicks live
+USE_PRECOMPUTED = os.environ.get("QTWSA_USE_PRECOMPUTED", "1") != "0"
+
+# files of a partition, the manifest goes last and marks it as complete
+GAGEIDS_FILE = "gageids.npy"
+Q_PRED_FILE = "q_pred.npy"
+MONTH_FLAGS_FILE = "month_flags.npy"
+SPATIAL_FILE = "spatial.npy"
+TEMPORAL_FILE = "temporal.npy"
+MANIFEST_FILE = "manifest.json"
+
+Combination = Tuple[str, str, str]
+
+
+def partition_name(
+    model_regionalisation: str,
+    model_spatial_feasibility: str,
+    model_temporal_feasibility: str,
+) -> str:
+    return f"{model_regionalisation}_{model_spatial_feasibility}_{model_temporal_feasibility}"
+
+
+def combinations(store: Optional[datastore.GaugeDataStore] = None) -> List[Combination]:
+    """
+    Every regionalisation x spatial x temporal model combination.
+    """
+    return list(
+        itertools.product(
+            engine.regionalisation_models(store),
+            engine.SPATIAL_MODELS,
+            engine.TEMPORAL_MODELS,
+        )
+    )
+
+
+# part of the signature, bump when the computed values change
+RESULTS_VERSION = 2
+
+
+def data_signature(
+    data_dir: str,
+    cutoff: Optional[str] = datastore.TWSA_CUTOFF,
+    sources: Optional[Dict[str, list]] = None,
+) -> list:
+    """
+    Size and mtime of the datasets a partition is computed from, the TWSA
+    cutoff and RESULTS_VERSION. A partition with another signature is
+    stale.
+
+    Parameters
+    ----------
+    data_dir: str
+        Directory containing the gauge datasets.
+    cutoff: str
+        Last TWSA date served.
+    sources: Dict[str, list]
+        datastore.source_files of the datasets, e.g. the `sources` of
+        the store they were loaded into. The files are read if None.
+
+    Returns
+    -------
+    list
+        JSON-serializable signature
+    """
+    sources = sources or datastore.source_files(data_dir)
+    twsa_files = {name: [size, mtime] for name, size, mtime in sources["twsa"]}
+    files = sources["dates"] + sources["models"]
+    if twsa_files[datastore.TWSA_FILE][0] is not None:
+        files.append([datastore.TWSA_FILE] + twsa_files[datastore.TWSA_FILE])
+    else:
+        name = os.path.join(datastore.BINARY_DIR, datastore.TWSA_VALUES_FILE)
+        files.append([name] + twsa_files[name])
+    signature = [str(cutoff), RESULTS_VERSION]
+    for name, size, mtime in files:
+        if size is None:
+            raise FileNotFoundError(os.path.join(data_dir, name))
+        signature.append([name, size, mtime])
+    return signature
+
+
+def read_manifest(path: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class Partition:
+    """
+    Precomputed handle_click results of one model combination.
+
+    Discharge is stored for the served TWSA months of every gauge with
+    TWSA, together with the feasible months as a 12-bit mask and the
+    spatial and temporal feasibility values. The TWSA and observations
+    are read from the GaugeDataStore as for live clicks.
+
+    Parameters
+    ----------
+    path: str
+        Directory of the partition.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.manifest = read_manifest(path)
+        self.gageids = np.load(os.path.join(path, GAGEIDS_FILE))
+        self.q_pred = np.load(os.path.join(path, Q_PRED_FILE), mmap_mode="r")
+        self.month_flags = np.load(os.path.join(path, MONTH_FLAGS_FILE))
+        self.spatial = np.load(os.path.join(path, SPATIAL_FILE))
+        self.temporal = np.load(os.path.join(path, TEMPORAL_FILE))
+        self.index = {
+            datastore.normalize_gageid(g): i for i, g in enumerate(self.gageids)
+        }  # type: Dict[str, int]
+
+    def __contains__(self, gageid: str) -> bool:
+        return datastore.normalize_gageid(gageid) in self.index
+
+    def get(self, gageid: str) -> Tuple[np.ndarray, np.ndarray, object, object]:
+        """
+        Returns the precomputed values of a gauge.
+
+        Parameters
+        ----------
+        gageid: str
+            Gauge identifier
+
+        Returns
+        -------
+        Tuple[numpy.ndarray, numpy.ndarray, Value, Value]
+            Discharge over the served months, feasibility of the 12
+            calendar months, spatial group and number of feasible months
+        """
+        i = self.index[datastore.normalize_gageid(gageid)]
+        flags = (int(self.month_flags[i]) >> np.arange(12)) & 1 == 1
+        return (
+            np.asarray(self.q_pred[i]),
+            flags,
+            self.spatial[i],
+            self.temporal[i],
+        )
+
+    def discharge(self, gageid: str) -> np.ndarray:
+        """
+        Returns the precomputed discharge of a gauge over the served months.
+        """
+        return np.asarray(self.q_pred[self.index[datastore.normalize_gageid(gageid)]])
+
+
+# keyed by store version, so that a partition checked against replaced
+# datasets is never served with the current ones
+_partitions = {}  # type: Dict[Tuple[int, Combination], Optional[Partition]]
+_partitions_lock = threading.Lock()
+
+
+def get_partition(
+    model_regionalisation: str,
+    model_spatial_feasibility: str,
+    model_temporal_feasibility: str,
+    store: Optional[datastore.GaugeDataStore] = None,
+) -> Optional[Partition]:
+    """
+    Returns the precomputed partition of a model combination, or None if
+    it is missing, incomplete or was not computed from the datasets of
+    `store`, datastore.get_store() if None. The answer for the current
+    store is kept until clear_partitions.
+    """
+    if not USE_PRECOMPUTED:
+        return None
+    store = store or datastore.get_store()
+    combination = (model_regionalisation, model_spatial_feasibility, model_temporal_feasibility)
+    key = (store.version, combination)
+    try:
+        return _partitions[key]
+    except KeyError:
+        pass
+    with _partitions_lock:
+        if key not in _partitions:
+            partition = _open_partition(combination, store)
+            if datastore.get_store() is not store:
+                # e.g. an export that started before a reload, see datawatch
+                return partition
+            for stale in [k for k in _partitions if k[0] != store.version]:
+                del _partitions[stale]
+            _partitions[key] = partition
+        return _partitions[key]
+
+
+def clear_partitions():
+    """
+    Forgets the partitions opened so far, they are opened and checked
+    again on next use.
+    """
+    with _partitions_lock:
+        _partitions.clear()
+
+
+def manifest_versions(data_dir: str = datastore.DATA_DIR) -> Dict[str, int]:
+    """
+    mtime of the manifest of every partition in `data_dir`, which changes
+    when a partition is written.
+    """
+    versions = {}
+    try:
+        names = sorted(os.listdir(os.path.join(data_dir, PRECOMPUTED_DIR)))
+    except OSError:
+        return versions
+    for name in names:
+        try:
+            st = os.stat(os.path.join(data_dir, PRECOMPUTED_DIR, name, MANIFEST_FILE))
+        except OSError:
+            continue
+        versions[name] = st.st_mtime_ns
+    return versions
+
+
+def get_discharge(
+    gageid: str,
+    model_regionalisation: str,
+    store: Optional[datastore.GaugeDataStore] = None,
+) -> Optional[np.ndarray]:
+    """
+    Returns the precomputed discharge of a gauge for a regionalisation
+    model, or None. The discharge does not depend on the feasibility
+    models, so any partition of the model that matches `store` is used.
+    """
+    for model_spatial_feasibility in engine.SPATIAL_MODELS:
+        for model_temporal_feasibility in engine.TEMPORAL_MODELS:
+            partition = get_partition(
+                model_regionalisation,
+                model_spatial_feasibility,
+                model_temporal_feasibility,
+                store,
+            )
+            if partition is not None and gageid in partition:
+                return partition.discharge(gageid)
+    return None
+
+
+def _open_partition(
+    combination: Combination, store: datastore.GaugeDataStore
+) -> Optional[Partition]:
+    if store.data_dir is None:
+        return None
+    path = os.path.join(store.data_dir, PRECOMPUTED_DIR, partition_name(*combination))
+    manifest = read_manifest(path)
+    if manifest is None:
+        return None
+    # the signature of the files the store was loaded from rather than of
+    # the files on disk, which may be newer, so that a partition is only
+    # served with the datasets and months it was computed from
+    try:
+        current = data_signature(store.data_dir, store.cutoff, store.sources)
+    except OSError:
+        return None
+    if manifest["signature"] != current:
+        logger.warning(f"Precomputed results in {path} are stale, computing live")
+        return None
+    logger.info(f"Serving precomputed results from {path}")
+    return Partition(path)
+
+
+def write_partition(
+    store: datastore.GaugeDataStore,
+    out_dir: str,
+    combination: Combination,
+    signature: list,
+    chunk_size: int = engine.DEFAULT_CHUNK_SIZE,
+) -> int:
+    """
+    Computes and writes the partition of one model combination.
+
+    The partition is built in a temporary directory and renamed into
+    place, so an interrupted job never leaves a partial partition.
+
+    Parameters
+    ----------
+    store: GaugeDataStore
+        Datasets to compute from.
+    out_dir: str
+        Directory containing the partitions.
+    combination: Tuple[str, str, str]
+        Regionalisation, spatial and temporal model.
+    signature: list
+        data_signature of the datasets, recorded in the manifest.
+    chunk_size: int
+        Number of gauges computed per block.
+
+    Returns
+    -------
+    int
+        Number of gauges written
+    """
+    model_regionalisation, model_spatial_feasibility, model_temporal_feasibility = combination
+    var_alpha, var_beta = engine.REGIONALISATION_COLUMNS[model_regionalisation]
+    var_sd = engine.SPATIAL_COLUMNS[model_spatial_feasibility]
+    var_td = engine.TEMPORAL_COLUMNS[model_temporal_feasibility]
+
+    # first occurrence of every gauge with TWSA, as served by handle_click
+    gageids = np.array(list(store.gauge_index), dtype="U")
+    rows = np.array(list(store.gauge_index.values()), dtype="int64")
+    has_twsa = store.gauge_twsa_rows[rows] >= 0
+    gageids, rows = gageids[has_twsa], rows[has_twsa]
+    parameters = store.parameters
+    columns = store.axis.columns
+
+    path = os.path.join(out_dir, partition_name(*combination))
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    arrays = [
+        (GAGEIDS_FILE, gageids),
+        # the bitmask of the parameter table, January in bit 0
+        (MONTH_FLAGS_FILE, parameters.month_masks[model_temporal_feasibility][rows]),
+        (SPATIAL_FILE, parameters[var_sd][rows]),
+        (TEMPORAL_FILE, parameters[var_td][rows]),
+    ]
+    for name, values in arrays:
+        np.save(os.path.join(tmp_path, name), values)
+
+    # same float64 arithmetic as utils.GaugeSeries.q_pred
+    alpha = parameters[var_alpha].astype("float64")[rows]
+    beta = parameters[var_beta].astype("float64")[rows]
+    q_pred = np.lib.format.open_memmap(
+        os.path.join(tmp_path, Q_PRED_FILE),
+        mode="w+",
+        dtype="float64",
+        shape=(len(rows), len(columns)),
+    )
+    for start in range(0, len(rows), chunk_size):
+        block = slice(start, start + chunk_size)
+        twsa_rows = store.gauge_twsa_rows[rows[block]]
+        twsa = np.asarray(store.twsa_values[twsa_rows][:, columns], dtype="float64")
+        q_pred[block] = alpha[block, None] * np.exp(twsa * beta[block, None])
+    q_pred.flush()
+    del q_pred
+
+    manifest = dict(
+        models=list(combination),
+        signature=signature,
+        gauges=int(len(rows)),
+        months=int(len(columns)),
+        created=time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    )
+    with open(os.path.join(tmp_path, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return len(rows)
+
+
+_worker_store = None  # type: Optional[datastore.GaugeDataStore]
+
+
+def _init_worker(data_dir: str, cutoff: Optional[str]):
+    global _worker_store
+    _worker_store = datastore.GaugeDataStore.load(data_dir, cutoff)
+
+
+def _run_partition(out_dir: str, combination: Combination, signature: list) -> Tuple[int, float]:
+    store = _worker_store
+    if data_signature(store.data_dir, store.cutoff, store.sources) != signature:
+        raise RuntimeError(f"The datasets of {store.data_dir} changed during the run")
+    start = time.perf_counter()
+    n_gauges = write_partition(_worker_store, out_dir, combination, signature)
+    return n_gauges, time.perf_counter() - start
+
+
+def precompute(
+    data_dir: str = datastore.DATA_DIR,
+    workers: Optional[int] = None,
+    force: bool = False,
+    cutoff: Optional[str] = datastore.TWSA_CUTOFF,
+) -> List[Combination]:
+    """
+    Precomputes every model combination on a process pool.
+
+    Partitions that are complete and current are skipped, so an
+    interrupted job resumes where it stopped.
+
+    Parameters
+    ----------
+    data_dir: str
+        Directory containing the gauge datasets, the partitions are
+        written to its PRECOMPUTED_DIR.
+    workers: int
+        Number of processes, os.cpu_count() if None.
+    force: bool
+        Recompute partitions that are current.
+    cutoff: str
+        Last TWSA date served.
+
+    Returns
+    -------
+    List[Tuple[str, str, str]]
+        Combinations that were computed
+    """
+    out_dir = os.path.join(data_dir, PRECOMPUTED_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+
+    store = datastore.GaugeDataStore.load(data_dir, cutoff)
+    signature = data_signature(data_dir, cutoff, store.sources)
+    todo = []
+    for combination in combinations(store):
+        manifest = read_manifest(os.path.join(out_dir, partition_name(*combination)))
+        if not force and manifest is not None and manifest["signature"] == signature:
+            logger.info(f"{partition_name(*combination)} is current, skipped")
+            continue
+        todo.append(combination)
+    del store
+
+    if not todo:
+        return todo
+    workers = min(workers or os.cpu_count() or 1, len(todo))
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(data_dir, cutoff)
+    ) as pool:
+        futures = {
+            pool.submit(_run_partition, out_dir, combination, signature): combination
+            for combination in todo
+        }
+        for future in as_completed(futures):
+            n_gauges, seconds = future.result()
+            logger.info(
+                f"Precomputed {partition_name(*futures[future])}: "
+                f"{n_gauges} gauges in {seconds:.1f} s"
+            )
+    return todo
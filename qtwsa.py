@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Command line tools for the Q-TWSA app.
+
+Run from the repository root, e.g.:
+
+    python -m qtwsa convert-data --data-dir static/data
+    python -m qtwsa precompute --data-dir static/data
+    python -m qtwsa startup-profile
+"""
+
+import argparse
+import importlib
+import json
+import os
+import time
+
+# local imports
+import logging_config
+
+
+def convert_data(args: argparse.Namespace):
+    import datastore
+
+    binary_dir = datastore.convert_to_binary(args.data_dir)
+    print(f"Binary gauge datasets written to {binary_dir}")
+
+
+def precompute(args: argparse.Namespace):
+    import precompute
+
+    start = time.perf_counter()
+    done = precompute.precompute(args.data_dir, workers=args.workers, force=args.force)
+    print(
+        f"Precomputed {len(done)} model combinations in "
+        f"{time.perf_counter() - start:.1f} s into "
+        f"{os.path.join(args.data_dir, precompute.PRECOMPUTED_DIR)}"
+    )
+
+
+def startup_profile(args: argparse.Namespace):
+    """
+    Times the phases of an app cold start in this fresh interpreter.
+    """
+    os.environ["QTWSA_DATA_DIR"] = args.data_dir
+    # importing app would start the warm-up in a thread that loads the
+    # datasets while the phases below are timed, it is timed last instead
+    os.environ["QTWSA_WARMUP"] = "off"
+    phases = []
+
+    def phase(name, func):
+        start = time.perf_counter()
+        try:
+            func()
+            status = "ok"
+        except (FileNotFoundError, KeyError) as e:
+            status = f"skipped ({type(e).__name__}: {e})"
+        elapsed = time.perf_counter() - start
+        phases.append(dict(phase=name, seconds=elapsed, status=status))
+
+    def imports(*modules):
+        return lambda: [importlib.import_module(m) for m in modules]
+
+    def load_datasets():
+        importlib.import_module("datastore").get_store()
+
+    def first_click():
+        import datastore
+        import utils
+
+        gageid = next(iter(datastore.get_store().gauge_index))
+        utils.handle_click(gageid, "GP", "XGB", "RF")
+
+    def warm_up():
+        importlib.import_module("warmup").load_caches()
+
+    phase("import numpy, pandas", imports("numpy", "pandas"))
+    phase(
+        "import dash, dash_bootstrap_components",
+        imports("dash", "dash_bootstrap_components"),
+    )
+    phase("import plotly.graph_objects", imports("plotly.graph_objects"))
+    phase("import utils and helpers", imports("utils", "components", "mapview"))
+    phase("import layout (map data, map figure)", imports("layout"))
+    phase("import callbacks", imports("callbacks"))
+    phase("import app (Dash app)", imports("app"))
+    phase("load gauge datasets", load_datasets)
+    phase("first click", first_click)
+    phase("warm up the remaining caches", warm_up)
+
+    if args.json:
+        print(json.dumps(phases, indent=2))
+        return
+    total = 0.0
+    for p in phases:
+        total += p["seconds"]
+        print(
+            f"{p['phase']:<42} {p['seconds'] * 1e3:9.1f} ms "
+            f"{total * 1e3:9.1f} ms  {p['status']}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="qtwsa", description="Q-TWSA app tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert = subparsers.add_parser(
+        "convert-data",
+        help="convert the TWSA and observation csv files to memory-mappable arrays",
+    )
+    convert.add_argument("--data-dir", default="static/data")
+    convert.set_defaults(func=convert_data)
+
+    batch = subparsers.add_parser(
+        "precompute",
+        help="precompute the discharge of every gauge and model combination",
+    )
+    batch.add_argument("--data-dir", default="static/data")
+    batch.add_argument(
+        "--workers", type=int, default=None, help="processes, one per CPU by default"
+    )
+    batch.add_argument(
+        "--force", action="store_true", help="recompute combinations that are current"
+    )
+    batch.set_defaults(func=precompute)
+
+    profile = subparsers.add_parser(
+        "startup-profile", help="time the phases of an app cold start"
+    )
+    profile.add_argument("--data-dir", default="static/data")
+    profile.add_argument(
+        "--json", action="store_true", help="print the phases as JSON"
+    )
+    profile.set_defaults(func=startup_profile)
+
+    args = parser.parse_args(argv)
+    logging_config.configure_logger()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
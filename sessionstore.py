@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+# typing imports
+from typing import Optional, Union
+
+# local imports
+import cache
+import instrumentation
+import localstate
+from logging_config import get_logger
+
+
+# instantiate logger
+logger = get_logger(__name__)
+
+
+# "sqlite" is shared by all workers on an instance, "memory" is per process
+RESULT_STORE_BACKEND = os.environ.get("QTWSA_RESULT_STORE", "sqlite")
+# SQLite file of the "sqlite" backend, in localstate.state_dir() if unset
+RESULT_STORE_PATH = os.environ.get("QTWSA_RESULT_STORE_PATH")
+RESULT_STORE_BYTES = int(os.environ.get("QTWSA_RESULT_STORE_BYTES", 256 * 2**20))
+
+
+def make_key(*parts) -> str:
+    """
+    Builds the short key under which a result is stored and that is held
+    in the browser instead of the result itself.
+
+    Parameters
+    ----------
+    parts:
+        Values identifying the result, e.g. gauge and model selection.
+
+    Returns
+    -------
+    str
+        20 character hexadecimal key
+    """
+    return hashlib.sha1("|".join(map(str, parts)).encode()).hexdigest()[:20]
+
+
+def encode_frame(frame: pd.DataFrame) -> bytes:
+    """
+    Serializes a DataFrame of numeric, datetime and string columns into
+    an uncompressed numpy archive. Unlike a pickle, reading it back cannot
+    run code.
+
+    Parameters
+    ----------
+    frame: pandas.DataFrame
+        Frame to serialize, its column and index names are kept as strings.
+
+    Returns
+    -------
+    bytes
+        Archive, see decode_frame
+    """
+    arrays = dict(
+        __columns__=np.array([str(c) for c in frame.columns], dtype="U"),
+        __objects__=np.array([frame[c].dtype == object for c in frame.columns], dtype=bool),
+        __index__=np.asarray(frame.index),
+    )
+    if arrays["__index__"].dtype == object:
+        arrays["__index__"] = arrays["__index__"].astype("U")
+    if frame.index.name is not None:
+        arrays["__index_name__"] = np.array(str(frame.index.name), dtype="U")
+    for i, column in enumerate(frame.columns):
+        values = np.asarray(frame[column])
+        if values.dtype == object:
+            # missing values of string columns are kept apart
+            arrays[f"m{i}"] = pd.isna(values)
+            values = np.where(arrays[f"m{i}"], "", values).astype("U")
+        arrays[f"c{i}"] = values
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def decode_frame(payload: bytes) -> pd.DataFrame:
+    """
+    Reads a DataFrame written by encode_frame, string columns are object
+    columns again with None for missing values.
+    """
+    with np.load(io.BytesIO(payload), allow_pickle=False) as arrays:
+        columns = arrays["__columns__"]
+        objects = arrays["__objects__"]
+        data = {}
+        for i, column in enumerate(columns):
+            values = arrays[f"c{i}"]
+            if objects[i]:
+                values = values.astype(object)
+                values[arrays[f"m{i}"]] = None
+            data[str(column)] = values
+        index = pd.Index(arrays["__index__"])
+        if "__index_name__" in arrays.files:
+            index.name = str(arrays["__index_name__"])
+        return pd.DataFrame(data, index=index, columns=list(data))
+
+
+class MemoryResultStore:
+    """
+    Per-process result store backed by a byte-bounded LRU cache.
+    """
+
+    def __init__(self, max_bytes: int = RESULT_STORE_BYTES):
+        self.cache = cache.ResultCache(max_bytes, name="result-store")
+        instrumentation.register_cache(self.cache)
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        return self.cache.get(key)
+
+    def put(self, key: str, frame: pd.DataFrame):
+        self.cache.put(key, frame)
+
+
+class SqliteResultStore:
+    """
+    Result store in a local SQLite file, shared by all worker processes of
+    an instance. Least recently read results are deleted once the stored
+    payloads exceed `max_bytes`. Frames are stored with encode_frame.
+
+    Parameters
+    ----------
+    path: str
+        SQLite file, "results.sqlite" in localstate.state_dir() if None.
+    max_bytes: int
+        Byte budget of the stored payloads.
+    """
+
+    def __init__(
+        self, path: Optional[str] = RESULT_STORE_PATH, max_bytes: int = RESULT_STORE_BYTES
+    ):
+        self.path = path or os.path.join(localstate.state_dir(), "results.sqlite")
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        with self._connection() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, payload BLOB, size INTEGER, accessed REAL)"
+            )
+            con.execute(
+                "CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        return localstate.connect(self.path, self._local)
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        with self._connection() as con:
+            row = con.execute(
+                "SELECT payload FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            con.execute(
+                "UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+        try:
+            return decode_frame(row[0])
+        except (OSError, ValueError, KeyError):
+            # e.g. written by an older version, computed again by the caller
+            logger.warning(f"Unreadable result {key} in {self.path}")
+            return None
+
+    def put(self, key: str, frame: pd.DataFrame):
+        payload = encode_frame(frame)
+        with self._connection() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                (key, payload, len(payload), time.time()),
+            )
+            (total,) = con.execute("SELECT TOTAL(size) FROM results").fetchone()
+            if total > self.max_bytes:
+                self._evict(con, total)
+
+    def _evict(self, con: sqlite3.Connection, total: float):
+        rows = con.execute("SELECT key, size FROM results ORDER BY accessed")
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        con.executemany("DELETE FROM results WHERE key = ?", evicted)
+        logger.debug(f"Evicted {len(evicted)} results from {self.path}")
+
+
+ResultStore = Union[MemoryResultStore, SqliteResultStore]
+
+_result_store = None  # type: Optional[ResultStore]
+_result_store_lock = threading.Lock()
+
+
+def get_result_store() -> ResultStore:
+    """
+    Returns the process-wide result store selected by QTWSA_RESULT_STORE.
+
+    Returns
+    -------
+    ResultStore
+        Store holding the results referenced by the browser-side keys
+    """
+    global _result_store
+    if _result_store is None:
+        with _result_store_lock:
+            if _result_store is None:
+                if RESULT_STORE_BACKEND == "memory":
+                    _result_store = MemoryResultStore()
+                else:
+                    _result_store = SqliteResultStore()
+                logger.info(f"Using {type(_result_store).__name__} for results")
+    return _result_store
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+# typing imports
+from typing import Dict, Optional
+
+# local imports
+import datastore
+import engine
+import precompute
+from logging_config import get_logger
+
+
+# instantiate logger
+logger = get_logger(__name__)
+
+
+SKILL_DIR = "skill"
+
+# gauges with fewer observed months are not scored
+MIN_MONTHS = int(os.environ.get("QTWSA_SKILL_MIN_MONTHS", 12))
+
+SCORE_COLUMNS = ["months", "KGE", "NSE", "pbias"]
+
+# part of the disk cache signature, bump when the scores change
+CACHE_VERSION = 1
+
+
+def observation_matrix(store: datastore.GaugeDataStore) -> np.ndarray:
+    """
+    Observed discharge of every gauge with observations, aligned on the
+    served TWSA months in one vectorized scatter.
+
+    Parameters
+    ----------
+    store: GaugeDataStore
+        Datasets to read.
+
+    Returns
+    -------
+    numpy.ndarray
+        float64 (observation gauges x served months), in the order of
+        store.obs_gageids, NaN for months without an observation
+    """
+    axis = store.axis
+    months = axis.months[axis.columns].astype("int64")
+    n_gauges = len(store.obs_gageids)
+    if len(months) == 0 or len(store.obs_months) == 0:
+        return np.full((n_gauges, len(months)), np.nan)
+    # (gauge, month) keys, sorted for the observations as they are stored
+    # by gauge and date; every served month of every gauge is looked up
+    # with one searchsorted, the first of duplicate months wins as in
+    # MonthAxis.align
+    obs_months = np.asarray(store.obs_months, dtype="int64")
+    first = min(months.min(), obs_months.min())
+    span = max(months.max(), obs_months.max()) - first + 1
+    gauges = np.repeat(np.arange(n_gauges), np.diff(store.obs_offsets))
+    obs_keys = gauges * span + (obs_months - first)
+    keys = np.arange(n_gauges)[:, None] * span + (months - first)[None, :]
+    pos = np.searchsorted(obs_keys, keys)
+    pos[pos == len(obs_keys)] = 0
+    found = obs_keys[pos] == keys
+    return np.where(found, np.asarray(store.obs_q, dtype="float64")[pos], np.nan)
+
+
+def scores(sim: np.ndarray, obs: np.ndarray, min_months: int = MIN_MONTHS) -> Dict[str, np.ndarray]:
+    """
+    Kling-Gupta efficiency, Nash-Sutcliffe efficiency and percent bias of
+    every row, over the months where both series have a value.
+
+    Parameters
+    ----------
+    sim: numpy.ndarray
+        Simulated discharge, (gauges x months).
+    obs: numpy.ndarray
+        Observed discharge, same shape, NaN for missing months.
+    min_months: int
+        Rows with fewer common months are NaN.
+
+    Returns
+    -------
+    Dict[str, numpy.ndarray]
+        months, KGE, NSE and pbias of every row
+    """
+    valid = np.isfinite(sim) & np.isfinite(obs)
+    n = valid.sum(axis=1)
+    sim = np.where(valid, sim, 0.0)
+    obs = np.where(valid, obs, 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sum_sim, sum_obs = sim.sum(axis=1), obs.sum(axis=1)
+        mean_sim, mean_obs = sum_sim / n, sum_obs / n
+        d_sim = np.where(valid, sim - mean_sim[:, None], 0.0)
+        d_obs = np.where(valid, obs - mean_obs[:, None], 0.0)
+        ss_sim = (d_sim ** 2).sum(axis=1)
+        ss_obs = (d_obs ** 2).sum(axis=1)
+
+        r = (d_sim * d_obs).sum(axis=1) / np.sqrt(ss_sim * ss_obs)
+        variability = np.sqrt(ss_sim / ss_obs)
+        bias = mean_sim / mean_obs
+        kge = 1 - np.sqrt((r - 1) ** 2 + (variability - 1) ** 2 + (bias - 1) ** 2)
+        nse = 1 - ((sim - obs) ** 2).sum(axis=1) / ss_obs
+        pbias = 100 * (sum_sim - sum_obs) / sum_obs
+
+    result = dict(months=n, KGE=kge, NSE=nse, pbias=pbias)
+    too_short = n < min_months
+    for name in ("KGE", "NSE", "pbias"):
+        values = result[name]
+        values[too_short | ~np.isfinite(values)] = np.nan
+    return result
+
+
+def compute_scores(
+    model_regionalisation: str,
+    store: Optional[datastore.GaugeDataStore] = None,
+    chunk_size: int = engine.DEFAULT_CHUNK_SIZE,
+) -> pd.DataFrame:
+    """
+    Scores the simulated discharge of a regionalisation model against the
+    observations of every gauge that has both.
+
+    The discharge is computed as in utils.compute_click, over the served
+    months, in blocks of `chunk_size` gauges.
+
+    Parameters
+    ----------
+    model_regionalisation: str
+        Regionalisation model, see engine.REGIONALISATION_COLUMNS.
+    store: GaugeDataStore
+        Datasets, the process-wide store if None.
+    chunk_size: int
+        Number of gauges scored per block.
+
+    Returns
+    -------
+    pandas.DataFrame
+        GAGEID and the SCORE_COLUMNS, one row per gauge with observations
+        and model parameters
+    """
+    store = store or datastore.get_store()
+    columns = store.axis.columns
+    var_alpha, var_beta = engine.REGIONALISATION_COLUMNS[model_regionalisation]
+
+    # observation gauges with model parameters and TWSA
+    model_rows = np.array(
+        [store.gauge_index.get(datastore.normalize_gageid(g), -1) for g in store.obs_gageids],
+        dtype="int64",
+    )
+    has_model = model_rows >= 0
+    twsa_rows = np.full(len(model_rows), -1, dtype="int64")
+    twsa_rows[has_model] = store.gauge_twsa_rows[model_rows[has_model]]
+    scored = np.flatnonzero(twsa_rows >= 0)
+
+    obs = observation_matrix(store)[scored]
+    alpha = store.parameters[var_alpha].astype("float64")[model_rows[scored]]
+    beta = store.parameters[var_beta].astype("float64")[model_rows[scored]]
+
+    parts = []
+    for start in range(0, len(scored), chunk_size):
+        block = slice(start, start + chunk_size)
+        twsa = np.asarray(store.twsa_values[twsa_rows[scored[block]]][:, columns], dtype="float64")
+        sim = alpha[block, None] * np.exp(twsa * beta[block, None])
+        parts.append(scores(sim, obs[block]))
+
+    result = pd.DataFrame(
+        {
+            name: np.concatenate([p[name] for p in parts]) if parts else np.empty(0)
+            for name in SCORE_COLUMNS
+        }
+    )
+    result.insert(0, "GAGEID", store.obs_gageids[scored].astype("str"))
+    result["months"] = result["months"].astype("int64")
+    return result
+
+
+class SkillScores:
+    """
+    Scores of one regionalisation model with a GAGEID lookup and the
+    ranked leaderboard.
+
+    Parameters
+    ----------
+    frame: pandas.DataFrame
+        Output of compute_scores.
+    """
+
+    def __init__(self, frame: pd.DataFrame):
+        self.frame = frame
+        # first occurrence wins, as in GaugeDataStore.gauge_index
+        self.index = {}  # type: Dict[str, int]
+        for i, gageid in enumerate(frame["GAGEID"]):
+            self.index.setdefault(datastore.normalize_gageid(gageid), i)
+        # scored gauges, best KGE first
+        leaderboard = frame.dropna(subset=["KGE"]).sort_values(
+            "KGE", ascending=False, kind="stable"
+        )
+        leaderboard.insert(0, "rank", np.arange(1, len(leaderboard) + 1))
+        self.leaderboard = leaderboard.reset_index(drop=True)
+
+    def get(self, gageid: str) -> Optional[Dict[str, float]]:
+        """
+        Returns the scores of a gauge, None if it is not scored.
+        """
+        i = self.index.get(datastore.normalize_gageid(gageid))
+        if i is None:
+            return None
+        return {name: self.frame[name].values[i] for name in SCORE_COLUMNS}
+
+
+def _cache_file(data_dir: str, model_regionalisation: str) -> str:
+    return os.path.join(data_dir, SKILL_DIR, f"{model_regionalisation}.npz")
+
+
+def load_or_compute(
+    model_regionalisation: str,
+    data_dir: Optional[str] = None,
+    store: Optional[datastore.GaugeDataStore] = None,
+) -> pd.DataFrame:
+    """
+    Reads the scores of a regionalisation model from the disk cache in
+    `data_dir`/SKILL_DIR, or computes them and writes the cache. A cache
+    written from other datasets, another cutoff or another MIN_MONTHS is
+    recomputed. The datasets are those the store was loaded from (see
+    GaugeDataStore.sources), a store built otherwise is not cached.
+    `data_dir` defaults to the directory of the store.
+    """
+    store = store or datastore.get_store()
+    data_dir = data_dir or store.data_dir
+    signature = None
+    if store.sources and data_dir is not None:
+        cache_file = _cache_file(data_dir, model_regionalisation)
+        signature = json.dumps(
+            [CACHE_VERSION, MIN_MONTHS, precompute.RESULTS_VERSION, str(store.axis.cutoff)]
+            + [store.sources[dataset] for dataset in sorted(store.sources)]
+        )
+
+    if signature is not None and os.path.exists(cache_file):
+        with np.load(cache_file, allow_pickle=False) as cached:
+            if str(cached["__signature__"]) == signature:
+                return pd.DataFrame({k: cached[k] for k in ["GAGEID"] + SCORE_COLUMNS})
+        logger.info(f"Datasets changed, recomputing {cache_file}")
+
+    frame = compute_scores(model_regionalisation, store)
+    if signature is not None:
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            with open(cache_file + ".tmp", "wb") as f:
+                np.savez(
+                    f,
+                    __signature__=signature,
+                    GAGEID=frame["GAGEID"].values.astype("U"),
+                    **{k: frame[k].values for k in SCORE_COLUMNS},
+                )
+            os.replace(cache_file + ".tmp", cache_file)
+        except OSError as e:
+            logger.warning(f"Could not write skill cache {cache_file}: {e}")
+    return frame
+
+
+_scores = {}  # type: Dict[str, SkillScores]
+_scores_lock = threading.Lock()
+
+
+def get_scores(model_regionalisation: str) -> SkillScores:
+    """
+    Returns the process-wide SkillScores of a regionalisation model.
+    """
+    model_scores = _scores.get(model_regionalisation)
+    if model_scores is None:
+        with _scores_lock:
+            model_scores = _scores.get(model_regionalisation)
+            if model_scores is None:
+                store = datastore.get_store()
+                model_scores = SkillScores(load_or_compute(model_regionalisation, store=store))
+                # not kept if the datasets were replaced meanwhile
+                if datastore.get_store() is store:
+                    _scores[model_regionalisation] = model_scores
+    return model_scores
+
+
+def clear_scores():
+    """
+    Forgets the scores loaded so far, e.g. after the datasets were
+    reloaded. The disk cache notices changed datasets by itself.
+    """
+    with _scores_lock:
+        _scores.clear()
+
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+import math
+import re
+import threading
+import numpy as np
+
+# typing imports
+from typing import Optional, Tuple
+
+# local imports
+import mapview
+
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# grid cell size, about 0.1 gauges per land cell for the global catalogue
+CELL_DEGREES = 1.0
+
+# first search radius of nearest(), grown by NEAREST_GROWTH until k
+# gauges are found
+NEAREST_START_KM = 50.0
+NEAREST_GROWTH = 8
+
+# "lat, lon" or "lat, lon, radius", the radius in km
+LOCATION_PATTERN = re.compile(
+    r"^\s*(?P<lat>[-+]?\d+(?:\.\d*)?)\s*[,;\s]\s*(?P<lon>[-+]?\d+(?:\.\d*)?)"
+    r"(?:\s*[,;\s]\s*(?P<radius>\d+(?:\.\d*)?)\s*(?:km)?)?\s*$",
+    re.IGNORECASE,
+)
+
+Matches = Tuple[np.ndarray, np.ndarray]
+
+
+def parse_location(text: Optional[str]) -> Optional[Tuple[float, float, Optional[float]]]:
+    """
+    Parses a "lat, lon[, radius km]" search.
+
+    Parameters
+    ----------
+    text: str
+        Search text.
+
+    Returns
+    -------
+    Optional[Tuple[float, float, Optional[float]]]
+        Latitude, longitude and radius in km (None if not given), None if
+        the text is not a valid location
+    """
+    match = LOCATION_PATTERN.match(text or "")
+    if match is None:
+        return None
+    lat, lon = float(match.group("lat")), float(match.group("lon"))
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    radius = match.group("radius")
+    return lat, lon, float(radius) if radius is not None else None
+
+
+def haversine_km(
+    lat: float, lon: float, lats: np.ndarray, lons: np.ndarray
+) -> np.ndarray:
+    """
+    Great-circle distances in km from one location to many.
+    """
+    lat, lon = np.radians(lat), np.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = (
+        np.sin((lats - lat) / 2) ** 2
+        + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GridIndex:
+    """
+    Latitude/longitude grid over the gauge locations for radius and
+    nearest-neighbour queries.
+
+    Gauges are sorted by grid cell, row-major from the south-west, so the
+    gauges of a run of cells along one latitude row are a contiguous
+    slice found with two binary searches. A query gathers the slices of
+    the rows its bounding box covers and measures exact great-circle
+    distances on those candidates only.
+
+    Parameters
+    ----------
+    lat: numpy.ndarray
+        Gauge latitudes in degrees.
+    lon: numpy.ndarray
+        Gauge longitudes in degrees.
+    cell_degrees: float
+        Size of the grid cells in degrees.
+    """
+
+    def __init__(self, lat: np.ndarray, lon: np.ndarray, cell_degrees: float = CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.n_rows = int(math.ceil(180 / cell_degrees))
+        self.n_cols = int(math.ceil(360 / cell_degrees))
+
+        cells = self._rows(lat) * self.n_cols + self._cols(lon)
+        self.order = np.argsort(cells, kind="stable")
+        self.cells = cells[self.order]
+        self.lat = np.asarray(lat, dtype="float64")[self.order]
+        self.lon = np.asarray(lon, dtype="float64")[self.order]
+        self.lat_r = np.radians(self.lat)
+        self.lon_r = np.radians(self.lon)
+        self.cos_lat = np.cos(self.lat_r)
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def _rows(self, lat: np.ndarray) -> np.ndarray:
+        row = np.floor((np.asarray(lat, dtype="float64") + 90) / self.cell_degrees)
+        return np.clip(row, 0, self.n_rows - 1).astype("int64")
+
+    def _cols(self, lon: np.ndarray) -> np.ndarray:
+        lon = (np.asarray(lon, dtype="float64") + 180) % 360
+        return np.clip(np.floor(lon / self.cell_degrees), 0, self.n_cols - 1).astype("int64")
+
+    def _cell_row(self, lat: float) -> int:
+        return min(max(int((lat + 90) // self.cell_degrees), 0), self.n_rows - 1)
+
+    def _cell_col(self, lon: float) -> int:
+        return min(int(((lon + 180) % 360) // self.cell_degrees), self.n_cols - 1)
+
+    def _candidates(self, lat: float, lon: float, radius_km: float) -> np.ndarray:
+        # positions (in sorted order) of the gauges of the cells covering
+        # the bounding box of the circle
+        dlat = radius_km / KM_PER_DEGREE
+        south, north = lat - dlat, lat + dlat
+        rows = np.arange(self._cell_row(south), self._cell_row(north) + 1) * self.n_cols
+
+        cos_lat = math.cos(math.radians(min(max(abs(south), abs(north)), 90)))
+        if north >= 90 or south <= -90 or cos_lat * 180 <= dlat:
+            # the circle reaches a pole or spans every longitude
+            spans = [(0, self.n_cols - 1)]
+        else:
+            dlon = dlat / cos_lat
+            first, last = self._cell_col(lon - dlon), self._cell_col(lon + dlon)
+            if first <= last:
+                spans = [(first, last)]
+            else:
+                # crosses the antimeridian
+                spans = [(first, self.n_cols - 1), (0, last)]
+
+        if len(spans) == 1:
+            first, last = spans[0]
+            starts = self.cells.searchsorted(rows + first)
+            stops = self.cells.searchsorted(rows + last + 1)
+        else:
+            (first, _), (_, last) = spans
+            starts = np.concatenate(
+                [self.cells.searchsorted(rows + first), self.cells.searchsorted(rows)]
+            )
+            stops = np.concatenate(
+                [self.cells.searchsorted(rows + self.n_cols), self.cells.searchsorted(rows + last + 1)]
+            )
+        lengths = stops - starts
+        total = lengths.sum()
+        if total == 0:
+            return np.empty(0, dtype="int64")
+        # concatenated aranges of the slices, without a python loop
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return offsets + np.arange(total)
+
+    def _search(self, lat: float, lon: float, radius_km: float) -> Matches:
+        # unsorted positions (in sorted order) and distances within radius_km
+        candidates = self._candidates(lat, lon, radius_km)
+        if len(candidates) == 0:
+            return candidates, np.empty(0)
+        # haversine with the gauge terms precomputed
+        lat_r, lon_r = math.radians(lat), math.radians(lon)
+        a = (
+            np.sin((self.lat_r[candidates] - lat_r) / 2) ** 2
+            + math.cos(lat_r) * self.cos_lat[candidates]
+            * np.sin((self.lon_r[candidates] - lon_r) / 2) ** 2
+        )
+        distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+        inside = distances <= radius_km
+        return candidates[inside], distances[inside]
+
+    def within(self, lat: float, lon: float, radius_km: float) -> Matches:
+        """
+        Gauges within `radius_km` of a location.
+
+        Parameters
+        ----------
+        lat: float
+            Latitude in degrees.
+        lon: float
+            Longitude in degrees.
+        radius_km: float
+            Search radius in km.
+
+        Returns
+        -------
+        Tuple[numpy.ndarray, numpy.ndarray]
+            Positions of the gauges in the arrays the index was built from
+            and their distances in km, nearest first
+        """
+        candidates, distances = self._search(lat, lon, radius_km)
+        by_distance = np.argsort(distances, kind="stable")
+        return self.order[candidates[by_distance]], distances[by_distance]
+
+    def nearest(self, lat: float, lon: float, k: int = 1) -> Matches:
+        """
+        The `k` gauges nearest to a location.
+
+        The search radius starts at NEAREST_START_KM and grows until it
+        holds `k` gauges; every gauge nearer than the k-th is then inside
+        the searched circle, so the answer is exact.
+
+        Parameters
+        ----------
+        lat: float
+            Latitude in degrees.
+        lon: float
+            Longitude in degrees.
+        k: int
+            Number of gauges.
+
+        Returns
+        -------
+        Tuple[numpy.ndarray, numpy.ndarray]
+            Positions of the gauges in the arrays the index was built from
+            and their distances in km, nearest first
+        """
+        k = min(k, len(self))
+        radius_km = NEAREST_START_KM
+        while True:
+            candidates, distances = self._search(lat, lon, radius_km)
+            if len(candidates) >= k or radius_km > math.pi * EARTH_RADIUS_KM:
+                break
+            radius_km *= NEAREST_GROWTH
+        if k < len(candidates):
+            nearest = np.argpartition(distances, k - 1)[:k]
+            candidates, distances = candidates[nearest], distances[nearest]
+        by_distance = np.argsort(distances, kind="stable")
+        return self.order[candidates[by_distance]], distances[by_distance]
+
+
+_index = None  # type: Optional[GridIndex]
+_index_lock = threading.Lock()
+
+
+def get_index() -> GridIndex:
+    """
+    Returns the process-wide GridIndex over mapview.get_map_points().
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                points = mapview.get_map_points()
+                _index = GridIndex(points.lat, points.lon)
+    return _index
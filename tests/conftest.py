@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# local imports
+import datastore
+
+
+# gauges of the small data directory, taken from the top of the model table
+N_GAUGES = 300
+
+
+def write_data_dir(out_dir: str, n_gauges: int = N_GAUGES, seed: int = 0) -> str:
+    """
+    Writes a small data directory: the dates file, the first `n_gauges`
+    rows of the model table, random TWSA for their COMIDs and observed
+    discharge for most of them, with gaps.
+    """
+    rng = np.random.default_rng(seed)
+    source_dir = os.path.join(ROOT, "static", "data")
+    shutil.copy(
+        os.path.join(source_dir, datastore.DATES_FILE),
+        os.path.join(out_dir, datastore.DATES_FILE),
+    )
+    models = pd.read_csv(
+        os.path.join(source_dir, datastore.MODELS_FILE),
+        dtype={"GAGEID": str},
+        nrows=n_gauges,
+    )
+    models.to_csv(os.path.join(out_dir, datastore.MODELS_FILE), index=False)
+
+    dates = pd.read_csv(os.path.join(out_dir, datastore.DATES_FILE), usecols=range(2))
+    # the last gauges have no TWSA
+    comids = models["COMID"].drop_duplicates().values[:-5]
+    twsa = pd.DataFrame(
+        rng.normal(0, 8, (len(comids), len(dates))).round(3),
+        columns=dates["date"].astype(str),
+    )
+    twsa.insert(0, "COMID", comids)
+    twsa.to_csv(os.path.join(out_dir, datastore.TWSA_FILE), index=False)
+
+    months = np.arange("2000-01", "2024-01", dtype="datetime64[M]")
+    records = []
+    for gageid in models["GAGEID"].drop_duplicates().values[::10][1:]:
+        observed = months[rng.random(len(months)) < 0.7]
+        records.append(
+            pd.DataFrame(
+                dict(
+                    GAGEID=gageid,
+                    date=observed.astype("datetime64[D]"),
+                    Q_mon=rng.lognormal(0, 1, len(observed)).round(3),
+                )
+            )
+        )
+    pd.concat(records).to_csv(
+        os.path.join(out_dir, datastore.OBSERVATIONS_FILE), index=False
+    )
+    return out_dir
+
+
+@pytest.fixture(scope="session")
+def data_dir(tmp_path_factory) -> str:
+    return write_data_dir(str(tmp_path_factory.mktemp("data")))
+
+
+@pytest.fixture(scope="session")
+def store(data_dir) -> datastore.GaugeDataStore:
+    # served as the process-wide store, as by the app
+    store = datastore.GaugeDataStore.load(data_dir)
+    datastore.set_store(store)
+    return store
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+import gzip
+import io
+import json
+import flask
+import numpy as np
+import pandas as pd
+import pytest
+
+# local imports
+import api
+import mapview
+import spatialindex
+import utils
+
+
+@pytest.fixture(scope="module")
+def client(store):
+    server = flask.Flask(__name__)
+    server.register_blueprint(api.blueprint)
+    return server.test_client()
+
+
+@pytest.fixture
+def points(monkeypatch):
+    rng = np.random.default_rng(0)
+    n = 500
+    points = mapview.MapPoints(
+        pd.DataFrame(
+            dict(
+                GAGEID=[str(1000000 + i) for i in range(n)],
+                Lat=rng.uniform(30, 50, n),
+                Lon=rng.uniform(-120, -70, n),
+                area=rng.uniform(10, 1000, n),
+            )
+        )
+    )
+    monkeypatch.setattr(mapview, "_points", points)
+    monkeypatch.setattr(spatialindex, "_index", None)
+    return points
+
+
+def exported_gauges(store, n=5):
+    with_twsa = [g for g, row in store.gauge_index.items() if store.gauge_twsa_rows[row] >= 0]
+    return with_twsa[:n]
+
+
+def assert_matches_load_click(export: pd.DataFrame, gageids, store):
+    assert list(export["GAGEID"].unique()) == gageids
+    for gageid, rows in export.groupby("GAGEID", sort=False):
+        res = utils.load_click(gageid, "NuSVR", "SVC", "XT", store=store)
+        discharges = res["discharges"]
+        assert list(rows["datetime"]) == list(discharges["datetime"].dt.strftime("%Y-%m-%d"))
+        for column in ("twsa", "Q_pred", "Q_pred_selmonths", "Q_mon"):
+            np.testing.assert_allclose(
+                rows[column].astype(float), discharges[column], atol=1e-6, rtol=1e-6
+            )
+        assert (rows["spatial_discrepency"] == res["spatial_discrepency"]).all()
+        assert (rows["temporal_discrepency"] == res["temporal_discrepency"]).all()
+
+
+def test_csv_export_matches_load_click(client, store):
+    gageids = exported_gauges(store)
+    response = client.get(
+        "/api/v1/discharge",
+        query_string=dict(
+            gages=",".join(["not-a-gauge"] + gageids), reg="NuSVR", spatial="SVC", temporal="XT"
+        ),
+    )
+    assert response.status_code == 200
+    assert response.mimetype == "text/csv"
+    assert "Content-Encoding" not in response.headers
+    export = pd.read_csv(io.BytesIO(response.data), dtype={"GAGEID": str})
+    assert list(export.columns) == api.EXPORT_COLUMNS
+    # the unknown gauge is skipped
+    assert_matches_load_click(export, gageids, store)
+
+
+def test_ndjson_export_matches_load_click(client, store):
+    gageids = exported_gauges(store)
+    response = client.get(
+        "/api/v1/discharge",
+        query_string=dict(
+            gages=",".join(gageids), reg="NuSVR", spatial="SVC", temporal="XT", format="ndjson"
+        ),
+    )
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert all(list(record) == api.EXPORT_COLUMNS for record in records)
+    export = pd.DataFrame(records)
+    # missing values are null
+    assert export["Q_mon"].isna().any()
+    assert_matches_load_click(export, gageids, store)
+
+
+@pytest.mark.parametrize("fmt", ["csv", "ndjson"])
+def test_gzip_export(client, store, fmt):
+    query_string = dict(gages=",".join(exported_gauges(store)), format=fmt)
+    plain = client.get("/api/v1/discharge", query_string=query_string)
+    compressed = client.get(
+        "/api/v1/discharge", query_string=query_string, headers={"Accept-Encoding": "br, gzip"}
+    )
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.headers["Vary"] == "Accept-Encoding"
+    assert len(compressed.data) < len(plain.data)
+    assert gzip.decompress(compressed.data) == plain.data
+
+    refused = client.get(
+        "/api/v1/discharge", query_string=query_string, headers={"Accept-Encoding": "gzip;q=0"}
+    )
+    assert "Content-Encoding" not in refused.headers
+    assert refused.data == plain.data
+
+
+def test_export_of_all_gauges(client, store):
+    response = client.get("/api/v1/discharge", query_string=dict(gages="all"))
+    assert response.status_code == 200
+    export = pd.read_csv(io.BytesIO(response.data), dtype={"GAGEID": str})
+    with_twsa = [g for g, row in store.gauge_index.items() if store.gauge_twsa_rows[row] >= 0]
+    assert list(export["GAGEID"].unique()) == with_twsa
+    assert len(export) == len(with_twsa) * len(store.axis)
+
+
+@pytest.mark.parametrize(
+    "query_string, error",
+    [
+        (dict(gages="1"), None),
+        (dict(gages=" , "), "no gauges requested"),
+        (dict(), "no gauges requested"),
+        (dict(gages="1", reg="XX"), "unknown regionalisation model 'XX'"),
+        (dict(gages="1", spatial="XX"), "unknown spatial feasibility model 'XX'"),
+        (dict(gages="1", temporal="XX"), "unknown temporal feasibility model 'XX'"),
+        (dict(gages="1", format="xml"), "unknown format 'xml'"),
+    ],
+)
+def test_discharge_parameters(client, query_string, error):
+    response = client.get("/api/v1/discharge", query_string=query_string)
+    if error is None:
+        assert response.status_code == 200
+    else:
+        assert response.status_code == 400
+        assert response.get_json()["error"].startswith(error)
+
+
+def test_nearest_gauges(client, points):
+    response = client.get("/api/v1/gauges/nearest", query_string=dict(lat=40, lon=-100, k=3))
+    assert response.status_code == 200
+    gauges = response.get_json()["gauges"]
+    distances = spatialindex.haversine_km(40, -100, points.lat, points.lon)
+    nearest = np.argsort(distances)[:3]
+    assert [g["GAGEID"] for g in gauges] == list(points.gageid[nearest])
+    assert [g["distance_km"] for g in gauges] == sorted(g["distance_km"] for g in gauges)
+
+
+def test_gauges_within(client, points):
+    response = client.get(
+        "/api/v1/gauges/within", query_string=dict(lat=40, lon=-100, radius_km=300)
+    )
+    assert response.status_code == 200
+    gauges = response.get_json()["gauges"]
+    distances = spatialindex.haversine_km(40, -100, points.lat, points.lon)
+    assert {g["GAGEID"] for g in gauges} == set(points.gageid[distances <= 300])
+    assert all(g["distance_km"] <= 300 for g in gauges)
+
+
+@pytest.mark.parametrize(
+    "path, query_string, error",
+    [
+        ("nearest", dict(lon=0), "lat is required"),
+        ("nearest", dict(lat="north", lon=0), "lat is required"),
+        ("nearest", dict(lat=91, lon=0), "lat must be between"),
+        ("nearest", dict(lat=0, lon=-181), "lon must be between"),
+        ("nearest", dict(lat=0, lon=0, k=0), "k must be between"),
+        ("nearest", dict(lat=0, lon=0, k=api.MAX_NEAREST + 1), "k must be between"),
+        ("within", dict(lat=0, lon=0), "radius_km is required"),
+        ("within", dict(lat=0, lon=0, radius_km=api.MAX_RADIUS_KM + 1), "radius_km must be"),
+    ],
+)
+def test_gauge_search_parameters(client, points, path, query_string, error):
+    response = client.get(f"/api/v1/gauges/{path}", query_string=query_string)
+    assert response.status_code == 400
+    assert response.get_json()["error"].startswith(error)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pandas as pd
+
+# local imports
+import cache
+
+
+def _value(n_bytes: int) -> np.ndarray:
+    return np.zeros(n_bytes, dtype="uint8")
+
+
+def test_entries_stay_within_the_byte_budget():
+    results = cache.ResultCache(250)
+    for key in range(10):
+        results.put(key, _value(100))
+        assert results.current_bytes <= 250
+    assert len(results) == 2
+    assert results.current_bytes == 200
+    assert results.evictions == 8
+
+
+def test_least_recently_used_entry_is_evicted():
+    results = cache.ResultCache(300)
+    for key in "abc":
+        results.put(key, _value(100))
+    # a read makes "a" the most recently used
+    assert results.get("a") is not None
+    results.put("d", _value(100))
+    assert results.get("b") is None
+    assert all(results.get(key) is not None for key in "acd")
+
+    # replacing a value frees the old one and makes it the most recent
+    results.put("c", _value(150))
+    assert results.current_bytes == 250
+    assert results.get("a") is None
+    assert results.get("d") is not None
+
+
+def test_values_larger_than_the_budget_are_not_cached():
+    results = cache.ResultCache(100)
+    results.put("small", _value(50))
+    results.put("large", _value(101))
+    assert results.get("large") is None
+    assert results.get("small") is not None
+    assert results.evictions == 0
+
+
+def test_stats_count_hits_misses_and_evictions():
+    results = cache.ResultCache(100, name="test")
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return _value(60)
+
+    results.get_or_compute("a", compute)
+    results.get_or_compute("a", compute)
+    results.get_or_compute("b", compute)
+    assert len(calls) == 2
+    assert results.stats() == dict(
+        name="test",
+        entries=1,
+        bytes=60,
+        max_bytes=100,
+        hits=1,
+        misses=2,
+        evictions=1,
+        hit_rate=1 / 3,
+    )
+
+    # the counters outlive a clear
+    results.clear()
+    stats = results.stats()
+    assert (stats["entries"], stats["bytes"], stats["hits"], stats["misses"]) == (0, 0, 1, 2)
+
+
+def test_sizeof_counts_frames_and_containers():
+    frame = pd.DataFrame(dict(a=np.zeros(100), b=np.zeros(100, dtype="float32")))
+    assert cache.sizeof(frame) >= 1200
+    assert cache.sizeof(dict(frame=frame)) > cache.sizeof(frame)
+    assert cache.sizeof([_value(10), _value(20)]) >= 30
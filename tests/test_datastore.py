@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+# local imports
+import datastore
+from conftest import write_data_dir
+
+
+def test_duplicate_gageids_keep_first_occurrence(tmp_path):
+    data_dir = write_data_dir(str(tmp_path), n_gauges=20)
+    models_file = os.path.join(data_dir, datastore.MODELS_FILE)
+    models = pd.read_csv(models_file, dtype={"GAGEID": str})
+    gageid = "12345678"
+    models.loc[0, "GAGEID"] = gageid
+    models.loc[1, "GAGEID"] = "0" + gageid
+    models.to_csv(models_file, index=False)
+    observations_file = os.path.join(data_dir, datastore.OBSERVATIONS_FILE)
+    observations = pd.DataFrame(
+        dict(
+            GAGEID=["0" + gageid] * 2 + [gageid] * 3,
+            date=["2005-01-01", "2005-02-01", "2006-01-01", "2006-02-01", "2006-03-01"],
+            Q_mon=[1.0, 2.0, 3.0, 4.0, 5.0],
+        )
+    )
+    observations.to_csv(observations_file, index=False)
+
+    store = datastore.GaugeDataStore.load(data_dir)
+    # both ids normalize to the same key, the first row of each table is used
+    assert store.gauge_row("0" + gageid) == 0
+    months, q = store.observation_series(gageid)
+    np.testing.assert_array_equal(q, [1.0, 2.0])
+
+
+def _assert_same_datasets(store, expected):
+    np.testing.assert_array_equal(store.twsa_comids, expected.twsa_comids)
+    np.testing.assert_array_equal(store.twsa_values, expected.twsa_values)
+    np.testing.assert_array_equal(store.obs_gageids, expected.obs_gageids)
+    np.testing.assert_array_equal(store.obs_offsets, expected.obs_offsets)
+    np.testing.assert_array_equal(store.obs_dates, expected.obs_dates)
+    np.testing.assert_array_equal(store.obs_months, expected.obs_months)
+    np.testing.assert_array_equal(store.obs_q, expected.obs_q)
+    np.testing.assert_array_equal(store.axis.columns, expected.axis.columns)
+
+
+def test_binary_layout_matches_csv(tmp_path):
+    data_dir = write_data_dir(str(tmp_path), n_gauges=40)
+    from_csv = datastore.GaugeDataStore.from_csv(data_dir)
+    assert not datastore.binary_is_current(data_dir)
+
+    datastore.convert_to_binary(data_dir)
+    assert datastore.binary_is_current(data_dir)
+    loaded = datastore.GaugeDataStore.load(data_dir)
+    assert loaded.binary
+    assert isinstance(loaded.twsa_values, np.memmap)
+    assert isinstance(loaded.obs_q, np.memmap)
+    _assert_same_datasets(loaded, from_csv)
+    for gageid in from_csv.observation_index:
+        for a, b in zip(loaded.observation_series(gageid), from_csv.observation_series(gageid)):
+            np.testing.assert_array_equal(a, b)
+
+
+def test_stale_binary_layout_is_not_used_until_rebuilt(tmp_path):
+    data_dir = write_data_dir(str(tmp_path), n_gauges=40)
+    datastore.convert_to_binary(data_dir)
+
+    # the csv file is rewritten after the conversion
+    twsa_file = os.path.join(data_dir, datastore.TWSA_FILE)
+    twsa = pd.read_csv(twsa_file)
+    twsa.iloc[:, 1:] += 1.0
+    twsa.to_csv(twsa_file, index=False)
+    values_file = os.path.join(data_dir, datastore.BINARY_DIR, datastore.TWSA_VALUES_FILE)
+    written = os.path.getmtime(twsa_file)
+    os.utime(values_file, (written - 10, written - 10))
+
+    assert not datastore.binary_is_current(data_dir)
+    loaded = datastore.GaugeDataStore.load(data_dir)
+    assert not loaded.binary
+    np.testing.assert_allclose(loaded.twsa_values, twsa.iloc[:, 1:].values, rtol=1e-6)
+
+    datastore.convert_to_binary(data_dir)
+    assert datastore.binary_is_current(data_dir)
+    rebuilt = datastore.GaugeDataStore.load(data_dir)
+    assert rebuilt.binary
+    _assert_same_datasets(rebuilt, loaded)
+
+
+@pytest.mark.parametrize(
+    "gageid, expected",
+    [
+        ("01646500", "1646500"),
+        ("1646500", "1646500"),
+        (1646500, "1646500"),
+        (1646500.0, "1646500"),
+        ("1646500.0", "1646500"),
+        (" 01646500\t", "1646500"),
+        ("  ADHI_1038 ", "ADHI_1038"),
+        ("ADHI_0038", "ADHI_0038"),
+        ("0", "0"),
+        ("1646500.5", "1646500.5"),
+    ],
+)
+def test_normalize_gageid(gageid, expected):
+    assert datastore.normalize_gageid(gageid) == expected
+
+
+def test_gageid_prefix_search():
+    index = datastore.GageIdIndex(
+        ["1646500", "1646502", "164", "2000", "ADHI_1038", "ADHI_2", "adhi_3", "GRDC_1"]
+    )
+    assert len(index) == 8
+    assert index.search("1646") == ["1646500", "1646502"]
+    # leading zeros and surrounding whitespace are ignored
+    assert index.search("001646") == ["1646500", "1646502"]
+    assert index.search(" 164 ") == ["164", "1646500", "1646502"]
+    # prefixed ids, case-insensitive
+    assert index.search("adhi") == ["ADHI_1038", "ADHI_2", "adhi_3"]
+    assert index.search("ADHI_1") == ["ADHI_1038"]
+    assert index.search("adhi", limit=2) == ["ADHI_1038", "ADHI_2"]
+    assert index.search("3") == []
+
+
+def test_store_resolves_any_gageid_spelling(store):
+    gageid = next(g for g in store.gauge_index if g.isdigit())
+    row = store.gauge_row(gageid)
+    assert store.gauge_row("00" + gageid) == row
+    assert store.gauge_row(f" {gageid} ") == row
+    assert store.gauge_row(float(gageid)) == row
+    with pytest.raises(KeyError):
+        store.gauge_row("not-a-gauge")
+    assert gageid in store.gageid_index.search(gageid[:3], limit=len(store.gageid_index))
+
+
+def test_duplicate_observations_keep_the_first_in_the_file(tmp_path):
+    data_dir = write_data_dir(str(tmp_path), n_gauges=20)
+    models_file = os.path.join(data_dir, datastore.MODELS_FILE)
+    models = pd.read_csv(models_file, dtype={"GAGEID": str})
+    gageid = "1234567"
+    models.loc[0, "GAGEID"] = gageid
+    models.loc[1, "GAGEID"] = "0" + gageid
+    models.to_csv(models_file, index=False)
+    # the file order differs from the sorted order of the raw ids
+    observations = pd.DataFrame(
+        dict(
+            GAGEID=[gageid] * 3 + ["0" + gageid] * 2 + [gageid],
+            date=[
+                "2006-01-01", "2006-03-01", "2006-02-01", "2005-01-01", "2005-02-01", "2006-04-01"
+            ],
+            Q_mon=[3.0, 5.0, 4.0, 1.0, 2.0, 6.0],
+        )
+    )
+    observations.to_csv(os.path.join(data_dir, datastore.OBSERVATIONS_FILE), index=False)
+
+    store = datastore.GaugeDataStore.from_csv(data_dir)
+    assert store.gauge_row("0" + gageid) == 0
+    assert list(store.obs_gageids) == [gageid]
+    for spelling in (gageid, "0" + gageid):
+        months, q = store.observation_series(spelling)
+        np.testing.assert_array_equal(q, [3.0, 4.0, 5.0, 6.0])
+        expected = np.arange("2006-01", "2006-05", dtype="datetime64[M]")
+        np.testing.assert_array_equal(months, datastore.to_month_index(expected))
+
+    datastore.convert_to_binary(data_dir)
+    binary = datastore.GaugeDataStore.load(data_dir)
+    assert binary.binary
+    np.testing.assert_array_equal(binary.observation_series(gageid)[1], [3.0, 4.0, 5.0, 6.0])
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+# local imports
+import datastore
+import datawatch
+import mapview
+import precompute
+import skill
+import utils
+import warmup
+from conftest import write_data_dir
+
+
+# months of TWSA appended to the data directory by the tests
+N_APPENDED = 6
+
+
+@pytest.fixture
+def appended(tmp_path, store):
+    """
+    Serves a data directory whose last TWSA months are missing and returns
+    a function appending them, with observations of the appended months
+    for a gauge that had none. The session store is served again
+    afterwards.
+    """
+    data_dir = write_data_dir(str(tmp_path), n_gauges=40)
+    twsa_path = os.path.join(data_dir, datastore.TWSA_FILE)
+    twsa = pd.read_csv(twsa_path)
+    twsa.iloc[:, :-N_APPENDED].to_csv(twsa_path, index=False)
+    loaded = datastore.GaugeDataStore.load(data_dir)
+    datastore.set_store(loaded)
+    gageid = next(
+        g for g, row in loaded.gauge_index.items()
+        if loaded.gauge_twsa_rows[row] >= 0 and not len(loaded.observation_series(g)[0])
+    )
+
+    def append() -> pd.DataFrame:
+        twsa.to_csv(twsa_path, index=False)
+        added = pd.DataFrame(
+            dict(
+                GAGEID=gageid,
+                date=loaded.dates["datetime"].values[-N_APPENDED:].astype("datetime64[D]"),
+                Q_mon=np.arange(1, N_APPENDED + 1, dtype="float64"),
+            )
+        )
+        added.to_csv(
+            os.path.join(data_dir, datastore.OBSERVATIONS_FILE),
+            mode="a",
+            header=False,
+            index=False,
+        )
+        return added
+
+    yield loaded, append
+    datastore.set_store(store)
+    utils.clear_caches()
+
+
+def test_refresh_serves_appended_months(appended):
+    loaded, append = appended
+    assert loaded.refresh() is loaded
+    added = append()
+
+    refreshed = loaded.refresh()
+    assert refreshed.version > loaded.version
+    assert refreshed.fingerprint != loaded.fingerprint
+    assert len(refreshed.axis) == len(loaded.axis) + N_APPENDED
+    np.testing.assert_array_equal(
+        refreshed.twsa_values[:, : len(loaded.axis)], loaded.twsa_values
+    )
+    months, q = refreshed.observation_series(added["GAGEID"].iloc[0])
+    np.testing.assert_array_equal(months, datastore.to_month_index(added["date"].values))
+    np.testing.assert_array_equal(q, added["Q_mon"].values)
+    assert refreshed.refresh() is refreshed
+
+
+def test_explicit_cutoff_hides_appended_months(appended):
+    loaded, append = appended
+    cutoff = str(loaded.axis.datetimes[-1])
+    capped = datastore.GaugeDataStore.load(loaded.data_dir, cutoff)
+    append()
+    assert len(capped.refresh().axis) == len(capped.axis)
+
+
+def test_reload_swaps_the_store_and_empties_derived_caches(appended, monkeypatch):
+    loaded, append = appended
+    loaded_caches = []
+    monkeypatch.setattr(warmup, "load_caches", lambda: loaded_caches.append(True))
+    assert datawatch.reload() == set()
+
+    gageid = loaded.obs_gageids[0]
+    utils.handle_click(gageid, "NuSVR", "XGB", "RF", store=loaded)
+    assert utils.click_cache.stats()["entries"] > 0
+    added = append()
+
+    assert datawatch.reload() == {"twsa", "observations"}
+    refreshed = datastore.get_store()
+    assert refreshed is not loaded and refreshed.version > loaded.version
+    assert len(refreshed.axis) == len(loaded.axis) + N_APPENDED
+    assert utils.click_cache.stats()["entries"] == 0
+    assert loaded_caches == [True]
+
+    # clicks compute from the refreshed store
+    discharges = utils.handle_click(added["GAGEID"].iloc[0], "NuSVR", "XGB", "RF")["discharges"]
+    assert len(discharges) == len(refreshed.axis)
+    np.testing.assert_array_equal(
+        discharges["Q_mon"].values[-N_APPENDED:], added["Q_mon"].values
+    )
+
+
+@pytest.mark.parametrize(
+    "changed, cleared",
+    [
+        ({"twsa"}, ["partitions", "frames", "skill", "clicks"]),
+        ({"dates", "models"}, ["partitions", "frames", "skill", "clicks"]),
+        ({"observations"}, ["skill", "clicks"]),
+    ],
+)
+def test_invalidate_clears_derived_caches_in_order(monkeypatch, changed, cleared):
+    calls = []
+    monkeypatch.setattr(precompute, "clear_partitions", lambda: calls.append("partitions"))
+    monkeypatch.setattr(mapview, "clear_frames", lambda: calls.append("frames"))
+    monkeypatch.setattr(skill, "clear_scores", lambda: calls.append("skill"))
+    monkeypatch.setattr(utils, "clear_caches", lambda: calls.append("clicks"))
+    datawatch.invalidate(changed)
+    assert calls == cleared
+    assert set(calls) == set().union(*(datawatch.DERIVED_FROM[d] for d in changed))
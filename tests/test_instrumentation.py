@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import logging
+import flask
+import pytest
+
+# local imports
+import cache
+import instrumentation
+from instrumentation import span
+
+
+def metric_lines(text: str, name: str):
+    return [line for line in text.splitlines() if line.startswith(name)]
+
+
+def test_spans_feed_the_histograms():
+    for seconds in (0.0001, 0.003, 0.003, 20.0):
+        instrumentation.observe("test.observed", seconds)
+    text = instrumentation.render_metrics()
+    buckets = {
+        line.split('le="')[1].split('"')[0]: int(line.split()[-1])
+        for line in metric_lines(text, 'qtwsa_span_duration_seconds_bucket{span="test.observed"')
+    }
+    # cumulative counts per upper bound
+    assert buckets["0.0005"] == 1
+    assert buckets["0.0025"] == 1
+    assert buckets["0.005"] == 3
+    assert buckets["10.0"] == 3
+    assert buckets["+Inf"] == 4
+    assert 'qtwsa_span_duration_seconds_count{span="test.observed"} 4' in text
+    (total,) = metric_lines(text, 'qtwsa_span_duration_seconds_sum{span="test.observed"}')
+    assert float(total.split()[-1]) == pytest.approx(20.0061)
+
+
+def test_span_times_blocks_and_functions():
+    @span("test.decorated")
+    def decorated():
+        return 1
+
+    assert decorated() == 1
+    with pytest.raises(ValueError):
+        with span("test.block", gageid="123"):
+            raise ValueError()
+    text = instrumentation.render_metrics()
+    assert 'qtwsa_span_duration_seconds_count{span="test.decorated"} 1' in text
+    assert 'qtwsa_span_duration_seconds_count{span="test.block"} 1' in text
+
+
+def test_span_log_records(caplog, monkeypatch):
+    monkeypatch.setattr(instrumentation, "SPAN_LOG_LEVEL", logging.INFO)
+    with caplog.at_level(logging.INFO, logger=instrumentation.logger.name):
+        with pytest.raises(KeyError):
+            with span("test.logged", gageid="123"):
+                raise KeyError()
+    (record,) = [r for r in caplog.records if getattr(r, "span", None) == "test.logged"]
+    assert record.fields == dict(gageid="123")
+    assert record.duration_ms >= 0
+    assert "gageid=123 error=KeyError" in record.getMessage()
+
+
+def test_cache_stats_are_exported():
+    results = cache.ResultCache(100, name="test-metrics")
+    instrumentation.register_cache(results)
+    results.get_or_compute("a", lambda: b"x" * 10)
+    results.get_or_compute("a", lambda: b"x" * 10)
+    text = instrumentation.render_metrics()
+    assert 'qtwsa_cache_hits_total{cache="test-metrics"} 1' in text
+    assert 'qtwsa_cache_misses_total{cache="test-metrics"} 1' in text
+    assert 'qtwsa_cache_evictions_total{cache="test-metrics"} 0' in text
+    assert 'qtwsa_cache_entries{cache="test-metrics"} 1' in text
+    assert 'qtwsa_cache_hit_rate{cache="test-metrics"} 0.5' in text
+    assert "# TYPE qtwsa_cache_hits_total counter" in text
+    assert metric_lines(text, "qtwsa_process_resident_memory_bytes ")
+
+
+def test_metrics_route():
+    server = flask.Flask(__name__)
+    instrumentation.register_metrics_route(server)
+    response = server.test_client().get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    assert "# TYPE qtwsa_span_duration_seconds histogram" in response.get_data(as_text=True)
+
+
+@pytest.mark.parametrize(
+    "name, level", [("info", logging.INFO), (" WARNING ", logging.WARNING), ("loud", logging.DEBUG)]
+)
+def test_span_log_level(name, level):
+    assert instrumentation._span_log_level(name) == level
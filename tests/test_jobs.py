@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import subprocess
+import sys
+import threading
+import time
+from dash import html
+import pytest
+
+# local imports
+import jobs
+import utils
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return jobs.JobQueue(str(tmp_path / "jobs.sqlite"), workers=2)
+
+
+def blocking(release: threading.Event):
+    # a job that reports progress until `release` is set
+    def work(context: jobs.JobContext):
+        while not release.wait(0.01):
+            context.progress(0, 1, "working")
+        return "done"
+    return work
+
+
+def test_results_are_stored_as_json(queue):
+    queue.submit("a", lambda context: ("key", html.Div(["text"]), None, 1.5))
+    assert queue.wait("a", 5)["status"] == jobs.DONE
+    key, div, empty, number = queue.result("a")
+    assert key == "key" and empty is None and number == 1.5
+    assert div["type"] == "Div" and div["props"]["children"] == ["text"]
+
+
+def test_job_is_cancelled_when_every_waiter_released(queue):
+    release = threading.Event()
+    queue.submit("a", blocking(release))
+    queue.submit("a", blocking(release))
+    queue.release("a")
+    assert queue.wait("a", 0.1)["status"] in jobs.UNFINISHED
+    queue.release("a")
+    assert queue.wait("a", 5)["status"] == jobs.CANCELLED
+    release.set()
+
+
+def test_rejoin_is_not_counted_again(queue):
+    release = threading.Event()
+    queue.submit("a", blocking(release))
+    queue.submit("a", blocking(release), rejoin=True)
+    queue.release("a")
+    assert queue.wait("a", 5)["status"] == jobs.CANCELLED
+    release.set()
+
+
+def test_jobs_of_exited_processes_fail(tmp_path, queue):
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    con = queue._connection()
+    con.execute(
+        "INSERT INTO jobs VALUES ('orphan', ?, 0, 0, '', 1, 0, NULL, ?, ?)",
+        (jobs.RUNNING, time.time(), exited.pid),
+    )
+    restarted = jobs.JobQueue(queue.path, workers=1)
+    status = restarted.status("orphan")
+    assert status["status"] == jobs.FAILED
+    assert status["message"] == "The job was interrupted by a restart"
+
+    # an orphan found by submit is started again rather than shared
+    con.execute(
+        "UPDATE jobs SET status = ?, updated = ? WHERE key = 'orphan'",
+        (jobs.RUNNING, time.time()),
+    )
+    restarted.submit("orphan", lambda context: "again")
+    assert restarted.wait("orphan", 5)["status"] == jobs.DONE
+    assert restarted.result("orphan") == "again"
+
+
+def test_running_job_is_cancelled_when_released(queue):
+    release = threading.Event()
+    finished = []
+
+    def work(context):
+        blocking(release)(context)
+        finished.append(True)
+
+    queue.submit("a", work)
+    deadline = time.monotonic() + 5
+    while queue.status("a")["status"] != jobs.RUNNING and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert queue.status("a")["status"] == jobs.RUNNING
+    queue.release("a")
+    assert queue.wait("a", 5)["status"] == jobs.CANCELLED
+    assert finished == []
+    with pytest.raises(KeyError):
+        queue.result("a")
+    release.set()
+
+
+def test_running_click_is_cancelled_between_stages(queue, store):
+    gageid = next(g for g, row in store.gauge_index.items() if store.gauge_twsa_rows[row] >= 0)
+    models = ("NuSVR", "SVC", "NN")
+    reached, resume = threading.Event(), threading.Event()
+    stages = []
+
+    def work(context):
+        def progress(done, total):
+            stages.append(done)
+            if done == 1:
+                # the series is loaded, the model stage is next
+                reached.set()
+                resume.wait(5)
+            context.progress(done, total)
+
+        return utils.handle_click(gageid, *models, store=store, progress=progress)["message"]
+
+    utils.clear_caches()
+    queue.submit("click", work)
+    assert reached.wait(5)
+    queue.release("click")
+    resume.set()
+    assert queue.wait("click", 5)["status"] == jobs.CANCELLED
+    assert stages == [0, 1]
+    # nothing of the cancelled click was cached
+    key = (store.version, gageid, models[0], models[2], False)
+    assert utils.click_cache.get(key) is None
+
+
+def test_click_reports_every_stage(store):
+    gageid = next(g for g, row in store.gauge_index.items() if store.gauge_twsa_rows[row] >= 0)
+    utils.clear_caches()
+    calls = []
+    utils.handle_click(gageid, "GP", "XGB", "RF", store=store, progress=lambda *a: calls.append(a))
+    assert calls == [(done, utils.CLICK_STAGES) for done in range(utils.CLICK_STAGES)]
+    # a cached click has no stage left to run after the series lookup
+    calls.clear()
+    utils.handle_click(gageid, "GP", "XGB", "RF", store=store, progress=lambda *a: calls.append(a))
+    assert calls == [(0, utils.CLICK_STAGES)]
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+import base64
+import numpy as np
+import pandas as pd
+import pytest
+
+# local imports
+import engine
+import mapview
+
+
+def map_points(n: int = 5000, seed: int = 0) -> mapview.MapPoints:
+    rng = np.random.default_rng(seed)
+    return mapview.MapPoints(
+        pd.DataFrame(
+            dict(
+                GAGEID=[f"{i:08d}" for i in range(n)],
+                Lat=rng.uniform(-60, 70, n),
+                Lon=rng.uniform(-180, 180, n),
+                area=rng.uniform(10, 1000, n),
+            )
+        )
+    )
+
+
+def inside_bounds(points, west, south, east, north):
+    # brute force, `west` and `east` within [-180, 180]
+    in_lat = (points.lat >= south) & (points.lat <= north)
+    if west <= east:
+        in_lon = (points.lon >= west) & (points.lon <= east)
+    else:
+        in_lon = (points.lon >= west) | (points.lon <= east)
+    return set(np.flatnonzero(in_lat & in_lon))
+
+
+@pytest.mark.parametrize("max_points", [10, 100, 2000])
+@pytest.mark.parametrize("zoom", [1.0, 4.0, 8.0])
+def test_decimate_caps_markers_and_counts_every_gauge(max_points, zoom):
+    points = map_points()
+    bounds = (-100, -20, 40, 50)
+    markers, counts = mapview.decimate(points, bounds, zoom, max_points)
+    expected = inside_bounds(points, *bounds)
+    assert len(markers) <= max_points
+    assert set(markers) <= expected
+    assert counts.sum() == len(expected)
+
+
+def test_decimate_keeps_every_gauge_when_zoomed_in():
+    points = map_points(200)
+    markers, counts = mapview.decimate(points, (-180, -90, 180, 90), 20)
+    assert sorted(markers) == list(range(len(points)))
+    assert (counts == 1).all()
+
+
+@pytest.mark.parametrize(
+    "bounds", [(170, -30, 190, 30), (170, -30, -170, 30), (-190, -30, -170, 30)]
+)
+def test_decimate_crosses_the_antimeridian(bounds):
+    points = map_points()
+    markers, counts = mapview.decimate(points, bounds, 12)
+    expected = inside_bounds(points, 170, -30, -170, 30)
+    assert expected
+    assert set(markers) == expected
+    assert counts.sum() == len(expected)
+
+
+def test_decimate_whole_world():
+    points = map_points()
+    markers, counts = mapview.decimate(points, (-200, -90, 200, 90), 1, 50)
+    assert len(markers) <= 50
+    assert counts.sum() == len(points)
+
+
+def test_box_selection():
+    points = map_points()
+    # plotly reports the corners as [west, north], [east, south]
+    selected = mapview.selected_gauges(points, {"range": {"mapbox": [[-10, 40], [30, -5]]}})
+    expected = inside_bounds(points, -10, -5, 30, 40)
+    assert set(selected) == {points.gageid[i] for i in expected}
+
+
+def test_lasso_selection():
+    points = map_points()
+    triangle = [[0, 0], [60, 0], [0, 60]]
+    selected = mapview.selected_gauges(points, {"lassoPoints": {"mapbox": triangle}})
+    inside = (points.lon > 0) & (points.lat > 0) & (points.lon + points.lat < 60)
+    assert set(selected) == set(points.gageid[inside])
+
+    square = [[-10, -5], [30, -5], [30, 40], [-10, 40]]
+    lasso = mapview.selected_gauges(points, {"lassoPoints": {"mapbox": square}})
+    box = mapview.selected_gauges(points, {"range": {"mapbox": [[-10, 40], [30, -5]]}})
+    assert set(lasso) == set(box)
+
+
+def test_selection_of_clicked_markers():
+    points = map_points(10)
+    clicked = [dict(hovertext=g) for g in ("3", "1", "3")]
+    assert mapview.selected_gauges(points, dict(points=clicked)) == ["3", "1"]
+    assert mapview.selected_gauges(points, None) == []
+
+
+@pytest.fixture(scope="module")
+def store_points(store):
+    # every gauge of the model table, then one the model table lacks
+    gageids = list(store.gauge_index) + ["99999999"]
+    n = len(gageids)
+    return mapview.MapPoints(
+        pd.DataFrame(dict(GAGEID=gageids, Lat=np.zeros(n), Lon=np.zeros(n), area=np.ones(n)))
+    )
+
+
+@pytest.mark.parametrize("model_temporal_feasibility", engine.TEMPORAL_MODELS)
+def test_discharge_frames_encode_the_feasible_discharge(
+    store, store_points, model_temporal_feasibility
+):
+    model_regionalisation = engine.regionalisation_models(store)[0]
+    levels = mapview.DischargeLevels(store_points, model_regionalisation, store)
+    frames = mapview.DischargeFrames(levels, model_temporal_feasibility, store)
+    n_months = len(store.axis)
+    assert frames.levels.dtype == np.uint8
+    assert frames.levels.shape == (n_months, len(store_points))
+    assert len(frames) == n_months
+
+    q = engine.compute_discharge_matrix(
+        model_regionalisation, store.axis.columns, model_temporal_feasibility, store=store
+    )[levels.rows[:-1]].T
+    feasible = np.isfinite(q) & (q > 0)
+    assert feasible.any() and not feasible.all()
+    # feasible months are on the log scale, every other month is grey
+    scaled = (np.log10(q[feasible]) - frames.low) / (frames.high - frames.low)
+    expected = np.rint(np.clip(scaled, 0, 1) * (mapview.FRAME_LEVELS - 1))
+    np.testing.assert_array_equal(frames.levels[:, :-1][feasible], expected)
+    assert (frames.levels[:, :-1][feasible] < mapview.FRAME_GREY).all()
+    assert (frames.levels[:, :-1][~feasible] == mapview.FRAME_GREY).all()
+    # the gauge without parameters is grey in every month
+    assert (frames.levels[:, -1] == mapview.FRAME_GREY).all()
+
+
+def test_discharge_frame_payload(store, store_points):
+    levels = mapview.DischargeLevels(store_points, engine.regionalisation_models(store)[0], store)
+    frames = mapview.DischargeFrames(levels, engine.TEMPORAL_MODELS[0], store)
+    last = len(frames) - 1
+    frame = frames.frame(last + 10)
+    assert frame["label"] == mapview.month_labels(store)[last]
+    colors = np.frombuffer(base64.b64decode(frame["colors"]), dtype="uint8")
+    np.testing.assert_array_equal(colors, frames.levels[last])
+    assert frames.frame(-1)["label"] == frames.labels[0]
+    tickvals, ticktext = frames.ticks()
+    assert len(tickvals) == len(ticktext) > 0
+    assert all(0 <= v <= mapview.FRAME_LEVELS - 1 for v in tickvals)
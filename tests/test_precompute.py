@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+# local imports
+import datastore
+import precompute
+import utils
+from conftest import write_data_dir
+
+
+@pytest.fixture(scope="module")
+def partitions(store):
+    combinations = precompute.precompute(store.data_dir, workers=2)
+    precompute.clear_partitions()
+    yield combinations
+    precompute.clear_partitions()
+
+
+def test_every_combination_is_precomputed(store, partitions):
+    assert sorted(partitions) == sorted(precompute.combinations(store))
+    assert precompute.precompute(store.data_dir, workers=2) == []
+
+
+def test_partitions_match_live_results(store, partitions):
+    for combination in partitions:
+        partition = precompute.get_partition(*combination, store)
+        assert partition is not None
+        assert len(partition.index) > 0
+        for gageid in partition.index:
+            precomputed = utils.load_click(gageid, *combination, store=store)
+            live = utils.compute_click(gageid, *combination, store=store)
+            pd.testing.assert_frame_equal(precomputed["discharges"], live["discharges"])
+            assert precomputed["spatial_discrepency"] == live["spatial_discrepency"]
+            assert precomputed["temporal_discrepency"] == live["temporal_discrepency"]
+
+
+def test_gauge_series_reads_partitions(store, partitions):
+    partition = precompute.get_partition(*partitions[0], store)
+    model_regionalisation = partitions[0][0]
+    for gageid in list(partition.index)[:20]:
+        series = utils.GaugeSeries(gageid, store)
+        np.testing.assert_array_equal(
+            series.q_pred(model_regionalisation), partition.discharge(gageid)
+        )
+
+
+def test_partitions_of_other_datasets_are_not_served(tmp_path):
+    data_dir = write_data_dir(str(tmp_path), n_gauges=40)
+    precompute.precompute(data_dir, workers=1)
+    loaded = datastore.GaugeDataStore.load(data_dir)
+    combination = precompute.combinations(loaded)[0]
+    assert precompute.get_partition(*combination, loaded) is not None
+
+    # another cutoff serves other months
+    earlier = datastore.GaugeDataStore.load(data_dir, "2010-01-01")
+    assert precompute.get_partition(*combination, earlier) is None
+
+    # the partition was computed from the files `loaded` was read from
+    models = os.path.join(data_dir, datastore.MODELS_FILE)
+    pd.read_csv(models, dtype={"GAGEID": str}).iloc[:-1].to_csv(models, index=False)
+    refreshed = loaded.refresh()
+    assert refreshed is not loaded
+    assert precompute.get_partition(*combination, refreshed) is None
+    assert precompute.get_partition(*combination, loaded) is not None
+
+
+def test_partition_of_the_previous_store_is_not_kept(tmp_path, store):
+    data_dir = write_data_dir(str(tmp_path), n_gauges=40)
+    precompute.precompute(data_dir, workers=1)
+    loaded = datastore.GaugeDataStore.load(data_dir)
+    combination = precompute.combinations(loaded)[0]
+    try:
+        datastore.set_store(loaded)
+        assert precompute.get_partition(*combination) is not None
+
+        # swapped in before the caches are cleared, see datawatch.reload
+        models = os.path.join(data_dir, datastore.MODELS_FILE)
+        pd.read_csv(models, dtype={"GAGEID": str}).iloc[:-1].to_csv(models, index=False)
+        datastore.set_store(loaded.refresh())
+        assert precompute.get_partition(*combination) is None
+    finally:
+        datastore.set_store(store)
+        precompute.clear_partitions()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pandas as pd
+
+# local imports
+import sessionstore
+
+
+def _frame() -> pd.DataFrame:
+    return pd.DataFrame(
+        dict(
+            datetime=pd.to_datetime(["2004-01-31", "2004-02-29", "2004-03-31"]),
+            twsa=np.array([1.5, np.nan, -2.25]),
+            Q_pred=np.array([0.1, 0.2, np.nan], dtype="float32"),
+            month=np.array([1, 2, 3], dtype="int64"),
+            year=np.array([2004, 2004, 2004], dtype="int16"),
+            GAGEID=["01646500", None, "ADHI_1038"],
+        ),
+        index=[10, 20, 30],
+    )
+
+
+def test_frame_survives_encoding():
+    frame = _frame()
+    decoded = sessionstore.decode_frame(sessionstore.encode_frame(frame))
+    pd.testing.assert_frame_equal(decoded, frame)
+    assert decoded["GAGEID"][20] is None
+
+
+def test_string_index_survives_encoding():
+    frame = _frame().set_index("GAGEID")
+    frame.index = frame.index.fillna("missing")
+    decoded = sessionstore.decode_frame(sessionstore.encode_frame(frame))
+    pd.testing.assert_frame_equal(decoded, frame, check_index_type=False)
+    assert list(decoded.index) == ["01646500", "missing", "ADHI_1038"]
+
+
+def test_empty_frame_survives_encoding():
+    decoded = sessionstore.decode_frame(sessionstore.encode_frame(pd.DataFrame()))
+    assert decoded.empty
+
+
+def test_sqlite_store_round_trip(tmp_path):
+    store = sessionstore.SqliteResultStore(str(tmp_path / "results.sqlite"))
+    frame = _frame()
+    store.put("key", frame)
+    pd.testing.assert_frame_equal(store.get("key"), frame)
+    assert store.get("other") is None
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# local imports
+import engine
+import skill
+import utils
+
+
+def reference_scores(discharges: pd.DataFrame) -> dict:
+    """
+    Scores of one gauge from its click frame, written with pandas.
+    """
+    both = discharges[["Q_pred", "Q_mon"]].dropna()
+    sim, obs = both["Q_pred"], both["Q_mon"]
+    scores = dict(months=len(both), KGE=np.nan, NSE=np.nan, pbias=np.nan)
+    if len(both) < skill.MIN_MONTHS:
+        return scores
+    r = sim.corr(obs)
+    variability = sim.std() / obs.std()
+    bias = sim.mean() / obs.mean()
+    scores["KGE"] = 1 - np.sqrt((r - 1) ** 2 + (variability - 1) ** 2 + (bias - 1) ** 2)
+    scores["NSE"] = 1 - ((sim - obs) ** 2).sum() / ((obs - obs.mean()) ** 2).sum()
+    scores["pbias"] = 100 * (sim.sum() - obs.sum()) / obs.sum()
+    return scores
+
+
+@pytest.mark.parametrize("model_regionalisation", ["GP", "NuSVR"])
+def test_scores_match_per_gauge_reference(store, model_regionalisation):
+    frame = skill.compute_scores(model_regionalisation, store, chunk_size=7)
+    assert len(frame) > 0
+    assert frame["KGE"].notna().any()
+    for row in frame.itertuples(index=False):
+        res = utils.compute_click(row.GAGEID, model_regionalisation, "XGB", "RF", store=store)
+        expected = reference_scores(res["discharges"])
+        assert row.months == expected["months"]
+        for name in ("KGE", "NSE", "pbias"):
+            np.testing.assert_allclose(getattr(row, name), expected[name], rtol=1e-9)
+
+
+def test_unscored_gauges_are_missing(store):
+    frame = skill.compute_scores("GP", store)
+    scored = set(frame["GAGEID"])
+    for gageid in store.obs_gageids:
+        row = store.gauge_index.get(gageid)
+        has_twsa = row is not None and store.gauge_twsa_rows[row] >= 0
+        assert (gageid in scored) == has_twsa
+
+
+def test_short_records_are_not_scored():
+    sim = np.arange(1.0, 21.0)[None, :]
+    obs = sim * 1.1
+    obs[0, 5:] = np.nan
+    result = skill.scores(sim, obs, min_months=6)
+    assert result["months"][0] == 5
+    assert np.isnan(result["KGE"][0])
+
+
+def test_cached_scores_equal_computed(store):
+    model = engine.regionalisation_models(store)[0]
+    computed = skill.compute_scores(model, store)
+    pd.testing.assert_frame_equal(skill.load_or_compute(model, store=store), computed)
+    # read back from the disk cache of the data directory
+    pd.testing.assert_frame_equal(skill.load_or_compute(model, store=store), computed)
+
+    scores = skill.SkillScores(computed)
+    assert (np.diff(scores.leaderboard["KGE"].values) <= 0).all()
+    first = scores.leaderboard.iloc[0]
+    assert scores.get(first["GAGEID"])["KGE"] == first["KGE"]
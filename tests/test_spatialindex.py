@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pytest
+
+# local imports
+from spatialindex import GridIndex, haversine_km
+
+
+def gauge_locations(seed: int = 0):
+    """
+    Random gauges spread over the globe, plus clusters around both poles
+    and on both sides of the antimeridian.
+    """
+    rng = np.random.default_rng(seed)
+    antimeridian = rng.uniform(177, 183, 400)
+    lat = [
+        np.degrees(np.arcsin(rng.uniform(-1, 1, 3000))),
+        rng.uniform(87, 90, 200),
+        rng.uniform(-90, -87, 200),
+        rng.uniform(-60, 70, 400),
+    ]
+    lon = [
+        rng.uniform(-180, 180, 3000),
+        rng.uniform(-180, 180, 200),
+        rng.uniform(-180, 180, 200),
+        np.where(antimeridian > 180, antimeridian - 360, antimeridian),
+    ]
+    return np.concatenate(lat), np.concatenate(lon)
+
+
+QUERIES = [
+    (0.0, 0.0),
+    (38.9, -77.0),
+    (89.9, 10.0),
+    (90.0, 0.0),
+    (-89.5, -120.0),
+    (-90.0, 0.0),
+    (12.0, 179.9),
+    (-30.0, -179.9),
+    (0.0, 180.0),
+    (0.0, -180.0),
+    (88.0, 179.5),
+    (-88.0, -179.5),
+]
+
+
+@pytest.fixture(scope="module")
+def locations():
+    return gauge_locations()
+
+
+@pytest.fixture(scope="module", params=[1.0, 5.0])
+def index(request, locations):
+    return GridIndex(*locations, cell_degrees=request.param)
+
+
+@pytest.mark.parametrize("lat, lon", QUERIES)
+@pytest.mark.parametrize("radius_km", [5.0, 80.0, 400.0, 2500.0, 25000.0])
+def test_within_matches_brute_force(index, locations, lat, lon, radius_km):
+    distances = haversine_km(lat, lon, *locations)
+    expected = np.flatnonzero(distances <= radius_km)
+
+    positions, found = index.within(lat, lon, radius_km)
+    assert sorted(positions) == sorted(expected)
+    assert np.all(np.diff(found) >= 0)
+    np.testing.assert_allclose(found, distances[positions], rtol=1e-9, atol=1e-6)
+
+
+@pytest.mark.parametrize("lat, lon", QUERIES)
+@pytest.mark.parametrize("k", [1, 7, 60])
+def test_nearest_matches_brute_force(index, locations, lat, lon, k):
+    distances = haversine_km(lat, lon, *locations)
+    expected = np.sort(distances)[:k]
+
+    positions, found = index.nearest(lat, lon, k)
+    assert len(positions) == k
+    assert len(set(positions)) == k
+    np.testing.assert_allclose(found, expected, rtol=1e-9, atol=1e-6)
+    np.testing.assert_allclose(found, distances[positions], rtol=1e-9, atol=1e-6)
+
+
+def test_nearest_of_more_than_all_gauges(locations):
+    lat, lon = locations[0][:10], locations[1][:10]
+    positions, _ = GridIndex(lat, lon).nearest(45.0, 90.0, k=50)
+    assert sorted(positions) == list(range(10))
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+import collections
+import logging
+import threading
+import numpy as np
+import pandas as pd
+import pytest
+
+# local imports
+import engine
+import instrumentation
+import precompute
+import utils
+
+
+@pytest.mark.parametrize("ensemble", [False, True])
+def test_handle_click_matches_compute_click(store, ensemble):
+    for gageid, row in list(store.gauge_index.items())[:50]:
+        if store.gauge_twsa_rows[row] < 0:
+            continue
+        for combination in precompute.combinations(store)[:4]:
+            res = utils.handle_click(gageid, *combination, ensemble=ensemble, store=store)
+            live = utils.compute_click(gageid, *combination, store=store)
+            assert res["message"] is None
+            discharges = res["discharges"]
+            if ensemble:
+                assert (discharges["Q_ens_min"] <= discharges["Q_ens_max"]).all()
+                discharges = discharges.drop(columns=["Q_ens_min", "Q_ens_max"])
+            pd.testing.assert_frame_equal(discharges, live["discharges"])
+            assert res["spatial_discrepency"] == live["spatial_discrepency"]
+            assert res["temporal_discrepency"] == live["temporal_discrepency"]
+
+
+@pytest.mark.parametrize("click", [utils.handle_click, utils.compute_click, utils.load_click])
+def test_unknown_gauge_is_reported(store, click):
+    res = click("not-a-gauge", "GP", "XGB", "RF", store=store)
+    assert res["discharges"].empty
+    assert res["message"] == "Gauge not-a-gauge was not found"
+
+
+def test_gauge_without_twsa_is_reported(store):
+    gageid = next(g for g, row in store.gauge_index.items() if store.gauge_twsa_rows[row] < 0)
+    res = utils.handle_click(gageid, "GP", "XGB", "RF", store=store)
+    assert res["discharges"].empty
+    assert res["message"] == f"There is no TWSA data for gauge {gageid}"
+
+
+def test_selection_skips_missing_gauges(store):
+    gageids = ["not-a-gauge"] + list(store.gauge_index)[:3]
+    res = utils.handle_selection(gageids, "GP", "XGB", "RF")
+    assert res["selected"] == 4
+    assert res["computed"] == 3
+    assert list(res["discharges"]["GAGEID"].unique()) == gageids[1:]
+
+
+def table_frame() -> pd.DataFrame:
+    return pd.DataFrame(
+        dict(
+            GAGEID=["9", "10", "10", "200", "9", "ADHI_1038"],
+            datetime=pd.to_datetime(
+                ["2005-01-31", "2005-02-28", "2005-12-31", "2006-01-31", "2006-02-28", "2010-06-30"]
+            ),
+            Q_pred=[9.0, 10.0, 2.5, 200.0, np.nan, 0.5],
+            Q_pred_selmonths=[9.0, np.nan, 2.5, 200.0, np.nan, 0.5],
+            Q_mon=[1.0, 1.0, 3.0, np.nan, 2.0, 1.0],
+        )
+    )
+
+
+@pytest.mark.parametrize(
+    "filter_query, expected",
+    [
+        # numbers compare as numbers, not as text
+        ("{Q_pred} > 9", [1, 3]),
+        ("{Q_pred} ge 10", [1, 3]),
+        ("{Q_pred} < 9.5", [0, 2, 5]),
+        ("{Q_pred} = 2.5", [2]),
+        ("{Q_pred} != 2.5", [0, 1, 3, 4, 5]),
+        # text compares as text
+        ("{GAGEID} > 9", [5]),
+        ("{GAGEID} = 10", [1, 2]),
+        ("{GAGEID} < 2", [1, 2]),
+        # dates compare as dates
+        ("{datetime} >= 2006-01-01", [3, 4, 5]),
+        ("{datetime} < 2005-12-31", [0, 1]),
+        ("{datetime} = 2005-12-31", [2]),
+        # matching the text shown in the table
+        ("{GAGEID} contains 0", [1, 2, 3, 5]),
+        ("{GAGEID} scontains ADHI", [5]),
+        ("{datetime} datestartswith 2005", [0, 1, 2]),
+        ("{datetime} datestartswith 2006-02", [4]),
+        ("{Q_pred} contains .5", [2, 5]),
+        # parts are combined, unknown columns and values are ignored
+        ("{Q_pred} > 1 && {datetime} datestartswith 2005", [0, 1, 2]),
+        ("{nope} > 1 && {Q_pred} > 100", [3]),
+        ("{Q_pred} > abc", [0, 1, 2, 3, 4, 5]),
+        ("{datetime} > not-a-date", [0, 1, 2, 3, 4, 5]),
+        ("", [0, 1, 2, 3, 4, 5]),
+        (None, [0, 1, 2, 3, 4, 5]),
+    ],
+)
+def test_filter_frame(filter_query, expected):
+    assert list(utils.filter_frame(table_frame(), filter_query).index) == expected
+
+
+def test_sort_frame_by_several_columns():
+    df = table_frame()
+    sort_by = [
+        dict(column_id="Q_mon", direction="asc"),
+        dict(column_id="datetime", direction="desc"),
+    ]
+    # missing values last, whatever the direction
+    assert list(utils.sort_frame(df, sort_by).index) == [5, 1, 0, 4, 2, 3]
+    sort_by = [dict(column_id="Q_pred", direction="desc")]
+    assert list(utils.sort_frame(df, sort_by).index) == [3, 1, 0, 2, 5, 4]
+    assert utils.sort_frame(df, []) is df
+
+
+def test_table_page_bounds():
+    df = pd.concat([table_frame()] * 10, ignore_index=True)
+    data, page_count = utils.table_page(df, 0, page_size=24)
+    assert page_count == 3
+    assert len(data) == 24
+    assert data[0]["datetime"] == "2005-01-31"
+    # multi-gauge frames show the GAGEID column
+    assert list(data[0]) == ["GAGEID"] + list(utils.TABLE_COLUMNS)[:4]
+    assert len(utils.table_page(df, 2, page_size=24)[0]) == 12
+    assert utils.table_page(df, 3, page_size=24)[0] == []
+
+    data, page_count = utils.table_page(df, 0, page_size=24, filter_query="{Q_pred} > 1000")
+    assert (data, page_count) == ([], 1)
+
+    data, page_count = utils.table_page(
+        df, 1, page_size=5, sort_by=[dict(column_id="Q_pred", direction="desc")],
+        filter_query="{Q_pred} >= 10",
+    )
+    assert page_count == 4
+    assert [row["Q_pred"] for row in data] == [200.0] * 5
+
+
+def test_selection_computes_the_first_gauges(store):
+    gageids = list(store.gauge_index)[:10]
+    # a repeated gauge, in another spelling, counts once
+    res = utils.handle_selection(["0" + gageids[0]] + gageids, "GP", "XGB", "RF", max_gauges=4)
+    assert res["selected"] == 10
+    assert res["computed"] == 4
+    assert list(res["discharges"]["GAGEID"].unique()) == gageids[:4]
+    assert list(res["spatial_discrepency"]) == gageids[:4]
+    assert list(res["temporal_discrepency"]) == gageids[:4]
+    for gageid in gageids[:4]:
+        click = utils.handle_click(gageid, "GP", "XGB", "RF", store=store)
+        rows = res["discharges"][res["discharges"]["GAGEID"] == gageid]
+        pd.testing.assert_frame_equal(rows.reset_index(drop=True), click["discharges"])
+        assert res["spatial_discrepency"][gageid] == click["spatial_discrepency"]
+
+
+def test_selection_reports_progress(store):
+    calls = []
+    gageids = list(store.gauge_index)[:6]
+    utils.handle_selection(
+        gageids, "GP", "XGB", "RF", max_gauges=5, progress=lambda *a: calls.append(a)
+    )
+    assert calls == [(done, 5) for done in range(1, 6)]
+
+
+def test_selection_is_stopped_by_progress(store):
+    class Stop(Exception):
+        pass
+
+    def progress(done, todo):
+        raise Stop()
+
+    with pytest.raises(Stop):
+        utils.handle_selection(list(store.gauge_index)[:20], "GP", "XGB", "RF", progress=progress)
+
+
+def test_empty_selection(store):
+    res = utils.handle_selection([], "GP", "XGB", "RF")
+    assert res["discharges"].empty
+    assert (res["selected"], res["computed"]) == (0, 0)
+
+
+def test_click_stages_are_timed(store, caplog, monkeypatch):
+    monkeypatch.setattr(instrumentation, "SPAN_LOG_LEVEL", logging.INFO)
+    gageid = next(g for g, row in store.gauge_index.items() if store.gauge_twsa_rows[row] >= 0)
+    with caplog.at_level(logging.INFO, logger=instrumentation.logger.name):
+        utils.compute_click(gageid, "GP", "XGB", "RF", store=store)
+    # spans of this thread, the selection threads may still be running
+    spans = collections.Counter(
+        r.span for r in caplog.records
+        if r.thread == threading.get_ident() and hasattr(r, "span")
+    )
+    # one lookup, load and merge, a discharge and a month mask
+    assert {name: count for name, count in spans.items() if name.startswith("click.")} == {
+        "click.uncached": 1,
+        "click.gauge_lookup": 1,
+        "click.data_load": 1,
+        "click.model": 2,
+        "click.merge": 1,
+    }
+
+
+def test_ensemble_band_spans_the_regionalisation_models(store):
+    models = engine.regionalisation_models(store)
+    assert len(models) > 1
+    gageids = [g for g, row in store.gauge_index.items() if store.gauge_twsa_rows[row] >= 0]
+    for gageid in gageids[:20]:
+        q_pred = np.array([
+            utils.compute_click(gageid, model, "XGB", "RF", store=store)["discharges"]["Q_pred"]
+            for model in models
+        ])
+        for model in models:
+            discharges = utils.handle_click(
+                gageid, model, "XGB", "RF", ensemble=True, store=store
+            )["discharges"]
+            np.testing.assert_allclose(discharges["Q_ens_min"], q_pred.min(axis=0), rtol=1e-12)
+            np.testing.assert_allclose(discharges["Q_ens_max"], q_pred.max(axis=0), rtol=1e-12)
+            assert (discharges["Q_ens_min"] <= discharges["Q_pred"]).all()
+            assert (discharges["Q_pred"] <= discharges["Q_ens_max"]).all()
+
+
+def test_ensemble_band_is_drawn(store):
+    gageid = next(g for g, row in store.gauge_index.items() if store.gauge_twsa_rows[row] >= 0)
+    res = utils.handle_click(gageid, "GP", "XGB", "RF", ensemble=True, store=store)
+    discharges = res["discharges"]
+    figure = utils.as_timeseries_scatterplot(discharges).figure
+    upper, lower = figure.data[:2]
+    np.testing.assert_array_equal(upper.y, discharges["Q_ens_max"])
+    np.testing.assert_array_equal(lower.y, discharges["Q_ens_min"])
+    assert lower.fill == "tonexty"
+
+    figure = utils.as_timeseries_scatterplot(
+        utils.handle_click(gageid, "GP", "XGB", "RF", store=store)["discharges"]
+    ).figure
+    assert "Q model range" not in [trace.name for trace in figure.data]
@@ -2,21 +2,25 @@
 
 
 import math
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
 import pandas as pd
-import dataretrieval.nwis as nwis
-import pytz
-from datetime import datetime
-import geopandas as gpd
-import time
-from dash import dcc, html
-import dash_bootstrap_components as dbc
+from dash import dash_table, dcc, html
 import plotly.graph_objects as go
 
 # typing imports
-from typing import Dict, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 # local imports
+import cache
+import datastore
+import engine
+import instrumentation
+import precompute
+from instrumentation import span
 from logging_config import get_logger
 
 
@@ -27,6 +31,29 @@ logger = get_logger(__name__)
 
 CFS_TO_CMS = 0.028316846592
 
+MAP_CACHE_SUFFIX = ".mapcache.npz"
+
+# byte budget of the handle_click result cache
+CLICK_CACHE_BYTES = int(os.environ.get("QTWSA_CLICK_CACHE_BYTES", 64 * 2**20))
+
+click_cache = cache.ResultCache(CLICK_CACHE_BYTES, name="click")
+instrumentation.register_cache(click_cache)
+
+# byte budget of the GaugeSeries cache, see handle_click
+SERIES_CACHE_BYTES = int(os.environ.get("QTWSA_SERIES_CACHE_BYTES", 32 * 2**20))
+
+series_cache = cache.ResultCache(SERIES_CACHE_BYTES, name="gauge_series")
+instrumentation.register_cache(series_cache)
+
+# map box/lasso selections: gauges computed per selection, and the
+# threads shared by all selections of the process
+SELECTION_MAX_GAUGES = int(os.environ.get("QTWSA_SELECTION_MAX_GAUGES", 50))
+SELECTION_WORKERS = int(os.environ.get("QTWSA_SELECTION_WORKERS", 4))
+
+_selection_pool = ThreadPoolExecutor(
+    max_workers=SELECTION_WORKERS, thread_name_prefix="selection"
+)
+
 
 def get_map_data(
     USGS_data_file: str = "static/data/usgs-gauges/gauges_global.shp"
@@ -34,6 +61,10 @@ def get_map_data(
     """
     Collects the data required for the map component
 
+    The attribute table of the shapefile is cached next to it as a
+    compressed numpy archive, which is rebuilt only when the shapefile
+    changes. Reading the cache avoids importing geopandas at startup.
+
     Parameters
     ----------
     gauges_data_file: str
@@ -43,14 +74,44 @@ def get_map_data(
     pandas.DataFrame
             A DataFrame containing the data for the map component
     """
+    cache_file = os.path.splitext(USGS_data_file)[0] + MAP_CACHE_SUFFIX
+    signature = _shapefile_signature(USGS_data_file)
+
+    if os.path.exists(cache_file):
+        with np.load(cache_file, allow_pickle=False) as cached:
+            if np.array_equal(cached["__signature__"], signature):
+                return pd.DataFrame(
+                    {k: cached[k] for k in cached.files if k != "__signature__"}
+                )
+        logger.info(f"{USGS_data_file} changed, rebuilding {cache_file}")
+
+    # geopandas is only needed to (re)build the cache
+    import geopandas as gpd
 
     # load data
     usgs_df = pd.DataFrame(gpd.GeoDataFrame.from_file(USGS_data_file))
     usgs_df.drop(columns="geometry", inplace=True)
-    print("usgs_df.shape:   .................   ", usgs_df.columns)
+
+    columns = {k: usgs_df[k].values for k in usgs_df.columns}
+    columns["GAGEID"] = usgs_df["GAGEID"].astype("str").values.astype("U")
+    try:
+        with open(cache_file + ".tmp", "wb") as f:
+            np.savez(f, __signature__=signature, **columns)
+        os.replace(cache_file + ".tmp", cache_file)
+    except OSError as e:
+        logger.warning(f"Could not write map data cache {cache_file}: {e}")
     return usgs_df
 
 
+def _shapefile_signature(USGS_data_file: str) -> np.ndarray:
+    # size and mtime of the geometry and attribute files
+    base = os.path.splitext(USGS_data_file)[0]
+    stats = [os.stat(base + ext) for ext in (".shp", ".dbf")]
+    return np.array(
+        [v for st in stats for v in (st.st_size, st.st_mtime_ns)], dtype="int64"
+    )
+
+
 def get_dependency_color(value):
     try:
         # Convert the dependency value to a float.
@@ -67,14 +128,34 @@ def get_dependency_color(value):
     else:
         return "darkgreen"
     
+# stages of handle_click reported to its progress callback
+CLICK_STAGES = 4
+
+
+def _no_progress(done: int, total: int):
+    pass
+
+
+@span("click.handle_click")
 def handle_click(
     gageid: str,
     model_regionalisation,
     model_spatial_feasibility,
     model_temporal_feasibility,
+    ensemble: bool = False,
+    store: Optional[datastore.GaugeDataStore] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
 ) :
     """
-    Computes QTWSA measurments.
+    Computes QTWSA measurments of a gauge.
+
+    The model-independent series of the gauge are kept in `series_cache`
+    (see GaugeSeries) and the discharges in `click_cache`, keyed by gauge,
+    regionalisation and temporal model. A change of model therefore only
+    redoes the alpha/beta transform (regionalisation) or the month mask
+    (temporal), and a change of spatial model is a lookup. Both caches
+    are also keyed by the version of the datasets, so results computed
+    from replaced datasets are never served.
 
     Parameters
     ----------
@@ -83,7 +164,15 @@ def handle_click(
     model_regionalisation: Model Selected,
     model_spatial_feasibility: Model Selected,
     model_temporal_feasibility: Model Selected 
-        
+    ensemble: bool
+        Add the range of the discharges of every regionalisation model,
+        as Q_ens_min and Q_ens_max columns.
+    store: GaugeDataStore
+        Datasets, datastore.get_store() if None.
+    progress: Callable[[int, int], None]
+        Called with the number of stages done and CLICK_STAGES before each
+        stage that is not cached (data load, model, feasibility, merge),
+        an exception it raises stops the click.
 
     Returns
     -------
@@ -94,104 +183,453 @@ def handle_click(
             The group identifier (KGE groups, see paper)
         temporal_discrepency: Value 
             Number of months
+        message: str
+            Why there are no discharges, e.g. an unknown gauge, or None
     """
-    dates = pd.read_csv("static/data/datesnumberfrombase_TWSA1.csv",usecols=range(2))
-    allmodels_tasks = pd.read_csv(r"static/data/global_gauges_models.csv")
-    TWSA_data = pd.read_csv(r"static/data/TWSA_gauges_global.csv")
-    
-    
-    print(f"Callback triggered with models: {model_regionalisation}, {model_spatial_feasibility}, {model_temporal_feasibility}")
-    
+    gageid = datastore.normalize_gageid(gageid)
+    store = store or datastore.get_store()
+    message = _missing_gauge(gageid, store)
+    if message is not None:
+        return _no_discharges(message)
+    report = progress or _no_progress
+    report(0, CLICK_STAGES)
+    series = get_gauge_series(gageid, store)
 
-    comid = allmodels_tasks[allmodels_tasks['GAGEID'].astype('str')==str(gageid)].COMID.values[0]
-    
-    if not comid:
-        comid = allmodels_tasks[allmodels_tasks['GAGEID'].astype('int')==gageid].COMID.values[0]
-
-    twsa_values = TWSA_data[TWSA_data['COMID'].astype('int')==int(comid)].iloc[0]
-    del TWSA_data
-    twsa = dates.copy().iloc[:(twsa_values.shape[0]-1)]
-    twsa['twsa'] = twsa_values.values.flatten()[1:]
-    twsa['datetime'] = pd.to_datetime(twsa['datetime']).dt.normalize()
-    twsa = twsa[twsa['datetime']<=datetime(2022,5,23)]
-    twsa = twsa[['datetime','twsa']]
-    
-    twsa['datetime'] = pd.to_datetime(twsa['datetime']).dt.normalize()
-    twsa['month'] = twsa['datetime'].dt.month
-    twsa['year'] = twsa['datetime'].dt.year
+    def compute() -> pd.DataFrame:
+        # each stage is kept by the series, discharges() reuses them
+        report(1, CLICK_STAGES)
+        if ensemble:
+            series.ensemble()
+        series.q_pred(model_regionalisation)
+        report(2, CLICK_STAGES)
+        series.feasible(model_temporal_feasibility)
+        report(3, CLICK_STAGES)
+        return series.discharges(model_regionalisation, model_temporal_feasibility, ensemble)
 
-    
-    if model_regionalisation == 'NuSVR':
-        var_alpha, var_beta = 'NUSVR_alpha', 'NUSVR_beta'
-    elif  model_regionalisation == 'GP':
-        var_alpha, var_beta = 'GP_alpha', 'GP_beta'
-    elif model_regionalisation == 'GB':
-        var_alpha, var_beta = 'GB_alpha', 'GB_beta'
-    
-    if model_spatial_feasibility == 'SVC':
-        var_sd = 'svc_sd'
-    elif  model_spatial_feasibility == 'XGB':
-        var_sd = 'xgb_sd'
-    elif model_spatial_feasibility == 'RF':
-        var_sd = 'rf_td'
-        
-    if model_temporal_feasibility == 'NN':
-        var_td = 'NN_td'
-    elif  model_temporal_feasibility == 'XT':
-        var_td = 'XT_td'
-    elif model_temporal_feasibility == 'RF':
-        var_td = 'RF_td'
-
-    alp_pred = allmodels_tasks[allmodels_tasks['COMID'] == comid][var_alpha].values[0]
-    bet_pred = allmodels_tasks[allmodels_tasks['COMID'] == comid][var_beta].values[0]
-    
-    twsa['Q_pred'] = alp_pred * np.exp(twsa[['twsa']] * bet_pred)
-    
-    
-    #Get in-situ observations
-    observations = pd.read_csv(r"static/data/global_gauges_q.csv")
-    df_q = observations[observations['GAGEID'].astype('str')==str(gageid)]
-    del observations
-    df_q['date'] = pd.to_datetime(df_q['date'])
-    df_q['month'] = df_q['date'].dt.month
-    df_q['year'] = df_q['date'].dt.year
-    
-    twsa = pd.merge(twsa,df_q,how='left', on = ['year','month'])
-    # twsa = twsa.dropna(axis=0)
-    
-    # Q at confident months 
-    columns_months = [j+'_'+model_temporal_feasibility for j in ['Jan', 'Feb', 'March', 'April', 'May', 'June', 'July', 'Aug','Sept', 'Oct', 'Nov', 'Dec']]
-    predicted_months = allmodels_tasks[allmodels_tasks['COMID'] == comid][columns_months].values[0]
-    predicted_months = [enum+1 for enum,num in enumerate(predicted_months) if num==1]
-    # twsa = twsa.dropna(axis=0)
-    
-    twsa['Q_pred_selmonths'] = twsa['Q_pred']
-    twsa.loc[~twsa["month"].isin(predicted_months),['Q_pred_selmonths']] = np.nan
-    print(twsa.head(5), twsa.shape)
-    # twsa.to_csv('saved_middle.csv')
-    if twsa.shape[0] == 0:
-        logger.info("No data for TWSA")
-        return dict(discharges=pd.DataFrame(), 
-                    spatial_discrepency = None,
-                    temporal_discrepency = None)
-    
-    value_sd = allmodels_tasks[allmodels_tasks['COMID'] == comid][var_sd].values[0]
-    twsa['GAGEID'] = gageid
-    
-    
-    return dict(discharges = twsa,
-                spatial_discrepency = value_sd,
-                temporal_discrepency = allmodels_tasks[allmodels_tasks['COMID'] == comid][var_td].values[0])
-    # print(twsa.shape,"TWSA_Shape_Gauge_________________________________s")
-    # Troubleshooting--------------------
-    # test_df = pd.DataFrame({
-    #     'datetime': pd.date_range(start='2014-01-01', periods=100, freq='D'),
-    #     'Q_pred': range(100)
-    # })
+    discharges = click_cache.get_or_compute(
+        (store.version, gageid, model_regionalisation, model_temporal_feasibility, ensemble),
+        compute,
+    )
+    # callers modify the frame in place, keep the cached copy intact
+    return _click_result(
+        series, discharges.copy(), model_spatial_feasibility, model_temporal_feasibility
+    )
+
+
+class GaugeSeries:
+    """
+    Model-independent data of a gauge: TWSA and observed discharge on the
+    served months, and the gauge's row of model parameters. The discharge
+    of each regionalisation model and the month mask of each temporal
+    model are derived on demand and kept. ensemble() computes every
+    regionalisation model at once.
+
+    The stages are timed by the spans click.gauge_lookup, click.data_load
+    (TWSA and observations on the served months), click.model (a
+    discharge or month mask) and click.merge (the discharge frame).
+
+    Parameters
+    ----------
+    gageid: str
+        Gauge identifier
+    store: GaugeDataStore
+        Datasets, datastore.get_store() if None.
+    precomputed: bool
+        Read the discharges from the precomputed results of `store` when
+        there are any, see precompute, rather than computing them.
+    """
+
+    def __init__(
+        self,
+        gageid: str,
+        store: Optional[datastore.GaugeDataStore] = None,
+        precomputed: bool = True,
+    ):
+        store = store or datastore.get_store()
+        axis = store.axis
+        columns = axis.columns
+        self.gageid = gageid
+        self.store = store
+        self.precomputed = precomputed
+        with span("click.gauge_lookup", gageid=gageid):
+            self.row = store.gauge_row(gageid)
+            self.parameters = store.parameters
+            # the gauge's parameters as a plain dict of scalars, read once
+            self.gauge = store.parameters.row(self.row)
+        with span("click.data_load", gageid=gageid):
+            self.twsa = np.asarray(store.twsa(self.gauge["COMID"])[columns], dtype='float64')
+            self.month = axis.month_of_year[columns].astype('int64')
+            # columns of the discharge frame, the discharges are filled in
+            # by discharges(): copying it is much cheaper than building a frame
+            self.template = pd.DataFrame(
+                dict(
+                    datetime=axis.datetimes[columns],
+                    twsa=self.twsa,
+                    month=self.month,
+                    year=axis.year[columns].astype('int64'),
+                    Q_pred=np.nan,
+                    Q_mon=axis.align(*store.observation_series(gageid)),
+                    Q_pred_selmonths=np.nan,
+                    GAGEID=gageid,
+                )
+            )
+        self._q_pred = {}  # type: Dict[str, np.ndarray]
+        self._feasible = {}  # type: Dict[str, np.ndarray]
+        self._ensemble = None  # type: Optional[Tuple[List[str], np.ndarray]]
+        self._ensemble_template = None  # type: Optional[pd.DataFrame]
+
+    def __sizeof__(self) -> int:
+        arrays = [self.twsa, self.month]
+        arrays += list(self._q_pred.values()) + list(self._feasible.values())
+        if self._ensemble is not None:
+            arrays.append(self._ensemble[1])
+        return (
+            sum(a.nbytes for a in arrays)
+            + cache.sizeof(self.template)
+            + cache.sizeof(self._ensemble_template)
+            + sys.getsizeof(self.gauge)
+        )
+
+    def q_pred(self, model_regionalisation: str) -> np.ndarray:
+        """
+        Discharge of a regionalisation model on the served months.
+        """
+        q_pred = self._q_pred.get(model_regionalisation)
+        if q_pred is None:
+            with span("click.model", model=model_regionalisation):
+                if self.precomputed:
+                    q_pred = precompute.get_discharge(
+                        self.gageid, model_regionalisation, self.store
+                    )
+                if q_pred is None:
+                    var_alpha, var_beta = engine.REGIONALISATION_COLUMNS[model_regionalisation]
+                    q_pred = self.gauge[var_alpha] * np.exp(self.twsa * self.gauge[var_beta])
+            self._q_pred[model_regionalisation] = q_pred
+        return q_pred
+
+    def ensemble(self) -> Tuple[List[str], np.ndarray]:
+        """
+        Discharge of every available regionalisation model, computed in one
+        vectorized pass.
+
+        Returns
+        -------
+        Tuple[List[str], numpy.ndarray]
+            Models and their discharges, (models x served months)
+        """
+        if self._ensemble is None:
+            models = engine.regionalisation_models()
+            with span("click.model", model="ensemble"):
+                parameters = np.array(
+                    [[self.gauge[c] for c in engine.REGIONALISATION_COLUMNS[m]] for m in models],
+                    dtype='float64',
+                ).reshape(len(models), 2)
+                alpha, beta = parameters[:, :1], parameters[:, 1:]
+                q_pred = alpha * np.exp(self.twsa[None, :] * beta)
+            for model, row in zip(models, q_pred):
+                self._q_pred.setdefault(model, row)
+            self._ensemble = models, q_pred
+        return self._ensemble
+
+    def feasible(self, model_temporal_feasibility: str) -> np.ndarray:
+        """
+        Served months that are feasible according to a temporal model.
+        """
+        feasible = self._feasible.get(model_temporal_feasibility)
+        if feasible is None:
+            with span("click.model", model=model_temporal_feasibility):
+                predicted_months = self.parameters.predicted_months(
+                    model_temporal_feasibility, self.row
+                )
+                feasible = predicted_months[self.month - 1]
+            self._feasible[model_temporal_feasibility] = feasible
+        return feasible
 
-    # return dict(usgs_discharge=range(100)).to_json()
+    def spatial(self, model_spatial_feasibility: str):
+        """
+        Spatial feasibility group of a spatial model.
+        """
+        return self.gauge[engine.SPATIAL_COLUMNS[model_spatial_feasibility]]
 
+    def temporal(self, model_temporal_feasibility: str):
+        """
+        Number of feasible months of a temporal model.
+        """
+        return self.gauge[engine.TEMPORAL_COLUMNS[model_temporal_feasibility]]
+
+    def discharges(
+        self,
+        model_regionalisation: str,
+        model_temporal_feasibility: str,
+        ensemble: bool = False,
+    ) -> pd.DataFrame:
+        """
+        Discharge frame of the served months: datetime, twsa, month, year,
+        Q_pred, Q_mon, Q_pred_selmonths (Q_pred in the feasible months) and
+        GAGEID, with the Q_ens_min and Q_ens_max columns if `ensemble`.
+        """
+        # the model stage is timed on its own, before the merge
+        q_ensemble = self.ensemble()[1] if ensemble else None
+        q_pred = self.q_pred(model_regionalisation)
+        feasible = self.feasible(model_temporal_feasibility)
+        with span("click.merge"):
+            if ensemble:
+                if self._ensemble_template is None:
+                    self._ensemble_template = self.template.assign(
+                        Q_ens_min=np.nan, Q_ens_max=np.nan
+                    )
+                twsa = self._ensemble_template.copy()
+            else:
+                twsa = self.template.copy()
+            twsa['Q_pred'] = q_pred
+            twsa['Q_pred_selmonths'] = np.where(feasible, q_pred, np.nan)
+            if ensemble:
+                twsa['Q_ens_min'] = q_ensemble.min(axis=0)
+                twsa['Q_ens_max'] = q_ensemble.max(axis=0)
+        return twsa
+
+
+def get_gauge_series(
+    gageid: str, store: Optional[datastore.GaugeDataStore] = None
+) -> GaugeSeries:
+    """
+    Returns the GaugeSeries of a normalized gauge id from `series_cache`.
+    """
+    store = store or datastore.get_store()
+    with span("click.gauge_series", gageid=gageid):
+        return series_cache.get_or_compute(
+            (store.version, gageid), lambda: GaugeSeries(gageid, store)
+        )
+
+
+def clear_caches():
+    """
+    Empties `series_cache` and `click_cache`, e.g. after the datasets
+    were reloaded.
+    """
+    series_cache.clear()
+    click_cache.clear()
+
+
+def compute_click(
+    gageid: str,
+    model_regionalisation,
+    model_spatial_feasibility,
+    model_temporal_feasibility,
+    store: Optional[datastore.GaugeDataStore] = None,
+) :
+    """
+    Computes QTWSA measurments without going through `click_cache` or the
+    precomputed results, e.g. to check them. See handle_click for the
+    parameters and the returned dictionary.
+    """
+    return _uncached_click(
+        gageid,
+        model_regionalisation,
+        model_spatial_feasibility,
+        model_temporal_feasibility,
+        store,
+        precomputed=False,
+    )
+
+
+def load_click(
+    gageid: str,
+    model_regionalisation,
+    model_spatial_feasibility,
+    model_temporal_feasibility,
+    store: Optional[datastore.GaugeDataStore] = None,
+) :
+    """
+    Returns the QTWSA measurments of a gauge from the precomputed results
+    of the model combination (see precompute), or computes them when
+    there are none. Not cached, for bulk use such as exports; see
+    handle_click for the parameters and the returned dictionary.
+    """
+    return _uncached_click(
+        gageid,
+        model_regionalisation,
+        model_spatial_feasibility,
+        model_temporal_feasibility,
+        store,
+        precomputed=True,
+    )
+
+
+def _uncached_click(
+    gageid: str,
+    model_regionalisation: str,
+    model_spatial_feasibility: str,
+    model_temporal_feasibility: str,
+    store: Optional[datastore.GaugeDataStore],
+    precomputed: bool,
+) -> Dict[str, Any]:
+    gageid = datastore.normalize_gageid(gageid)
+    store = store or datastore.get_store()
+    message = _missing_gauge(gageid, store)
+    if message is not None:
+        return _no_discharges(message)
+    with span("click.uncached", gageid=gageid):
+        series = GaugeSeries(gageid, store, precomputed=precomputed)
+        discharges = series.discharges(model_regionalisation, model_temporal_feasibility)
+    return _click_result(series, discharges, model_spatial_feasibility, model_temporal_feasibility)
+
+
+def _missing_gauge(gageid: str, store: datastore.GaugeDataStore) -> Optional[str]:
+    # why the discharges of a normalized gauge id cannot be computed, None
+    # if they can
+    row = store.gauge_index.get(gageid)
+    if row is None:
+        return f"Gauge {gageid} was not found"
+    if store.gauge_twsa_rows[row] < 0:
+        return f"There is no TWSA data for gauge {gageid}"
+    return None
+
+
+def _no_discharges(message: str) -> Dict[str, Any]:
+    return dict(discharges=pd.DataFrame(),
+                spatial_discrepency=None,
+                temporal_discrepency=None,
+                message=message)
+
+
+def _click_result(
+    series: "GaugeSeries",
+    discharges: pd.DataFrame,
+    model_spatial_feasibility: str,
+    model_temporal_feasibility: str,
+) -> Dict[str, Any]:
+    if discharges.empty:
+        logger.info(f"No TWSA months for gauge {series.gageid}")
+        return _no_discharges(f"There is no TWSA data for gauge {series.gageid}")
+    return dict(discharges=discharges,
+                spatial_discrepency=series.spatial(model_spatial_feasibility),
+                temporal_discrepency=series.temporal(model_temporal_feasibility),
+                message=None)
+
+
+@span("click.handle_selection")
+def handle_selection(
+    gageids: List[str],
+    model_regionalisation,
+    model_spatial_feasibility,
+    model_temporal_feasibility,
+    max_gauges: int = SELECTION_MAX_GAUGES,
+    progress: Optional[Callable[[int, int], None]] = None,
+    store: Optional[datastore.GaugeDataStore] = None,
+) -> Dict[str, Any]:
+    """
+    Computes QTWSA measurments for several gauges of a map selection.
+
+    Gauges are computed concurrently on the shared selection threads
+    through handle_click, so they are cached like single clicks. Only the
+    first `max_gauges` gauges of the selection are computed.
+
+    Parameters
+    ----------
+    gageids: List[str]
+        USGS streamflow gage identifiers, in selection order
+    model_regionalisation: Model Selected,
+    model_spatial_feasibility: Model Selected,
+    model_temporal_feasibility: Model Selected
+    max_gauges: int
+        Maximum number of gauges computed.
+    progress: Callable[[int, int], None]
+        Called with the number of gauges done and to do after each gauge,
+        an exception it raises stops the selection.
+    store: GaugeDataStore
+        Datasets of every gauge of the selection, datastore.get_store()
+        if None.
+
+    Returns
+    -------
+    Dict[str, Any]
+        discharges: pandas.DataFrame
+            Discharges of all gauges, with a GAGEID column
+        spatial_discrepency: Dict[str, Value]
+            Spatial group of each computed gauge
+        temporal_discrepency: Dict[str, Value]
+            Number of confident months of each computed gauge
+        selected: int
+            Number of gauges in the selection
+        computed: int
+            Number of gauges with results
+    """
+    selected = list(dict.fromkeys(datastore.normalize_gageid(g) for g in gageids))
+    todo = selected[:max_gauges]
+    # every gauge of the selection is computed from the same datasets
+    store = store or datastore.get_store()
+    futures = {
+        _selection_pool.submit(
+            handle_click,
+            gageid,
+            model_regionalisation,
+            model_spatial_feasibility,
+            model_temporal_feasibility,
+            store=store,
+        ): gageid
+        for gageid in todo
+    }
+
+    results = {}
+    try:
+        for done, future in enumerate(as_completed(futures), 1):
+            gageid = futures[future]
+            res = future.result()
+            if res["message"] is not None:
+                logger.info(f"{res['message']}, skipped")
+            else:
+                results[gageid] = res
+            if progress is not None:
+                progress(done, len(todo))
+    except BaseException:
+        # e.g. cancelled through `progress`, drop the gauges not started
+        for future in futures:
+            future.cancel()
+        raise
 
+    # keep the selection order whatever the completion order
+    computed = [g for g in todo if g in results]
+    discharges = (
+        pd.concat([results[g]["discharges"] for g in computed], ignore_index=True)
+        if computed else pd.DataFrame()
+    )
+    return dict(
+        discharges=discharges,
+        spatial_discrepency={g: results[g]["spatial_discrepency"] for g in computed},
+        temporal_discrepency={g: results[g]["temporal_discrepency"] for g in computed},
+        selected=len(selected),
+        computed=len(computed),
+    )
+
+
+def selection_summary(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Summarises a multi-gauge discharge frame, one row per gauge.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        Discharges of several gauges, with a GAGEID column.
+
+    Returns
+    -------
+    pandas.DataFrame
+        GAGEID, mean simulated, certain-month and observed Q, and number
+        of observed months
+    """
+    grouped = df.groupby("GAGEID", sort=False)
+    return pd.DataFrame(
+        {
+            "Q simulated": grouped["Q_pred"].mean(),
+            "Q certain months": grouped["Q_pred_selmonths"].mean(),
+            "Q observed": grouped["Q_mon"].mean(),
+            "observed months": grouped["Q_mon"].count(),
+        }
+    ).reset_index()
+
+
+@span("figure.timeseries")
 def as_timeseries_scatterplot(
     df: Union[pd.DataFrame, None]
 ) -> Union[html.P, dcc.Graph]:
@@ -210,16 +648,41 @@ def as_timeseries_scatterplot(
         Dash scatter graph object containing the input data.
 
     """
-    start_time = time.time()
     if df is None:
         return html.P(
             "Please select a location on the map to populate this graph",
             style={"margin-top": "1rem"},
         )
     gageid = df['GAGEID'].unique()
+    if len(gageid) > 1:
+        return as_selection_plot(df)
     # build figure
     fig = go.Figure()
 
+    if 'Q_ens_min' in df:
+        # range of the regionalisation models, drawn below the lines
+        fig.add_trace(
+            go.Scatter(
+                x=df['datetime'],
+                y=df['Q_ens_max'],
+                mode="lines",
+                line=dict(width=0),
+                hoverinfo="skip",
+                showlegend=False,
+            )
+        )
+        fig.add_trace(
+            go.Scatter(
+                x=df['datetime'],
+                y=df['Q_ens_min'],
+                mode="lines",
+                line=dict(width=0),
+                fill="tonexty",
+                fillcolor="rgba(99, 110, 250, 0.2)",
+                name="Q model range",
+            )
+        )
+
     fig.add_trace(
         go.Scatter(
             x=df['datetime'],
@@ -260,41 +723,343 @@ def as_timeseries_scatterplot(
         
     )
     
-    end_time = time.time()
-    print("Generate Graph:      ", end_time - start_time)
     return dcc.Graph(
         id="hydrograph",
         figure=fig,
     )
 
 
-def as_table(df: Union[pd.DataFrame, None]) -> Union[html.P, dbc.Table]:
+def as_selection_plot(df: pd.DataFrame) -> html.Div:
+    """
+    Overlays the hydrographs of several gauges, with the selection mean
+    and a per-gauge summary table.
+
+    WebGL traces keep the plot responsive with many gauges.
+
+    Parameters
+    ----------
+    df: pandas DataFrame
+        Discharges of several gauges, with a GAGEID column.
+
+    Returns
+    -------
+    html.Div
+        Graph and summary table
+    """
+    fig = go.Figure()
+    for gageid, gauge in df.groupby("GAGEID", sort=False):
+        fig.add_trace(
+            go.Scattergl(
+                x=gauge["datetime"],
+                y=gauge["Q_pred"],
+                mode="lines",
+                name=str(gageid),
+                line=dict(width=1),
+                opacity=0.5,
+            )
+        )
+
+    mean = df.groupby("datetime")[["Q_pred", "Q_mon"]].mean()
+    fig.add_trace(
+        go.Scattergl(
+            x=mean.index,
+            y=mean["Q_pred"],
+            mode="lines",
+            name="Mean Q simulated",
+            line=dict(width=3, color="black"),
+        )
+    )
+    if mean["Q_mon"].notnull().any():
+        fig.add_trace(
+            go.Scattergl(
+                x=mean.index,
+                y=mean["Q_mon"],
+                mode="lines",
+                name="Mean Q observed",
+                line=dict(width=3, color="black", dash="dot"),
+            )
+        )
+
+    fig.update_layout(
+        title=f" {df['GAGEID'].nunique()} gauges",
+        margin_t=35,
+        margin_l=0,
+        margin_b=0,
+        margin_r=0,
+        yaxis_title="River discharge (cm/month)",
+    )
+
+    summary = selection_summary(df).round(4)
+    return html.Div(
+        [
+            dcc.Graph(id="hydrograph", figure=fig),
+            dash_table.DataTable(
+                id="selection-summary",
+                columns=[dict(id=c, name=c) for c in summary.columns],
+                data=summary.to_dict("records"),
+                page_size=TABLE_PAGE_SIZE,
+                sort_action="native",
+                style_table={"overflowX": "auto"},
+            ),
+        ]
+    )
+
+
+TABLE_PAGE_SIZE = 24
+
+# frame column -> table column name
+TABLE_COLUMNS = {
+    "datetime": "datetime",
+    "Q_pred": "Q simulated (cm/month)",
+    "Q_pred_selmonths": "Q certain months",
+    "Q_mon": "Q observed",
+    "Q_ens_min": "Q model range min",
+    "Q_ens_max": "Q model range max",
+}
+
+FILTER_OPERATORS = {
+    "ge": "__ge__", ">=": "__ge__",
+    "le": "__le__", "<=": "__le__",
+    "lt": "__lt__", "<": "__lt__",
+    "gt": "__gt__", ">": "__gt__",
+    "ne": "__ne__", "!=": "__ne__",
+    "eq": "__eq__", "=": "__eq__",
+}
+
+FILTER_PART = re.compile(
+    r"^\{(?P<column>[^}]+)\} s?(?P<operator>contains|datestartswith|[^\s]+) (?P<value>.+)$"
+)
+
+
+def table_columns(df: pd.DataFrame) -> List[str]:
+    """
+    Frame columns shown in the table, with GAGEID for multi-gauge frames.
+    """
+    columns = [c for c in TABLE_COLUMNS if c in df]
+    if "GAGEID" in df and df["GAGEID"].nunique() > 1:
+        columns.insert(0, "GAGEID")
+    return columns
+
+
+def filter_frame(df: pd.DataFrame, filter_query: Union[str, None]) -> pd.DataFrame:
+    """
+    Applies a DataTable filter_query to a frame. Parts on unknown columns
+    or with values that do not parse are ignored.
+
+    contains and datestartswith match the text shown in the table, the
+    other operators compare dates as dates, text as text and numbers as
+    numbers.
+    """
+    for part in (filter_query or "").split(" && "):
+        match = FILTER_PART.match(part.strip())
+        if match is None:
+            continue
+        column, operator, value = match.group("column", "operator", "value")
+        if column not in df:
+            continue
+        value = value.strip().strip("\"'`")
+        series = df[column]
+        if operator in ("contains", "datestartswith"):
+            if pd.api.types.is_datetime64_any_dtype(series):
+                text = series.dt.strftime("%Y-%m-%d")
+            else:
+                text = series.astype(str)
+            df = df[text.str.contains(value, regex=False) if operator == "contains"
+                    else text.str.startswith(value)]
+            continue
+        if operator not in FILTER_OPERATORS:
+            continue
+        if pd.api.types.is_datetime64_any_dtype(series):
+            try:
+                value = pd.Timestamp(value)
+            except ValueError:
+                continue
+        elif series.dtype == object:
+            series = series.astype(str)
+        else:
+            try:
+                value = float(value)
+            except ValueError:
+                continue
+        df = df[getattr(series, FILTER_OPERATORS[operator])(value)]
+    return df
+
+
+def sort_frame(df: pd.DataFrame, sort_by: Union[List[Dict[str, str]], None]) -> pd.DataFrame:
+    """
+    Sorts a frame by a DataTable sort_by property, missing values last.
+    """
+    if not sort_by:
+        return df
+    return df.sort_values(
+        [s["column_id"] for s in sort_by],
+        ascending=[s["direction"] == "asc" for s in sort_by],
+        na_position="last",
+    )
+
+
+@span("table.page")
+def table_page(
+    df: pd.DataFrame,
+    page_current: int = 0,
+    page_size: int = TABLE_PAGE_SIZE,
+    sort_by: Union[List[Dict[str, str]], None] = None,
+    filter_query: Union[str, None] = None,
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Filters, sorts and slices a discharge frame for one table page.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        DataFrame containing Q data with the TABLE_COLUMNS columns.
+    page_current: int
+        Zero-based page number.
+    page_size: int
+        Number of rows per page.
+    sort_by: List[Dict[str, str]]
+        DataTable sort_by property.
+    filter_query: str
+        DataTable filter_query property.
+
+    Returns
+    -------
+    Tuple[List[Dict[str, Any]], int]
+        Records of the page and the number of pages
+    """
+    df = sort_frame(filter_frame(df[table_columns(df)], filter_query), sort_by)
+
+    page_count = max(math.ceil(len(df) / page_size), 1)
+    page = df.iloc[page_current * page_size:(page_current + 1) * page_size].copy()
+    page["datetime"] = page["datetime"].dt.strftime("%Y-%m-%d")
+    return page.round(4).to_dict("records"), page_count
+
+
+@span("table.build")
+def as_table(df: Union[pd.DataFrame, None]) -> Union[html.P, dash_table.DataTable]:
     """
     Converts pandas DataFrame into a table.
 
+    Only the first page is serialized; paging, sorting and filtering are
+    done server-side by callbacks.update_table_page against the stored
+    frame.
+
     Parameters
     ----------
     df: pandas.DataFrame
         DataFrame containing S bWOT and USGS data. Expecting the following
-        columns: datetime, month, year, TWSA, Q_pred
+        columns: datetime, Q_pred, Q_pred_selmonths, Q_mon
 
     Returns
     -------
-    table: dbc.Table
-        table object containing the content of the dataframe
+    table: dash_table.DataTable
+        table object containing the first page of the dataframe
 
     """
-    start_time = time.time()
     if df is None:
         return html.P(
             "Please select a location on the map to populate this table",
             style={"margin-top": "1rem"},
         )
-    df = df[['datetime','Q_pred',"Q_pred_selmonths","Q_mon"]].round(4)
-    df.columns = ['datetime','Q simulated (cm/month)',"Q certain months","Q observed"]
-    # df.reset_index(inplace=True)
-    end_time = time.time()
-    
-    print(f"Runtime for table: {end_time - start_time} seconds")
-    
-    return dbc.Table.from_dataframe(df)
+    data, page_count = table_page(df)
+
+    return dash_table.DataTable(
+        id="discharge-table",
+        columns=[
+            dict(id=k, name=TABLE_COLUMNS.get(k, k)) for k in table_columns(df)
+        ],
+        data=data,
+        page_current=0,
+        page_size=TABLE_PAGE_SIZE,
+        page_count=page_count,
+        page_action="custom",
+        sort_action="custom",
+        sort_mode="multi",
+        sort_by=[],
+        filter_action="custom",
+        filter_query="",
+        style_table={"overflowX": "auto"},
+    )
+
+
+# frame column -> leaderboard column name
+LEADERBOARD_COLUMNS = {
+    "rank": "Rank",
+    "GAGEID": "GAGEID",
+    "months": "Months",
+    "KGE": "KGE",
+    "NSE": "NSE",
+    "pbias": "Bias (%)",
+}
+
+
+@span("table.leaderboard_page")
+def leaderboard_page(
+    df: pd.DataFrame,
+    page_current: int = 0,
+    page_size: int = TABLE_PAGE_SIZE,
+    sort_by: Union[List[Dict[str, str]], None] = None,
+    filter_query: Union[str, None] = None,
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Filters, sorts and slices the skill leaderboard for one table page,
+    see table_page.
+    """
+    df = sort_frame(filter_frame(df, filter_query), sort_by)
+    page_count = max(math.ceil(len(df) / page_size), 1)
+    page = df.iloc[page_current * page_size:(page_current + 1) * page_size]
+    return page.round(4).to_dict("records"), page_count
+
+
+@span("table.leaderboard")
+def as_leaderboard(df: pd.DataFrame, model_regionalisation: str) -> html.Div:
+    """
+    Table of the skill scores of every scored gauge, ranked by KGE.
+
+    Paging, sorting and filtering are done server-side by
+    callbacks.update_leaderboard_page.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        skill.SkillScores.leaderboard of the regionalisation model.
+    model_regionalisation: str
+        Regionalisation model that was scored.
+
+    Returns
+    -------
+    html.Div
+        Description and table
+    """
+    data, page_count = leaderboard_page(df)
+    return html.Div(
+        [
+            html.P(
+                f"{len(df)} gauges scored against their observations with the "
+                f"{model_regionalisation} regionalisation model, best KGE first",
+                style={"margin-top": "1rem"},
+            ),
+            dash_table.DataTable(
+                id="leaderboard-table",
+                columns=[
+                    dict(
+                        id=k,
+                        name=name,
+                        type="text" if k == "GAGEID" else "numeric",
+                    )
+                    for k, name in LEADERBOARD_COLUMNS.items()
+                ],
+                data=data,
+                page_current=0,
+                page_size=TABLE_PAGE_SIZE,
+                page_count=page_count,
+                page_action="custom",
+                sort_action="custom",
+                sort_mode="multi",
+                sort_by=[],
+                filter_action="custom",
+                filter_query="",
+                style_table={"overflowX": "auto"},
+            ),
+        ]
+    )
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import os
+import threading
+import time
+import numpy as np
+
+# typing imports
+from typing import Any, Dict
+
+# local imports
+import datastore
+import engine
+import mapview
+import precompute
+import skill
+import spatialindex
+from logging_config import get_logger
+
+
+# instantiate logger
+logger = get_logger(__name__)
+
+
+# "sync" warms up while the app is imported, which with gunicorn's
+# preload_app happens in the master so that the workers share the loaded
+# datasets; "background" warms up in a thread of each worker; "off" loads
+# everything on first use.
+WARMUP = os.environ.get("QTWSA_WARMUP", "background")
+
+_state = dict(ready=False, started=None, seconds=None, error=None)  # type: Dict[str, Any]
+_state_lock = threading.Lock()
+
+
+def _touch(values: np.ndarray):
+    # read every page of a memory-mapped array into the page cache
+    if values.size:
+        np.asarray(values).reshape(-1)[:: max(4096 // values.itemsize, 1)].sum()
+
+
+def load_caches():
+    """
+    Loads the datasets served by the app: gauge datasets, map points and
+    their spatial index, precomputed partitions, skill scores and discharge
+    map frames, and pages memory-mapped arrays in. Whatever is loaded
+    already is kept, so this also reloads what datawatch invalidated.
+    """
+    store = datastore.get_store()
+    for values in (store.twsa_values, store.obs_months, store.obs_q):
+        _touch(values)
+    mapview.get_map_points()
+    spatialindex.get_index()
+    for combination in precompute.combinations(store):
+        partition = precompute.get_partition(*combination)
+        if partition is not None:
+            _touch(partition.q_pred)
+    for model in engine.regionalisation_models(store):
+        skill.get_scores(model)
+        for model_temporal_feasibility in engine.TEMPORAL_MODELS:
+            mapview.get_discharge_frames(model, model_temporal_feasibility)
+
+
+def warm_up():
+    """
+    Runs load_caches once per process and records its outcome for the
+    readiness route.
+    """
+    with _state_lock:
+        if _state["started"] is not None:
+            return
+        _state["started"] = time.time()
+    start = time.perf_counter()
+    try:
+        load_caches()
+    except Exception as e:
+        # the app still serves, loading on first use
+        logger.exception("Warm-up failed")
+        _state["error"] = f"{type(e).__name__}: {e}"
+    _state["seconds"] = time.perf_counter() - start
+    _state["ready"] = True
+    logger.info(f"Warm-up done in {_state['seconds']:.2f} s")
+
+
+def start(mode: str = WARMUP):
+    """
+    Starts the warm-up according to `mode`, see WARMUP.
+    """
+    if mode == "sync":
+        warm_up()
+    elif mode == "background":
+        threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+    else:
+        _state["ready"] = True
+
+
+def status() -> Dict[str, Any]:
+    """
+    Warm-up state of this process.
+    """
+    return dict(_state, pid=os.getpid())
+
+
+def register_readiness_route(server, path: str = "/ready"):
+    """
+    Adds a readiness route to the Flask server, answering 200 once the
+    warm-up of the worker is done and 503 before.
+
+    Parameters
+    ----------
+    server: flask.Flask
+        The app's Flask server.
+    path: str
+        URL of the route.
+    """
+    from flask import jsonify
+
+    def ready():
+        state = status()
+        return jsonify(state), 200 if state["ready"] else 503
+
+    server.add_url_rule(path, "ready", ready)